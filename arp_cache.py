@@ -41,16 +41,29 @@
 #
 
 
-import time
+import math
+import threading
+from collections import deque
 
 import loguru
 
+import config
 import ps_arp
+import ps_ether
+import ps_ip4
 import stack
 from ipv4_address import IPv4Address
+from mac_address import MAC_BROADCAST, MAC_UNSPECIFIED
 
 ARP_ENTRY_MAX_AGE = 3600
 ARP_ENTRY_REFRESH_TIME = 300
+ARP_RESOLUTION_TIMEOUT = 1000  # Delay between consecutive ARP requests sent for unresolved address
+ARP_RESOLUTION_RETRIES = 3  # Number of ARP requests resent for unresolved address before packets held for it are dropped
+
+# Maximum number of packets held for unresolved address, it fits all the fragments of maximum size IPv4 datagram, the oldest one gets dropped once it fills up
+ARP_PENDING_QUEUE_LEN = math.ceil(
+    (0xFFFF - ps_ip4.IP4_HEADER_LEN) / ((config.mtu - ps_ether.ETHER_HEADER_LEN - ps_ip4.IP4_HEADER_LEN) & 0b1111111111111000)
+)
 
 
 class ArpCache:
@@ -62,8 +75,18 @@ class ArpCache:
         def __init__(self, mac_address, permanent=False):
             self.mac_address = mac_address
             self.permanent = permanent
-            self.creation_time = time.time()
+            self.creation_time = stack.clock.time()
             self.hit_count = 0
+            self.timer_refresh = None
+            self.timer_expire = None
+
+    class PendingEntry:
+        """ Container class for packets held while their destination is being resolved """
+
+        def __init__(self, timer_retry):
+            self.packets = deque(maxlen=ARP_PENDING_QUEUE_LEN)
+            self.retries = 0
+            self.timer_retry = timer_retry
 
     def __init__(self, packet_handler):
         """ Class constructor """
@@ -71,53 +94,128 @@ class ArpCache:
         self.packet_handler = packet_handler
 
         self.arp_cache = {}
+        self.pending = {}
+        self.lock_pending = threading.Lock()  # Used to ensure that packets held for the address get sent out or dropped together with its pending entry
 
         self.logger = loguru.logger.bind(object_name="arp_cache.")
 
-        # Setup timer to execute ARP Cache maintainer every second
-        stack.timer.register_method(method=self.maintain_cache, delay=1000)
-
         self.logger.debug("Started ARP cache")
 
-    def maintain_cache(self):
-        """ Method responsible for maintaining ARP cache entries """
-
-        for ip4_address in list(self.arp_cache):
-
-            # Skip permanent entries
-            if self.arp_cache[ip4_address].permanent:
-                continue
-
-            # If entry age is over maximum age then discard the entry
-            if time.time() - self.arp_cache[ip4_address].creation_time > ARP_ENTRY_MAX_AGE:
-                mac_address = self.arp_cache.pop(ip4_address).mac_address
-                self.logger.debug(f"Discarded expired ARP cache entry - {ip4_address} -> {mac_address}")
-
-            # If entry age is close to maximum age but the entry has been used since last refresh then send out request in attempt to refresh it
-            elif (time.time() - self.arp_cache[ip4_address].creation_time > ARP_ENTRY_MAX_AGE - ARP_ENTRY_REFRESH_TIME) and self.arp_cache[
-                ip4_address
-            ].hit_count:
-                self.arp_cache[ip4_address].hit_count = 0
-                self.__send_arp_request(ip4_address)
-                self.logger.debug(f"Trying to refresh expiring ARP cache entry for {ip4_address} -> {self.arp_cache[ip4_address].mac_address}")
-
-    def add_entry(self, ip4_address, mac_address):
-        """ Add / refresh entry in cache """
-
-        self.arp_cache[ip4_address] = self.CacheEntry(mac_address)
-
-    def find_entry(self, ip4_address):
-        """ Find entry in cache and return MAC address """
+    def __expire_entry(self, ip4_address):
+        """ Entry expiry timer handler, discard the entry """
+
+        # Entry may have just got refreshed while timer was firing
+        if not (arp_entry := self.arp_cache.get(ip4_address, None)) or arp_entry.timer_expire.active:
+            return
+
+        del self.arp_cache[ip4_address]
+        self.packet_handler.flush_tx_caches()
+        self.logger.debug(f"Discarded expired ARP cache entry - {ip4_address} -> {arp_entry.mac_address}")
+
+    def __refresh_entry(self, ip4_address):
+        """ Entry refresh timer handler, if entry has been used since it was created then send out request in attempt to refresh it """
+
+        if (arp_entry := self.arp_cache.get(ip4_address, None)) and arp_entry.hit_count:
+            arp_entry.hit_count = 0
+            self.__send_arp_request(ip4_address)
+            self.logger.debug(f"Trying to refresh expiring ARP cache entry for {ip4_address} -> {arp_entry.mac_address}")
+
+    def add_entry(self, ip4_address, mac_address, sync=True):
+        """ Add / refresh entry in cache, sync means to share the entry with other workers serving multi-queue TAP interface """
+
+        mac_changed = False
+
+        with self.lock_pending:
+            # Existing entry gets refreshed in place together with its timers
+            if arp_entry := self.arp_cache.get(ip4_address, None):
+                arp_entry.timer_refresh.reset()
+                arp_entry.timer_expire.reset()
+                arp_entry.creation_time = stack.clock.time()
+                mac_changed = arp_entry.mac_address != mac_address
+                arp_entry.mac_address = mac_address
+
+            else:
+                arp_entry = self.CacheEntry(mac_address)
+                arp_entry.timer_refresh = stack.timer.register_timer(
+                    method=self.__refresh_entry, args=[ip4_address], delay=(ARP_ENTRY_MAX_AGE - ARP_ENTRY_REFRESH_TIME) * 1000
+                )
+                arp_entry.timer_expire = stack.timer.register_timer(method=self.__expire_entry, args=[ip4_address], delay=ARP_ENTRY_MAX_AGE * 1000)
+                self.arp_cache[ip4_address] = arp_entry
+
+            pending_entry = self.pending.pop(ip4_address, None)
+
+        # Transmit caches hold on to the entry, they need to be flushed only when its MAC address changes
+        if mac_changed:
+            self.packet_handler.flush_tx_caches()
+
+        if sync and self.packet_handler.state_sync:
+            self.packet_handler.state_sync.publish_arp_entry(ip4_address, mac_address)
+
+        # Send out packets that have been waiting for the address to get resolved
+        if pending_entry:
+            pending_entry.timer_retry.cancel()
+            self.logger.debug(f"Resolved {ip4_address} -> {mac_address}, sending out {len(pending_entry.packets)} held packet(s)")
+            while pending_entry.packets:
+                ether_packet_tx = pending_entry.packets.popleft()
+                ether_packet_tx.ether_dst = mac_address
+                ether_packet_tx.drop_raw_packet()
+                self.packet_handler.tx_ring.enqueue(ether_packet_tx)
+
+    def __retry_resolution(self, ip4_address):
+        """ Resolution retry timer handler, resend ARP request or give up and drop packets held for the address once retries run out """
+
+        with self.lock_pending:
+            # Address may have just got resolved while timer was firing
+            if (pending_entry := self.pending.get(ip4_address, None)) is None:
+                return
+
+            # Give up once retries run out
+            if retry := pending_entry.retries < ARP_RESOLUTION_RETRIES:
+                pending_entry.retries += 1
+                pending_entry.timer_retry.reset()
+            else:
+                del self.pending[ip4_address]
+
+        if retry:
+            self.__send_arp_request(ip4_address)
+            self.logger.debug(f"Resent ARP request for {ip4_address}, retry {pending_entry.retries}")
+            return
+
+        self.logger.warning(f"Unable to resolve {ip4_address}, dropped {len(pending_entry.packets)} held packet(s)")
+
+    def find_entry(self, ip4_address, ether_packet_tx=None):
+        """ Find entry in cache and return it, on miss hold the packet (if provided) until address gets resolved """
 
         if arp_entry := self.arp_cache.get(ip4_address, None):
             arp_entry.hit_count += 1
             self.logger.debug(
-                f"Found {ip4_address} -> {arp_entry.mac_address} entry, age {time.time() - arp_entry.creation_time:.0f}s, hit_count {arp_entry.hit_count}"
+                f"Found {ip4_address} -> {arp_entry.mac_address} entry, age {stack.clock.time() - arp_entry.creation_time:.0f}s, "
+                + f"hit_count {arp_entry.hit_count}"
             )
-            return arp_entry.mac_address
+            return arp_entry
+
+        with self.lock_pending:
+            # Entry may have just been added by packet handler RX thread
+            if arp_entry := self.arp_cache.get(ip4_address, None):
+                arp_entry.hit_count += 1
+                return arp_entry
+
+            # Start resolution unless there is one already in progress, its timer is created before the entry gets published so it can be always cancelled
+            if request := ip4_address not in self.pending:
+                timer_retry = stack.timer.register_timer(method=self.__retry_resolution, args=[ip4_address], delay=ARP_RESOLUTION_TIMEOUT)
+                self.pending[ip4_address] = self.PendingEntry(timer_retry)
+
+            if ether_packet_tx:
+                packets = self.pending[ip4_address].packets
+                if len(packets) == packets.maxlen:
+                    self.logger.debug(f"{packets[0].tracker} - Too many packets held until {ip4_address} gets resolved, droping the oldest one...")
+                packets.append(ether_packet_tx)
+                self.logger.debug(f"{ether_packet_tx.tracker} - Holding packet until {ip4_address} gets resolved")
+
+        if request:
+            self.logger.debug(f"Unable to find entry for {ip4_address}, sending ARP request")
+            self.__send_arp_request(ip4_address)
 
-        self.logger.debug(f"Unable to find entry for {ip4_address}, sending ARP request")
-        self.__send_arp_request(ip4_address)
         return None
 
     def __send_arp_request(self, arp_tpa):
@@ -125,10 +223,10 @@ class ArpCache:
 
         self.packet_handler.phtx_arp(
             ether_src=self.packet_handler.mac_unicast,
-            ether_dst="ff:ff:ff:ff:ff:ff",
+            ether_dst=MAC_BROADCAST,
             arp_oper=ps_arp.ARP_OP_REQUEST,
             arp_sha=self.packet_handler.mac_unicast,
             arp_spa=self.packet_handler.ip4_unicast[0] if self.packet_handler.ip4_unicast else IPv4Address("0.0.0.0"),
-            arp_tha="00:00:00:00:00:00",
+            arp_tha=MAC_UNSPECIFIED,
             arp_tpa=arp_tpa,
         )
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyTCP - Python TCP/IP stack                                             #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyTCP                   #
+#                                                                          #
+############################################################################
+
+##############################################################################################
+#                                                                                            #
+#  This program is a work in progress and it changes on daily basis due to new features      #
+#  being implemented, changes being made to already implemented features, bug fixes, etc.    #
+#  Therefore if the current version is not working as expected try to clone it again the     #
+#  next day or shoot me an email describing the problem. Any input is appreciated. Also      #
+#  keep in mind that some features may be implemented only partially (as needed for stack    #
+#  operation) or they may be implemented in sub-optimal or not 100% RFC compliant way (due   #
+#  to lack of time) or last but not least they may contain bug(s) that i didn't notice yet.  #
+#                                                                                            #
+##############################################################################################
+
+
+#
+# clock.py - module contains classes supplying time source for the stack components
+#
+
+
+import time
+
+
+class Clock:
+    """ System clock, used by the stack in normal operation """
+
+    simulated = False
+
+    def __init__(self):
+        """ Class constructor """
+
+        self.timer = None  # Timer driven by this clock
+
+    def time(self):
+        """ Wall clock time in seconds """
+
+        return time.time()
+
+    def monotonic(self):
+        """ Monotonic time in seconds, used to calculate timer deadlines """
+
+        return time.monotonic()
+
+    def sleep(self, delay):
+        """ Suspend caller for given number of seconds """
+
+        time.sleep(delay)
+
+    def acquire(self, semaphore, timeout=None):
+        """ Acquire semaphore, wait no longer than given number of seconds """
+
+        return semaphore.acquire(timeout=timeout)
+
+
+class SimulatedClock:
+    """ Virtual clock for deterministic simulation, its time moves forward only when timer's simulation driver jumps to the next deadline """
+
+    simulated = True
+
+    def __init__(self, start_time=0.0):
+        """ Class constructor, start_time is the wall clock time reported at the start of simulation """
+
+        self.timer = None  # Timer driven by this clock
+        self.start_time = start_time
+        self.now = 0.0
+
+    def time(self):
+        """ Virtual wall clock time in seconds """
+
+        return self.start_time + self.now
+
+    def monotonic(self):
+        """ Virtual time in seconds elapsed since the start of simulation """
+
+        return self.now
+
+    def sleep(self, delay):
+        """ Jump given number of seconds forward, executing all timer tasks that expire in the meantime """
+
+        self.timer.run_until(self.now + delay)
+
+    def acquire(self, semaphore, timeout=None):
+        """ Acquire semaphore, executing timer tasks one deadline at a time until it gets released or timeout passes,
+        waiting with no timeout raises RuntimeError if there is no task left that could release the semaphore as it would never return """
+
+        deadline = None if timeout is None else self.now + timeout
+
+        while not semaphore.acquire(blocking=False):
+            if not self.timer.run_next(deadline):
+                if deadline is None:
+                    raise RuntimeError(f"Simulation deadlock at {self.now:.3f}s, waiting for event with no timer task left to be executed")
+                self.now = max(self.now, deadline)
+                return semaphore.acquire(blocking=False)
+
+        return True
@@ -47,6 +47,12 @@ from ipv6_address import IPv6Interface
 # TAP interface name stack should bind itself to
 interface = b"tap7"
 
+# Link backend, 'tap' creates / attaches to TAP interface, 'packet_mmap' attaches to existing interface (eg. veth or physical one)
+# through AF_PACKET socket using memory mapped TPACKET_V3 rings, 'pair' runs second stack in separate process and connects both of them
+# back-to-back through Unix socket pair, 'sim' runs both stacks in single process on virtual clock as deterministic simulation, TAP offloads and multiple queues
+# are supported by 'tap' backend only
+link_backend = "tap"
+
 # Support for IPv6 and IPv4, at least one should be anabled
 ip6_support = True
 ip4_support = True
@@ -129,6 +135,52 @@ UDP_EPHEMERAL_PORT_RANGE = (32168, 60999)
 
 mtu = 1500  # TAP interface MTU
 
+# RX / TX ring depth, packets arriving to the full ring are dropped according to the ring drop policy
+rx_ring_depth = 1024
+tx_ring_depth = 1024
+
+# Ring drop policy, 'tail' drops packet arriving to the full ring (unless it's urgent and can replace queued normal one),
+# 'head' drops the oldest queued packet to make room for the new one
+ring_drop_policy = "tail"
+
+# Maximum number of frames RX ring reads from TAP interface per wakeup and packet handler processes as single batch
+rx_batch_size = 64
+
+# Maximum number of frames TX ring hands over to link backend as single batch
+tx_batch_size = 64
+
+# Open TAP interface with virtio-net header (IFF_VNET_HDR) and let kernel handle TCP/UDP checksums and TCP segmentation (TSO), checksums
+# of inbound packets validated by kernel are trusted and not computed again
+tap_vnet_hdr = False
+
+# Number of TAP interface queues (IFF_MULTI_QUEUE), when more than one each queue is served by its own worker process that owns TCP sessions
+# and UDP sockets of flows kernel hashes to that queue, ARP / ICMPv6 ND cache entries and address configuration are shared between workers
+tap_queues = 1
+
+# Maximum amount of TCP data sent out as single super-segment for kernel to split into MSS sized segments, when TAP offloads are enabled
+tap_tso_max_size = 65000
+
+# Impairments of 'pair' and 'sim' link backends, applied to frames sent out by each of the stacks. Bandwidth is in bits per second
+# (0 means unlimited), delay is one way propagation delay in ms, loss is the probability of frame being lost and reorder is the probability
+# of frame being held back by reorder delay (ms) so the frames sent after it overtake it. Frames sent out while queue depth worth of frames
+# is in flight are dropped
+link_pair_bandwidth = 0
+link_pair_delay = 0
+link_pair_loss = 0.0
+link_pair_reorder = 0.0
+link_pair_reorder_delay = 10
+link_pair_queue_depth = 1024
+
+# Seed of random number generator 'sim' link backend simulation runs with, the same configuration and seed always produce the same run,
+# amount of data simulation transfers to peer stack and back over TCP
+link_sim_seed = 0
+link_sim_transfer_size = 1000000
+
+# Addressing of the peer stack 'pair' and 'sim' link backends connect this one to
+link_pair_peer_mac_address = "02:00:00:88:88:88"
+link_pair_peer_ip6_address_candidate = [("FE80::8/64", None)]
+link_pair_peer_ip4_address_candidate = [("192.168.9.8/24", "192.168.9.1")]
+
 local_tcp_mss = 1460  # Maximum segment peer can send to us
 local_tcp_win = 65535  # Maximum amount of data peer can send to us without confirmation
 
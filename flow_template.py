@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyTCP - Python TCP/IP stack                                             #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyTCP                   #
+#                                                                          #
+############################################################################
+
+##############################################################################################
+#                                                                                            #
+#  This program is a work in progress and it changes on daily basis due to new features      #
+#  being implemented, changes being made to already implemented features, bug fixes, etc.    #
+#  Therefore if the current version is not working as expected try to clone it again the     #
+#  next day or shoot me an email describing the problem. Any input is appreciated. Also      #
+#  keep in mind that some features may be implemented only partially (as needed for stack    #
+#  operation) or they may be implemented in sub-optimal or not 100% RFC compliant way (due   #
+#  to lack of time) or last but not least they may contain bug(s) that i didn't notice yet.  #
+#                                                                                            #
+##############################################################################################
+
+
+#
+# flow_template.py - module contains class supporting per-flow header templates used by TCP / UDP transmit path
+#
+
+
+import struct
+
+import ps_ether
+import ps_ip4
+import ps_ip6
+import ps_tcp
+import ps_udp
+from ip_helper import inet_cksum, inet_sum
+
+# Maximum number of flow templates kept by packet handler, the whole cache gets flushed once it fills up
+FLOW_TEMPLATE_CACHE_SIZE = 1024
+
+
+class FlowTemplate:
+    """ Prebuilt Ethernet, IP and TCP / UDP headers of single outbound flow, frames of the flow are assembled by patching just the fields that vary """
+
+    def __init__(self, ether_packet_tx, ether_dst_cache):
+        """ Class constructor, template is captured from the first frame of the flow that has been fully built and had its destination resolved """
+
+        ip_packet_tx = ether_packet_tx.child_packet
+        l4_packet_tx = ip_packet_tx.child_packet
+
+        self.ip_version = 4 if ip_packet_tx.protocol == "IPv4" else 6
+
+        # ARP / ND cache entry the destination MAC came from gets hits of the flow accounted so it keeps being refreshed
+        ip_src, ip_dst = (ip_packet_tx.ip4_src, ip_packet_tx.ip4_dst) if self.ip_version == 4 else (ip_packet_tx.ip6_src, ip_packet_tx.ip6_dst)
+        self.neighbor_entry = ether_dst_cache.get((ip_src, ip_dst), (None, None))[1]
+
+        self.protocol = l4_packet_tx.protocol
+        self.l4_hptr = ps_ether.ETHER_HEADER_LEN + (ip_packet_tx.ip4_hlen if self.ip_version == 4 else ps_ip6.IP6_HEADER_LEN)
+        self.hlen = self.l4_hptr + (ps_tcp.TCP_HEADER_LEN if self.protocol == "TCP" else ps_udp.UDP_HEADER_LEN)
+
+        # Fields that vary from frame to frame are zeroed in the template so they can be added to precomputed sums later
+        self.header = bytearray(ether_packet_tx.get_raw_packet()[: self.hlen])
+        self.header[self.l4_hptr + 4 : self.hlen] = bytes(self.hlen - self.l4_hptr - 4)
+
+        if self.ip_version == 4:
+            struct.pack_into("!HH", self.header, ps_ether.ETHER_HEADER_LEN + 2, 0, 0)
+            struct.pack_into("!H", self.header, ps_ether.ETHER_HEADER_LEN + ps_ip4.IP4_CKSUM_OFFSET, 0)
+            self.ip4_header_sum = inet_sum(memoryview(self.header)[ps_ether.ETHER_HEADER_LEN : self.l4_hptr])
+            self.pseudo_header_sum = inet_sum(
+                ps_ip4.IP4_PSEUDO_HEADER_STRUCT.pack(ip_packet_tx.ip4_src.packed, ip_packet_tx.ip4_dst.packed, 0, ip_packet_tx.ip4_proto, 0)
+            )
+        else:
+            struct.pack_into("!H", self.header, ps_ether.ETHER_HEADER_LEN + 4, 0)
+            self.pseudo_header_sum = inet_sum(
+                ps_ip6.IP6_PSEUDO_HEADER_STRUCT.pack(ip_packet_tx.ip6_src.packed, ip_packet_tx.ip6_dst.packed, 0, 0, 0, 0, ip_packet_tx.ip6_next)
+            )
+
+    def __assemble_frame(self, ip4_packet_id, raw_data):
+        """ Create frame out of template and payload, patch IP header fields """
+
+        frame = bytearray(self.hlen + len(raw_data))
+        frame[: self.hlen] = self.header
+        frame[self.hlen :] = raw_data
+
+        ip_plen = len(frame) - ps_ether.ETHER_HEADER_LEN
+
+        # IPv4 header checksum is just the precomputed sum of constant fields adjusted by total length and packet id
+        if self.ip_version == 4:
+            struct.pack_into("!HH", frame, ps_ether.ETHER_HEADER_LEN + 2, ip_plen, ip4_packet_id)
+            struct.pack_into(
+                "!H", frame, ps_ether.ETHER_HEADER_LEN + ps_ip4.IP4_CKSUM_OFFSET, inet_cksum(b"", self.ip4_header_sum + ip_plen + ip4_packet_id)
+            )
+        else:
+            struct.pack_into("!H", frame, ps_ether.ETHER_HEADER_LEN + 4, ip_plen - ps_ip6.IP6_HEADER_LEN)
+
+        return frame
+
+    def assemble_tcp(self, ip4_packet_id, tcp_seq, tcp_ack, tcp_flags, tcp_win, tcp_urp, raw_data):
+        """ Assemble TCP frame of the flow, tcp_flags carries NS flag in its ninth bit """
+
+        frame = self.__assemble_frame(ip4_packet_id, raw_data)
+
+        struct.pack_into(
+            "! L L BBH 2x H", frame, self.l4_hptr + 4, tcp_seq, tcp_ack, ps_tcp.TCP_HEADER_LEN << 2 | tcp_flags >> 8, tcp_flags & 0xFF, tcp_win, tcp_urp
+        )
+        tcp_plen = len(frame) - self.l4_hptr
+        struct.pack_into(
+            "!H", frame, self.l4_hptr + ps_tcp.TCP_CKSUM_OFFSET, inet_cksum(memoryview(frame)[self.l4_hptr :], self.pseudo_header_sum + tcp_plen)
+        )
+
+        return frame
+
+    def assemble_udp(self, ip4_packet_id, raw_data):
+        """ Assemble UDP frame of the flow """
+
+        frame = self.__assemble_frame(ip4_packet_id, raw_data)
+
+        udp_plen = len(frame) - self.l4_hptr
+        struct.pack_into("!H", frame, self.l4_hptr + 4, udp_plen)
+        struct.pack_into(
+            "!H", frame, self.l4_hptr + ps_udp.UDP_CKSUM_OFFSET, inet_cksum(memoryview(frame)[self.l4_hptr :], self.pseudo_header_sum + udp_plen)
+        )
+
+        return frame
+
+
+class FlowFrame:
+    """ Outbound frame assembled out of flow template, provides the interface TX ring uses with Ethernet packets """
+
+    def __init__(self, raw_packet, tracker):
+        """ Class constructor """
+
+        self.raw_packet = raw_packet
+        self.tracker = tracker
+        self.vnet_hdr = None
+
+    def __len__(self):
+        """ Length of the frame """
+
+        return len(self.raw_packet)
+
+    def get_raw_packet(self):
+        """ Get frame in raw format """
+
+        return self.raw_packet
@@ -41,7 +41,8 @@
 #
 
 
-import time
+import threading
+from collections import deque
 
 import loguru
 
@@ -51,6 +52,9 @@ from ipv6_address import IPv6Address
 
 ND_ENTRY_MAX_AGE = 3600
 ND_ENTRY_REFRESH_TIME = 300
+ND_RESOLUTION_TIMEOUT = 1000  # Delay between consecutive Neighbor Solicitations sent for unresolved address
+ND_RESOLUTION_RETRIES = 3  # Number of Neighbor Solicitations resent for unresolved address before packets held for it are dropped
+ND_PENDING_QUEUE_LEN = 8  # Maximum number of packets held for unresolved address, the oldest one gets dropped once it fills up
 
 
 class ICMPv6NdCache:
@@ -62,8 +66,18 @@ class ICMPv6NdCache:
         def __init__(self, mac_address, permanent=False):
             self.mac_address = mac_address
             self.permanent = permanent
-            self.creation_time = time.time()
+            self.creation_time = stack.clock.time()
             self.hit_count = 0
+            self.timer_refresh = None
+            self.timer_expire = None
+
+    class PendingEntry:
+        """ Container class for packets held while their destination is being resolved """
+
+        def __init__(self, timer_retry):
+            self.packets = deque(maxlen=ND_PENDING_QUEUE_LEN)
+            self.retries = 0
+            self.timer_retry = timer_retry
 
     def __init__(self, packet_handler):
         """ Class constructor """
@@ -71,51 +85,128 @@ class ICMPv6NdCache:
         self.packet_handler = packet_handler
 
         self.nd_cache = {}
+        self.pending = {}
+        self.lock_pending = threading.Lock()  # Used to ensure that packets held for the address get sent out or dropped together with its pending entry
 
         self.logger = loguru.logger.bind(object_name="icmp6_nd_cache.")
 
-        # Setup timer to execute ND Cache maintainer every second
-        stack.timer.register_method(method=self.maintain_cache, delay=1000)
-
         self.logger.debug("Started ICMPv6 Neighbor Discovery cache")
 
-    def maintain_cache(self):
-        """ Method responsible for maintaining ND cache entries """
-
-        for ip6_address in list(self.nd_cache):
-
-            # Skip permanent entries
-            if self.nd_cache[ip6_address].permanent:
-                continue
-
-            # If entry age is over maximum age then discard the entry
-            if time.time() - self.nd_cache[ip6_address].creation_time > ND_ENTRY_MAX_AGE:
-                mac_address = self.nd_cache.pop(ip6_address).mac_address
-                self.logger.debug(f"Discarded expired ICMPv6 ND cache entry - {ip6_address} -> {mac_address}")
-
-            # If entry age is close to maximum age but the entry has been used since last refresh then send out request in attempt to refresh it
-            elif (time.time() - self.nd_cache[ip6_address].creation_time > ND_ENTRY_MAX_AGE - ND_ENTRY_REFRESH_TIME) and self.nd_cache[ip6_address].hit_count:
-                self.nd_cache[ip6_address].hit_count = 0
-                self.__send_icmp6_neighbor_solicitation(ip6_address)
-                self.logger.debug(f"Trying to refresh expiring ICMPv6 ND cache entry for {ip6_address} -> {self.nd_cache[ip6_address].mac_address}")
-
-    def add_entry(self, ip6_address, mac_address):
-        """ Add / refresh entry in cache """
-
-        self.nd_cache[ip6_address] = self.CacheEntry(mac_address)
-
-    def find_entry(self, ip6_address):
-        """ Find entry in cache and return MAC address """
+    def __expire_entry(self, ip6_address):
+        """ Entry expiry timer handler, discard the entry """
+
+        # Entry may have just got refreshed while timer was firing
+        if not (nd_entry := self.nd_cache.get(ip6_address, None)) or nd_entry.timer_expire.active:
+            return
+
+        del self.nd_cache[ip6_address]
+        self.packet_handler.flush_tx_caches()
+        self.logger.debug(f"Discarded expired ICMPv6 ND cache entry - {ip6_address} -> {nd_entry.mac_address}")
+
+    def __refresh_entry(self, ip6_address):
+        """ Entry refresh timer handler, if entry has been used since it was created then send out request in attempt to refresh it """
+
+        if (nd_entry := self.nd_cache.get(ip6_address, None)) and nd_entry.hit_count:
+            nd_entry.hit_count = 0
+            self.__send_icmp6_neighbor_solicitation(ip6_address)
+            self.logger.debug(f"Trying to refresh expiring ICMPv6 ND cache entry for {ip6_address} -> {nd_entry.mac_address}")
+
+    def add_entry(self, ip6_address, mac_address, sync=True):
+        """ Add / refresh entry in cache, sync means to share the entry with other workers serving multi-queue TAP interface """
+
+        mac_changed = False
+
+        with self.lock_pending:
+            # Existing entry gets refreshed in place together with its timers
+            if nd_entry := self.nd_cache.get(ip6_address, None):
+                nd_entry.timer_refresh.reset()
+                nd_entry.timer_expire.reset()
+                nd_entry.creation_time = stack.clock.time()
+                mac_changed = nd_entry.mac_address != mac_address
+                nd_entry.mac_address = mac_address
+
+            else:
+                nd_entry = self.CacheEntry(mac_address)
+                nd_entry.timer_refresh = stack.timer.register_timer(
+                    method=self.__refresh_entry, args=[ip6_address], delay=(ND_ENTRY_MAX_AGE - ND_ENTRY_REFRESH_TIME) * 1000
+                )
+                nd_entry.timer_expire = stack.timer.register_timer(method=self.__expire_entry, args=[ip6_address], delay=ND_ENTRY_MAX_AGE * 1000)
+                self.nd_cache[ip6_address] = nd_entry
+
+            pending_entry = self.pending.pop(ip6_address, None)
+
+        # Transmit caches hold on to the entry, they need to be flushed only when its MAC address changes
+        if mac_changed:
+            self.packet_handler.flush_tx_caches()
+
+        if sync and self.packet_handler.state_sync:
+            self.packet_handler.state_sync.publish_nd_entry(ip6_address, mac_address)
+
+        # Send out packets that have been waiting for the address to get resolved
+        if pending_entry:
+            pending_entry.timer_retry.cancel()
+            self.logger.debug(f"Resolved {ip6_address} -> {mac_address}, sending out {len(pending_entry.packets)} held packet(s)")
+            while pending_entry.packets:
+                ether_packet_tx = pending_entry.packets.popleft()
+                ether_packet_tx.ether_dst = mac_address
+                ether_packet_tx.drop_raw_packet()
+                self.packet_handler.tx_ring.enqueue(ether_packet_tx)
+
+    def __retry_resolution(self, ip6_address):
+        """ Resolution retry timer handler, resend Neighbor Solicitation or give up and drop packets held for the address once retries run out """
+
+        with self.lock_pending:
+            # Address may have just got resolved while timer was firing
+            if (pending_entry := self.pending.get(ip6_address, None)) is None:
+                return
+
+            # Give up once retries run out
+            if retry := pending_entry.retries < ND_RESOLUTION_RETRIES:
+                pending_entry.retries += 1
+                pending_entry.timer_retry.reset()
+            else:
+                del self.pending[ip6_address]
+
+        if retry:
+            self.__send_icmp6_neighbor_solicitation(ip6_address)
+            self.logger.debug(f"Resent ICMPv6 Neighbor Solicitation message for {ip6_address}, retry {pending_entry.retries}")
+            return
+
+        self.logger.warning(f"Unable to resolve {ip6_address}, dropped {len(pending_entry.packets)} held packet(s)")
+
+    def find_entry(self, ip6_address, ether_packet_tx=None):
+        """ Find entry in cache and return it, on miss hold the packet (if provided) until address gets resolved """
 
         if nd_entry := self.nd_cache.get(ip6_address, None):
             nd_entry.hit_count += 1
             self.logger.debug(
-                f"Found {ip6_address} -> {nd_entry.mac_address} entry, age {time.time() - nd_entry.creation_time:.0f}s, hit_count {nd_entry.hit_count}"
+                f"Found {ip6_address} -> {nd_entry.mac_address} entry, age {stack.clock.time() - nd_entry.creation_time:.0f}s, "
+                + f"hit_count {nd_entry.hit_count}"
             )
-            return nd_entry.mac_address
+            return nd_entry
+
+        with self.lock_pending:
+            # Entry may have just been added by packet handler RX thread
+            if nd_entry := self.nd_cache.get(ip6_address, None):
+                nd_entry.hit_count += 1
+                return nd_entry
+
+            # Start resolution unless there is one already in progress, its timer is created before the entry gets published so it can be always cancelled
+            if request := ip6_address not in self.pending:
+                timer_retry = stack.timer.register_timer(method=self.__retry_resolution, args=[ip6_address], delay=ND_RESOLUTION_TIMEOUT)
+                self.pending[ip6_address] = self.PendingEntry(timer_retry)
+
+            if ether_packet_tx:
+                packets = self.pending[ip6_address].packets
+                if len(packets) == packets.maxlen:
+                    self.logger.debug(f"{packets[0].tracker} - Too many packets held until {ip6_address} gets resolved, droping the oldest one...")
+                packets.append(ether_packet_tx)
+                self.logger.debug(f"{ether_packet_tx.tracker} - Holding packet until {ip6_address} gets resolved")
+
+        if request:
+            self.logger.debug(f"Unable to find entry for {ip6_address}, sending ICMPv6 Neighbor Solicitation message")
+            self.__send_icmp6_neighbor_solicitation(ip6_address)
 
-        self.logger.debug(f"Unable to find entry for {ip6_address}, sending ICMPv6 Neighbor Solicitation message")
-        self.__send_icmp6_neighbor_solicitation(ip6_address)
         return None
 
     def __send_icmp6_neighbor_solicitation(self, icmp6_ns_target_address):
@@ -41,18 +41,30 @@
 #
 
 
-import struct
 from ipaddress import AddressValueError
 
 from ipv4_address import IPv4Address
 from ipv6_address import IPv6Address
 
 
-def inet_cksum(data):
-    """ Compute Internet Checksum used by IP/TCP/UDP/ICMPv4 protocols """
+def inet_sum(data, init=0):
+    """ Compute one's complement sum of 16 bit words of data, init carries sum of data preceding the buffer (eg. IP pseudo header) """
 
-    data = data + (b"\0" if len(data) & 1 else b"")
-    cksum = sum(struct.unpack(f"! {len(data) >> 1}H", data))
+    # Data is summed as single wide integer, its value modulo 0xFFFF equals to the one's complement sum of its 16 bit words
+    value = int.from_bytes(data, "big") << ((len(data) & 1) << 3)
+    return (value + init) % 0xFFFF or (0xFFFF if value or init else 0)
+
+
+def inet_cksum(data, init=0):
+    """ Compute Internet Checksum used by IP/TCP/UDP/ICMPv4 protocols, init carries sum of data preceding the buffer (eg. IP pseudo header) """
+
+    return ~inet_sum(data, init) & 0xFFFF
+
+
+def inet_cksum_update(cksum, old_word, new_word):
+    """ Update Internet Checksum after one of the 16 bit words it covers got changed, without summing the whole data again (RFC 1624, eqn. 3) """
+
+    cksum = (~cksum & 0xFFFF) + (~old_word & 0xFFFF) + new_word
     cksum = (cksum >> 16) + (cksum & 0xFFFF)
     return ~(cksum + (cksum >> 16)) & 0xFFFF
 
@@ -41,6 +41,10 @@
 #
 
 import ipaddress
+from functools import cached_property
+
+# Maximum number of interned IP addresses, the whole intern cache gets flushed once it fills up
+IP_ADDRESS_CACHE_SIZE = 1024
 
 
 class IPv4Interface(ipaddress.IPv4Interface):
@@ -84,10 +88,59 @@ class IPv4Network(ipaddress.IPv4Network):
 
 
 class IPv4Address(ipaddress.IPv4Address):
-    """ Extensions for ipaddress.IPv4Address class """
+    """ Extensions for ipaddress.IPv4Address class, instances are interned so packets of the same hosts share them """
+
+    __cache = {}
+
+    def __new__(cls, address):
+        """ Class constructor, accepts address as view into packet buffer on top of formats supported by ipaddress library """
+
+        if type(address) is cls:
+            return address
+
+        if isinstance(address, memoryview):
+            address = address.tobytes()
+
+        if (ip4_address := cls.__cache.get(address, None)) is not None:
+            return ip4_address
+
+        ip4_address = super().__new__(cls)
+        ipaddress.IPv4Address.__init__(ip4_address, address)
+
+        if len(cls.__cache) >= IP_ADDRESS_CACHE_SIZE:
+            cls.__cache.clear()
+
+        # Same address given in different formats resolves to single instance
+        ip4_address = cls.__cache.setdefault(int(ip4_address), ip4_address)
+        cls.__cache[address] = ip4_address
+
+        return ip4_address
+
+    def __init__(self, address):
+        """ Address has already been initialized by the constructor """
+
+        pass
+
+    @cached_property
+    def packed(self):
+        """ Address in binary form """
+
+        return int(self).to_bytes(4, "big")
 
     @property
     def is_limited_broadcast(self):
         """ Check if IPv4 address is a limited broadcast """
 
-        return str(self) == "255.255.255.255"
+        return int(self) == 0xFFFFFFFF
+
+    @property
+    def is_multicast(self):
+        """ Check if IPv4 address is a multicast address (224.0.0.0/4) """
+
+        return int(self) >> 28 == 0xE
+
+    @property
+    def is_unspecified(self):
+        """ Check if IPv4 address is unspecified address """
+
+        return int(self) == 0
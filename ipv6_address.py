@@ -41,7 +41,10 @@
 #
 
 import ipaddress
-from re import sub
+from functools import cached_property
+
+from ipv4_address import IP_ADDRESS_CACHE_SIZE
+from mac_address import MacAddress
 
 
 class IPv6Interface(ipaddress.IPv6Interface):
@@ -104,27 +107,74 @@ class IPv6Network(ipaddress.IPv6Network):
 
         assert self.prefixlen == 64
 
-        eui64 = sub(r"[.:-]", "", mac).lower()
-        eui64 = eui64[0:6] + "fffe" + eui64[6:]
-        eui64 = hex(int(eui64[0:2], 16) ^ 2)[2:].zfill(2) + eui64[2:]
-        eui64 = ":".join(eui64[_ : _ + 4] for _ in range(0, 16, 4))
-        return IPv6Interface(self.network_address.exploded[0:20] + eui64 + "/" + str(self.prefixlen))
+        mac = MacAddress(mac)
+        eui64 = bytes([mac[0] ^ 2]) + mac[1:3] + b"\xff\xfe" + mac[3:6]
+        return IPv6Interface((self.network_address.packed[:8] + eui64, self.prefixlen))
 
 
 class IPv6Address(ipaddress.IPv6Address):
-    """ Extensions for ipaddress.IPv6Address class """
+    """ Extensions for ipaddress.IPv6Address class, instances are interned so packets of the same hosts share them """
+
+    __cache = {}
+
+    def __new__(cls, address):
+        """ Class constructor, accepts address as view into packet buffer on top of formats supported by ipaddress library """
+
+        if type(address) is cls:
+            return address
+
+        if isinstance(address, memoryview):
+            address = address.tobytes()
+
+        if (ip6_address := cls.__cache.get(address, None)) is not None:
+            return ip6_address
+
+        ip6_address = super().__new__(cls)
+        ipaddress.IPv6Address.__init__(ip6_address, address)
+
+        if len(cls.__cache) >= IP_ADDRESS_CACHE_SIZE:
+            cls.__cache.clear()
+
+        # Same address given in different formats resolves to single instance
+        ip6_address = cls.__cache.setdefault(int(ip6_address), ip6_address)
+        cls.__cache[address] = ip6_address
+
+        return ip6_address
+
+    def __init__(self, address):
+        """ Address has already been initialized by the constructor """
+
+        pass
+
+    @cached_property
+    def packed(self):
+        """ Address in binary form """
+
+        return int(self).to_bytes(16, "big")
 
     @property
     def solicited_node_multicast(self):
         """ Create IPv6 solicited node multicast address """
 
-        return IPv6Address("ff02::1:ff" + self.exploded[-7:])
+        return IPv6Address(0xFF0200000000000000000001FF000000 | int(self) & 0xFFFFFF)
 
     @property
     def is_solicited_node_multicast(self):
         """ Check if address is IPv6 solicited node multicast address """
 
-        return str(self).startswith("ff02::1:ff")
+        return int(self) >> 24 == 0xFF0200000000000000000001FF
+
+    @property
+    def is_multicast(self):
+        """ Check if address is IPv6 multicast address (ff00::/8) """
+
+        return int(self) >> 120 == 0xFF
+
+    @property
+    def is_unspecified(self):
+        """ Check if address is IPv6 unspecified address """
+
+        return int(self) == 0
 
     @property
     def is_unicast(self):
@@ -138,4 +188,4 @@ class IPv6Address(ipaddress.IPv6Address):
 
         assert self.is_multicast
 
-        return "33:33:" + ":".join(["".join(self.exploded[-9:].split(":"))[_ : _ + 2] for _ in range(0, 8, 2)])
+        return MacAddress(b"\x33\x33" + self.packed[-4:])
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyTCP - Python TCP/IP stack                                             #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyTCP                   #
+#                                                                          #
+############################################################################
+
+##############################################################################################
+#                                                                                            #
+#  This program is a work in progress and it changes on daily basis due to new features      #
+#  being implemented, changes being made to already implemented features, bug fixes, etc.    #
+#  Therefore if the current version is not working as expected try to clone it again the     #
+#  next day or shoot me an email describing the problem. Any input is appreciated. Also      #
+#  keep in mind that some features may be implemented only partially (as needed for stack    #
+#  operation) or they may be implemented in sub-optimal or not 100% RFC compliant way (due   #
+#  to lack of time) or last but not least they may contain bug(s) that i didn't notice yet.  #
+#                                                                                            #
+##############################################################################################
+
+
+#
+# link_backend.py - module contains base class of link layer backends moving Ethernet frames between the stack and the network
+#
+
+
+from abc import ABC, abstractmethod
+
+
+class LinkBackend(ABC):
+    """ Link layer backend interface used by RX and TX rings """
+
+    name = "link"
+
+    @abstractmethod
+    def wait_rx(self):
+        """ Block until there are inbound frames ready to be picked up """
+
+    @abstractmethod
+    def receive_batch(self, max_count):
+        """ Pick up to max_count inbound frames without blocking, return list of (raw_frame, vnet_hdr) tuples, vnet_hdr carries offload information if any """
+
+    @abstractmethod
+    def transmit_batch(self, batch):
+        """ Send out list of (raw_frame, vnet_hdr) tuples, return list of flags telling which frames were sent and which got dropped """
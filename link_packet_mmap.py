@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyTCP - Python TCP/IP stack                                             #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyTCP                   #
+#                                                                          #
+############################################################################
+
+##############################################################################################
+#                                                                                            #
+#  This program is a work in progress and it changes on daily basis due to new features      #
+#  being implemented, changes being made to already implemented features, bug fixes, etc.    #
+#  Therefore if the current version is not working as expected try to clone it again the     #
+#  next day or shoot me an email describing the problem. Any input is appreciated. Also      #
+#  keep in mind that some features may be implemented only partially (as needed for stack    #
+#  operation) or they may be implemented in sub-optimal or not 100% RFC compliant way (due   #
+#  to lack of time) or last but not least they may contain bug(s) that i didn't notice yet.  #
+#                                                                                            #
+##############################################################################################
+
+
+#
+# link_packet_mmap.py - module contains class supporting AF_PACKET link backend using TPACKET_V3 memory mapped RX / TX rings
+#
+
+
+import mmap
+import select
+import socket
+import struct
+
+from link_backend import LinkBackend
+from vnet_hdr import VNET_HDR_F_DATA_VALID, VNET_HDR_F_NEEDS_CSUM, VnetHdr
+
+SOL_PACKET = 263
+PACKET_ADD_MEMBERSHIP = 1
+PACKET_MR_PROMISC = 1
+PACKET_RX_RING = 5
+PACKET_VERSION = 10
+PACKET_TX_RING = 13
+PACKET_QDISC_BYPASS = 20
+
+TPACKET_V3 = 2
+ETH_P_ALL = 0x0003
+
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+TP_STATUS_CSUMNOTREADY = 8
+TP_STATUS_CSUM_VALID = 0x80
+TP_STATUS_AVAILABLE = 0
+TP_STATUS_SEND_REQUEST = 1
+TP_STATUS_SENDING = 2
+TP_STATUS_WRONG_FORMAT = 4
+
+TPACKET3_HDR_LEN = 48  # TPACKET_ALIGN(sizeof(struct tpacket3_hdr)), also offset of frame data in TX ring slot
+
+RX_BLOCK_SIZE = 1 << 18  # RX ring is made of blocks, each of them is handed over to us when full or after timeout
+RX_BLOCK_NR = 64
+RX_FRAME_SIZE = 2048
+RX_BLOCK_TIMEOUT = 1  # ms
+
+TX_BLOCK_SIZE = 1 << 18  # TX ring is made of fixed size slots, one frame each
+TX_BLOCK_NR = 8
+TX_FRAME_SIZE = 2048
+
+RX_RING_SIZE = RX_BLOCK_SIZE * RX_BLOCK_NR
+TX_RING_SIZE = TX_BLOCK_SIZE * TX_BLOCK_NR
+TX_FRAME_NR = TX_RING_SIZE // TX_FRAME_SIZE
+
+TPACKET_REQ3 = struct.Struct("= IIIIIII")  # block_size, block_nr, frame_size, frame_nr, retire_blk_tov, sizeof_priv, feature_req_word
+PACKET_MREQ = struct.Struct("= iHH8s")  # ifindex, type, alen, address
+BLOCK_DESC = struct.Struct("= 8x III")  # block_status, num_pkts, offset_to_first_pkt
+TPACKET3_HDR_RX = struct.Struct("= I 8x I 4x I H")  # tp_next_offset, tp_snaplen, tp_status, tp_mac
+TPACKET3_HDR_TX = struct.Struct("= I 8x II")  # tp_next_offset, tp_snaplen, tp_len
+TP_STATUS = struct.Struct("= I")
+TP_STATUS_OFFSET = 20
+BLOCK_STATUS_OFFSET = 8
+
+
+class PacketMmapLink(LinkBackend):
+    """ Link backend attached to existing interface (eg. veth or physical one) through AF_PACKET socket, frames are exchanged with kernel in
+    blocks straight from memory shared with it, so there is single poll / send syscall per batch of frames instead of read / write per frame """
+
+    name = "packet_mmap"
+
+    def __init__(self, interface):
+        """ Class constructor """
+
+        self.socket = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        self.socket.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+        self.socket.setsockopt(SOL_PACKET, PACKET_QDISC_BYPASS, 1)
+        self.socket.setsockopt(
+            SOL_PACKET,
+            PACKET_RX_RING,
+            TPACKET_REQ3.pack(RX_BLOCK_SIZE, RX_BLOCK_NR, RX_FRAME_SIZE, RX_RING_SIZE // RX_FRAME_SIZE, RX_BLOCK_TIMEOUT, 0, 0),
+        )
+        self.socket.setsockopt(SOL_PACKET, PACKET_TX_RING, TPACKET_REQ3.pack(TX_BLOCK_SIZE, TX_BLOCK_NR, TX_FRAME_SIZE, TX_FRAME_NR, 0, 0, 0))
+        self.socket.bind((interface, ETH_P_ALL))
+
+        # Stack uses its own MAC address so interface needs to pass us frames that are not destined to the host
+        self.socket.setsockopt(SOL_PACKET, PACKET_ADD_MEMBERSHIP, PACKET_MREQ.pack(socket.if_nametoindex(interface), PACKET_MR_PROMISC, 0, b""))
+
+        # Both rings are mapped as single memory region, RX ring goes first
+        self.ring = mmap.mmap(self.socket.fileno(), RX_RING_SIZE + TX_RING_SIZE, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        self.ring_view = memoryview(self.ring)
+
+        self.rx_block = 0
+        self.tx_frame = 0
+
+        self.poller = select.poll()
+        self.poller.register(self.socket, select.POLLIN | select.POLLERR)
+
+    def __rx_block_ready(self):
+        """ Check if the next RX block has been handed over to us by kernel """
+
+        return TP_STATUS.unpack_from(self.ring_view, self.rx_block * RX_BLOCK_SIZE + BLOCK_STATUS_OFFSET)[0] & TP_STATUS_USER
+
+    def wait_rx(self):
+        """ Block until there are inbound frames ready to be picked up """
+
+        while not self.__rx_block_ready():
+            self.poller.poll()
+
+    def receive_batch(self, max_count):
+        """ Pick up inbound frames from RX blocks without blocking, block is always consumed as whole so batch may exceed max_count """
+
+        batch = []
+        while len(batch) < max_count and self.__rx_block_ready():
+            block_offset = self.rx_block * RX_BLOCK_SIZE
+            _, num_pkts, packet_offset = BLOCK_DESC.unpack_from(self.ring_view, block_offset)
+            packet_offset += block_offset
+
+            for _ in range(num_pkts):
+                next_offset, snaplen, status, mac = TPACKET3_HDR_RX.unpack_from(self.ring_view, packet_offset)
+
+                # Locally generated frames (eg. coming from veth peer) may carry partial checksums, same as frames kernel already validated
+                # they are passed up with offload information that lets the stack skip checksum validation
+                if status & TP_STATUS_CSUMNOTREADY:
+                    vnet_hdr = VnetHdr(flags=VNET_HDR_F_NEEDS_CSUM)
+                elif status & TP_STATUS_CSUM_VALID:
+                    vnet_hdr = VnetHdr(flags=VNET_HDR_F_DATA_VALID)
+                else:
+                    vnet_hdr = None
+
+                batch.append((bytes(self.ring_view[packet_offset + mac : packet_offset + mac + snaplen]), vnet_hdr))
+                packet_offset += next_offset
+
+            # Return block to kernel and move to the next one
+            TP_STATUS.pack_into(self.ring_view, block_offset + BLOCK_STATUS_OFFSET, TP_STATUS_KERNEL)
+            self.rx_block = (self.rx_block + 1) % RX_BLOCK_NR
+
+        return batch
+
+    def transmit_batch(self, batch):
+        """ Put batch of frames into TX ring slots and let kernel send them all out with single syscall, frame gets dropped if ring is full """
+
+        sent = []
+        for raw_frame, _ in batch:
+            frame_offset = RX_RING_SIZE + self.tx_frame * TX_FRAME_SIZE
+
+            # Slot still waiting to be sent out by kernel means ring is full
+            if TP_STATUS.unpack_from(self.ring_view, frame_offset + TP_STATUS_OFFSET)[0] & (TP_STATUS_SEND_REQUEST | TP_STATUS_SENDING):
+                sent.append(False)
+                continue
+
+            if len(raw_frame) > TX_FRAME_SIZE - TPACKET3_HDR_LEN:
+                sent.append(False)
+                continue
+
+            self.ring_view[frame_offset + TPACKET3_HDR_LEN : frame_offset + TPACKET3_HDR_LEN + len(raw_frame)] = raw_frame
+            TPACKET3_HDR_TX.pack_into(self.ring_view, frame_offset, 0, len(raw_frame), len(raw_frame))
+            TP_STATUS.pack_into(self.ring_view, frame_offset + TP_STATUS_OFFSET, TP_STATUS_SEND_REQUEST)
+            self.tx_frame = (self.tx_frame + 1) % TX_FRAME_NR
+            sent.append(True)
+
+        # Kick kernel to send out all the frames queued in the ring
+        if any(sent):
+            try:
+                self.socket.send(b"", socket.MSG_DONTWAIT)
+            except BlockingIOError:
+                pass
+
+        return sent
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyTCP - Python TCP/IP stack                                             #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyTCP                   #
+#                                                                          #
+############################################################################
+
+##############################################################################################
+#                                                                                            #
+#  This program is a work in progress and it changes on daily basis due to new features      #
+#  being implemented, changes being made to already implemented features, bug fixes, etc.    #
+#  Therefore if the current version is not working as expected try to clone it again the     #
+#  next day or shoot me an email describing the problem. Any input is appreciated. Also      #
+#  keep in mind that some features may be implemented only partially (as needed for stack    #
+#  operation) or they may be implemented in sub-optimal or not 100% RFC compliant way (due   #
+#  to lack of time) or last but not least they may contain bug(s) that i didn't notice yet.  #
+#                                                                                            #
+##############################################################################################
+
+
+#
+# link_pair.py - module contains class supporting link backend connecting two stacks back-to-back over Unix socket pair, with optional link impairments
+#
+
+
+import heapq
+import itertools
+import random
+import select
+import threading
+import time
+
+import config
+from link_backend import LinkBackend
+
+PAIR_FRAME_SIZE_MAX = 65536
+
+
+class PairLink(LinkBackend):
+    """ Link backend connecting stack to its peer through one end of Unix socket pair, no network interface or root privileges are needed.
+    Frames sent out are subject to impairments (bandwidth, delay, loss, reorder) configured in config.py """
+
+    name = "pair"
+
+    def __init__(self, sock):
+        """ Class constructor, sock is this stack's end of SOCK_SEQPACKET socket pair """
+
+        self.socket = sock
+        self.socket.setblocking(False)
+
+        self.poller = select.poll()
+        self.poller.register(self.socket, select.POLLIN)
+
+        # Frames released from the link wait for room in peer's socket buffer, they are not lost unless loss is configured
+        self.tx_poller = select.poll()
+        self.tx_poller.register(self.socket, select.POLLOUT)
+
+        # Each end draws from its own generator, so peers forked from the same process don't lose / reorder the same frames
+        self.random = random.Random()
+
+        self.shaped = bool(config.link_pair_bandwidth or config.link_pair_delay or config.link_pair_reorder)
+
+        # Heap of (release_time, sequence, raw_frame) entries holding frames that are 'on the wire', link_free_time is when the last of them
+        # finishes serialization at configured bandwidth
+        self.in_flight = []
+        self.in_flight_sequence = itertools.count()
+        self.in_flight_changed = threading.Condition()
+        self.link_free_time = 0.0
+
+        if self.shaped:
+            threading.Thread(target=self.__thread_release).start()
+
+    def __thread_release(self):
+        """ Thread responsible for handing frames over to peer once their release time comes """
+
+        while True:
+            with self.in_flight_changed:
+                now = time.monotonic()
+                if not self.in_flight or self.in_flight[0][0] > now:
+                    self.in_flight_changed.wait(timeout=self.in_flight[0][0] - now if self.in_flight else None)
+                    continue
+
+                released = []
+                while self.in_flight and self.in_flight[0][0] <= now:
+                    released.append(heapq.heappop(self.in_flight)[2])
+
+            for raw_frame in released:
+                while not self.__send(raw_frame):
+                    self.tx_poller.poll()
+
+    def __send(self, raw_frame):
+        """ Hand frame over to peer, return False if peer's socket buffer is full """
+
+        try:
+            self.socket.send(raw_frame)
+        except BlockingIOError:
+            return False
+        return True
+
+    def wait_rx(self):
+        """ Block until there are inbound frames ready to be picked up """
+
+        self.poller.poll()
+
+    def receive_batch(self, max_count):
+        """ Pick up to max_count inbound frames without blocking """
+
+        batch = []
+        for _ in range(max_count):
+            try:
+                batch.append((self.socket.recv(PAIR_FRAME_SIZE_MAX), None))
+            except BlockingIOError:
+                break
+
+        return batch
+
+    def transmit_batch(self, batch):
+        """ Send out batch of frames, frame gets dropped if there is already queue depth worth of frames in flight """
+
+        sent = []
+        for raw_frame, _ in batch:
+
+            # Lost frame still counts as sent, it just never reaches the peer
+            if config.link_pair_loss and self.random.random() < config.link_pair_loss:
+                sent.append(True)
+                continue
+
+            if not self.shaped:
+                sent.append(self.__send(raw_frame))
+                continue
+
+            with self.in_flight_changed:
+                if len(self.in_flight) >= config.link_pair_queue_depth:
+                    sent.append(False)
+                    continue
+
+                # Frame starts serialization once link is done with the previous one, then it takes propagation delay to reach peer
+                now = time.monotonic()
+                self.link_free_time = max(self.link_free_time, now)
+                if config.link_pair_bandwidth:
+                    self.link_free_time += len(raw_frame) * 8 / config.link_pair_bandwidth
+                release_time = self.link_free_time + config.link_pair_delay / 1000
+
+                # Reordered frame is held back long enough for frames sent after it to overtake it
+                if config.link_pair_reorder and self.random.random() < config.link_pair_reorder:
+                    release_time += config.link_pair_reorder_delay / 1000
+
+                heapq.heappush(self.in_flight, (release_time, sequence := next(self.in_flight_sequence), raw_frame))
+                if self.in_flight[0][1] == sequence:
+                    self.in_flight_changed.notify()
+                sent.append(True)
+
+        return sent
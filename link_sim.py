@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyTCP - Python TCP/IP stack                                             #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyTCP                   #
+#                                                                          #
+############################################################################
+
+##############################################################################################
+#                                                                                            #
+#  This program is a work in progress and it changes on daily basis due to new features      #
+#  being implemented, changes being made to already implemented features, bug fixes, etc.    #
+#  Therefore if the current version is not working as expected try to clone it again the     #
+#  next day or shoot me an email describing the problem. Any input is appreciated. Also      #
+#  keep in mind that some features may be implemented only partially (as needed for stack    #
+#  operation) or they may be implemented in sub-optimal or not 100% RFC compliant way (due   #
+#  to lack of time) or last but not least they may contain bug(s) that i didn't notice yet.  #
+#                                                                                            #
+##############################################################################################
+
+
+#
+# link_sim.py - module contains class supporting link backend connecting two stacks running in single process on simulated clock
+#
+
+
+import collections
+import random
+
+import config
+import stack
+from link_backend import LinkBackend
+
+
+class SimLink(LinkBackend):
+    """ Link backend connecting two stacks that run in single process on simulated clock, frames sent out are handed over to peer by timer tasks
+    so they are subject to the same impairments 'pair' link applies (bandwidth, delay, loss, reorder) configured in config.py """
+
+    name = "sim"
+
+    def __init__(self, peer=None):
+        """ Class constructor, link end gets connected to its peer end if one is provided """
+
+        self.peer = None
+        self.inbound = collections.deque()
+
+        # Stack attached to this end of the link, its callback is executed on behalf of it whenever frames arrive
+        self.context = None
+        self.rx_callback = None
+
+        # Each end draws from its own generator, seeded from the one simulation seeds with configured seed, so runs are reproducible
+        self.random = random.Random(random.getrandbits(64))
+
+        # Number of frames that are 'on the wire' and the time the last of them finishes serialization at configured bandwidth
+        self.in_flight = 0
+        self.link_free_time = 0.0
+
+        if peer:
+            self.peer = peer
+            peer.peer = self
+
+    def attach(self, rx_callback):
+        """ Attach stack that is currently in charge to this end of the link """
+
+        self.context = stack.context
+        self.rx_callback = rx_callback
+
+    def wait_rx(self):
+        """ Frames are handed over to the stack as they arrive, there is never anything to wait for """
+
+    def receive_batch(self, max_count):
+        """ Pick up to max_count inbound frames """
+
+        batch = []
+        while self.inbound and len(batch) < max_count:
+            batch.append((self.inbound.popleft(), None))
+
+        return batch
+
+    def transmit_batch(self, batch):
+        """ Send out batch of frames, frame gets dropped if there is already queue depth worth of frames in flight """
+
+        sent = []
+        for raw_frame, _ in batch:
+
+            # Lost frame still counts as sent, it just never reaches the peer
+            if config.link_pair_loss and self.random.random() < config.link_pair_loss:
+                sent.append(True)
+                continue
+
+            if self.in_flight >= config.link_pair_queue_depth:
+                sent.append(False)
+                continue
+
+            # Frame starts serialization once link is done with the previous one, then it takes propagation delay to reach peer
+            now = stack.clock.monotonic()
+            self.link_free_time = max(self.link_free_time, now)
+            if config.link_pair_bandwidth:
+                self.link_free_time += len(raw_frame) * 8 / config.link_pair_bandwidth
+            release_time = self.link_free_time + config.link_pair_delay / 1000
+
+            # Reordered frame is held back long enough for frames sent after it to overtake it
+            if config.link_pair_reorder and self.random.random() < config.link_pair_reorder:
+                release_time += config.link_pair_reorder_delay / 1000
+
+            self.in_flight += 1
+            stack.timer.register_timer(method=self.__release, args=[raw_frame], delay=(release_time - now) * 1000)
+            sent.append(True)
+
+        return sent
+
+    def __release(self, raw_frame):
+        """ Timer task handler, hand frame over to peer once its release time comes, frame is lost if there is no stack attached to peer yet """
+
+        self.in_flight -= 1
+
+        if self.peer is None or self.peer.rx_callback is None:
+            return
+
+        self.peer.inbound.append(raw_frame)
+        context = stack.switch_context(self.peer.context)
+        self.peer.rx_callback()
+        stack.switch_context(context)
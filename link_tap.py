@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyTCP - Python TCP/IP stack                                             #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyTCP                   #
+#                                                                          #
+############################################################################
+
+##############################################################################################
+#                                                                                            #
+#  This program is a work in progress and it changes on daily basis due to new features      #
+#  being implemented, changes being made to already implemented features, bug fixes, etc.    #
+#  Therefore if the current version is not working as expected try to clone it again the     #
+#  next day or shoot me an email describing the problem. Any input is appreciated. Also      #
+#  keep in mind that some features may be implemented only partially (as needed for stack    #
+#  operation) or they may be implemented in sub-optimal or not 100% RFC compliant way (due   #
+#  to lack of time) or last but not least they may contain bug(s) that i didn't notice yet.  #
+#                                                                                            #
+##############################################################################################
+
+
+#
+# link_tap.py - module contains class supporting TAP interface link backend
+#
+
+
+import os
+import select
+
+import config
+import ps_ether
+from link_backend import LinkBackend
+from vnet_hdr import VNET_HDR_LEN, VnetHdr
+
+
+class TapLink(LinkBackend):
+    """ Link backend exchanging frames with kernel through TAP interface (or one of its queues), one read / write syscall per frame """
+
+    name = "tap"
+
+    def __init__(self, tap):
+        """ Class constructor """
+
+        self.tap = tap
+
+        # Switch TAP interface into non-blocking mode so all the frames that are readable at once can be picked up as single batch
+        os.set_blocking(self.tap, False)
+        self.poller = select.poll()
+        self.poller.register(self.tap, select.POLLIN)
+
+        # Frames that kernel can't take right away are not dropped, TX waits for the interface to become writable again instead
+        self.tx_poller = select.poll()
+        self.tx_poller.register(self.tap, select.POLLOUT)
+
+        # With TAP offloads enabled every frame is preceeded by virtio-net header and it can carry TCP super-segment up to 64KB long
+        self.read_size = VNET_HDR_LEN + ps_ether.ETHER_HEADER_LEN + 65535 if config.tap_vnet_hdr else 2048
+
+    def wait_rx(self):
+        """ Block until there are inbound frames ready to be picked up """
+
+        self.poller.poll()
+
+    def receive_batch(self, max_count):
+        """ Pick up to max_count inbound frames without blocking """
+
+        batch = []
+        for _ in range(max_count):
+            try:
+                raw_frame = os.read(self.tap, self.read_size)
+            except BlockingIOError:
+                break
+            if config.tap_vnet_hdr:
+                batch.append((raw_frame[VNET_HDR_LEN:], VnetHdr(raw_frame)))
+            else:
+                batch.append((raw_frame, None))
+
+        return batch
+
+    def transmit_batch(self, batch):
+        """ Send out batch of frames, block until kernel is able to take each of them as TAP interface shares its descriptor with RX in non-blocking mode """
+
+        for raw_frame, vnet_hdr in batch:
+            while True:
+                try:
+                    # With TAP offloads enabled every frame needs to be preceeded by virtio-net header telling kernel which checksum to finish and how to
+                    # segment packet, header is passed along with the frame in single gathered write so frame doesn't need to be copied to make room for it
+                    if config.tap_vnet_hdr:
+                        os.writev(self.tap, [(vnet_hdr or VnetHdr()).raw_header, raw_frame])
+                    else:
+                        os.write(self.tap, raw_frame)
+                    break
+                except BlockingIOError:
+                    self.tx_poller.poll()
+
+        return [True] * len(batch)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyTCP - Python TCP/IP stack                                             #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyTCP                   #
+#                                                                          #
+############################################################################
+
+##############################################################################################
+#                                                                                            #
+#  This program is a work in progress and it changes on daily basis due to new features      #
+#  being implemented, changes being made to already implemented features, bug fixes, etc.    #
+#  Therefore if the current version is not working as expected try to clone it again the     #
+#  next day or shoot me an email describing the problem. Any input is appreciated. Also      #
+#  keep in mind that some features may be implemented only partially (as needed for stack    #
+#  operation) or they may be implemented in sub-optimal or not 100% RFC compliant way (due   #
+#  to lack of time) or last but not least they may contain bug(s) that i didn't notice yet.  #
+#                                                                                            #
+##############################################################################################
+
+
+#
+# mac_address.py - module contains MAC address class
+#
+
+
+# Maximum number of interned MAC addresses, the whole intern cache gets flushed once it fills up
+MAC_ADDRESS_CACHE_SIZE = 1024
+
+
+class MacAddress(bytes):
+    """ MAC address kept in its binary form, instances are interned so frames of the same hosts share them and string form is created only when logged """
+
+    __cache = {}
+
+    def __new__(cls, address):
+        """ Class constructor, accepts address as string, bytes or view into packet buffer """
+
+        if isinstance(address, MacAddress):
+            return address
+
+        if isinstance(address, str):
+            address = bytes.fromhex(address.replace(":", "").replace("-", "").replace(".", ""))
+        else:
+            address = bytes(address)
+
+        if (mac_address := cls.__cache.get(address, None)) is not None:
+            return mac_address
+
+        assert len(address) == 6, f"Invalid MAC address length: {len(address)}"
+
+        if len(cls.__cache) >= MAC_ADDRESS_CACHE_SIZE:
+            cls.__cache.clear()
+
+        mac_address = cls.__cache[address] = super().__new__(cls, address)
+        return mac_address
+
+    def __str__(self):
+        """ Address in colon separated string form """
+
+        return ":".join(f"{_:0>2x}" for _ in self)
+
+    def __repr__(self):
+        """ Address representation """
+
+        return f"MacAddress('{self}')"
+
+    @property
+    def is_unspecified(self):
+        """ Check if address is all zeros """
+
+        return self == MAC_UNSPECIFIED
+
+    @property
+    def is_broadcast(self):
+        """ Check if address is broadcast address """
+
+        return self == MAC_BROADCAST
+
+    @property
+    def is_multicast(self):
+        """ Check if address is multicast (or broadcast) address """
+
+        return bool(self[0] & 1)
+
+
+MAC_UNSPECIFIED = MacAddress("00:00:00:00:00:00")
+MAC_BROADCAST = MacAddress("ff:ff:ff:ff:ff:ff")
@@ -42,7 +42,7 @@
 
 import random
 import threading
-import time
+from collections import Counter
 from ipaddress import AddressValueError
 
 import loguru
@@ -54,8 +54,10 @@ import ps_icmp6
 import stack
 from arp_cache import ArpCache
 from icmp6_nd_cache import ICMPv6NdCache
-from ipv4_address import IPv4Address, IPv4Interface
+from ipv4_address import IPv4Address, IPv4Interface, IPv4Network
 from ipv6_address import IPv6Address, IPv6Interface, IPv6Network
+from mac_address import MAC_BROADCAST, MAC_UNSPECIFIED, MacAddress
+from route_table import RouteTable
 from rx_ring import RxRing
 from tx_ring import TxRing
 from udp_metadata import UdpMetadata
@@ -82,26 +84,41 @@ class PacketHandler:
     from phtx_tcp import phtx_tcp
     from phtx_udp import phtx_udp
 
-    def __init__(self, tap):
-        """ Class constructor """
+    def __init__(self, link, state_sync=None):
+        """ Class constructor, state_sync is provided when stack runs as one of the workers serving multi-queue TAP interface """
 
         stack.packet_handler = self
+        self.state_sync = state_sync
 
         self.logger = loguru.logger.bind(object_name="packet_handler.")
 
         # MAC and IPv6 Multicast lists hold duplicate entries by design. This is to accomodate IPv6 Solicited Node Multicast mechanism where multiple
         # IPv6 unicast addresses can be tied to the same SNM address (and the same multicast MAC). This is important when removing one of unicast addresses,
         # so the other ones keep it's SNM entry in multicast list. Its the simplest solution and imho perfectly valid one in this case.
-        self.mac_unicast = config.mac_address
+        self.mac_unicast = MacAddress(config.mac_address)
         self.mac_multicast = []
-        self.mac_broadcast = "ff:ff:ff:ff:ff:ff"
+        self.mac_broadcast = MAC_BROADCAST
         self.ip6_address = []
         self.ip6_multicast = []
         self.ip4_address = []
         self.ip4_multicast = []
 
-        self.rx_ring = RxRing(tap)
-        self.tx_ring = TxRing(tap)
+        # Reference counted memberships of addresses stack listens on (several unicast addresses may share the same SNM, multicast MAC
+        # or broadcast address) and frozen sets built out of them, RX / TX path checks packet addresses against those sets with single lookup
+        # and they get rebuilt only by the address assign / remove methods
+        self.mac_membership = Counter((self.mac_unicast, self.mac_broadcast))
+        self.ip6_membership = Counter()
+        self.ip4_membership = Counter((IPv4Address("255.255.255.255"),))
+        self.mac_rx_filter = frozenset(self.mac_membership)
+        self.ip6_rx_filter = frozenset()
+        self.ip4_rx_filter = frozenset(self.ip4_membership)
+
+        # Routes to directly connected networks and default routes are created for each of stack addresses as it gets assigned
+        self.ip6_route_table = RouteTable(version=6)
+        self.ip4_route_table = RouteTable(version=4)
+
+        self.rx_ring = RxRing(link)
+        self.tx_ring = TxRing(link)
         self.arp_cache = ArpCache(self)
         self.icmp6_nd_cache = ICMPv6NdCache(self)
 
@@ -120,27 +137,48 @@ class PacketHandler:
         # Used to keep IPv4 packet ID last value
         self.ip4_packet_id = 0
 
-        # Start packed handler so we can receive packets from network
-        threading.Thread(target=self.__thread_packet_handler).start()
+        # Prebuilt header templates of outbound TCP / UDP flows and destination MAC addresses resolved for outbound IP packets,
+        # both are flushed whenever stack addressing or ARP / ND cache content changes
+        self.tx_flow_templates = {}
+        self.tx_ether_dst_cache = {}
+
+        # Start packed handler so we can receive packets from network, in simulated time mode there are no threads and link calls
+        # packet handler whenever packets arrive
+        if stack.clock.simulated:
+            link.attach(self.__process_link_rx)
+        else:
+            threading.Thread(target=self.__thread_packet_handler).start()
         self.logger.debug("Started packet handler")
 
-        if config.ip6_support:
-            # Assign All IPv6 Nodes multicast address
-            self.assign_ip6_multicast(IPv6Address("ff02::1"))
-            # Create list of IPv6 unicast/multicast addresses stack should listen on
-            self.ip6_address_candidate = self.parse_stack_ip6_address_candidate(config.ip6_address_candidate)
-            self.create_stack_ip6_addressing()
+        # Start sharing ARP / ND cache entries and address configuration with other workers
+        if self.state_sync:
+            self.state_sync.start(self)
 
-        if config.ip4_support:
-            # Create list of IPv4 unicast/multicast/broadcast addresses stack should listen on, use DHCP if enabled
-            ip4_address_dhcp = self.__dhcp4_client()
-            ip4_address_dhcp = [ip4_address_dhcp] if ip4_address_dhcp[0] else []
-            self.ip4_address_candidate = self.parse_stack_ip4_address_candidate(config.ip4_address_candidate + ip4_address_dhcp)
-            self.create_stack_ip4_addressing()
+        # Worker serving secondary TAP queue takes over address configuration from the primary one instead of running its own
+        if self.state_sync and not self.state_sync.primary:
+            self.state_sync.wait_for_addressing()
+
+        else:
+            if config.ip6_support:
+                # Assign All IPv6 Nodes multicast address
+                self.assign_ip6_multicast(IPv6Address("ff02::1"))
+                # Create list of IPv6 unicast/multicast addresses stack should listen on
+                self.ip6_address_candidate = self.parse_stack_ip6_address_candidate(config.ip6_address_candidate)
+                self.create_stack_ip6_addressing()
+
+            if config.ip4_support:
+                # Create list of IPv4 unicast/multicast/broadcast addresses stack should listen on, use DHCP if enabled
+                ip4_address_dhcp = self.__dhcp4_client() if config.ip4_address_dhcp_config else (None, None)
+                ip4_address_dhcp = [ip4_address_dhcp] if ip4_address_dhcp[0] else []
+                self.ip4_address_candidate = self.parse_stack_ip4_address_candidate(config.ip4_address_candidate + ip4_address_dhcp)
+                self.create_stack_ip4_addressing()
+
+            if self.state_sync:
+                self.state_sync.publish_addressing()
 
         # Log all the addresses stack will listen on
         self.logger.info(f"Stack listening on unicast MAC address: {self.mac_unicast}")
-        self.logger.info(f"Stack listening on multicast MAC addresses: {list(set(self.mac_multicast))}")
+        self.logger.info(f"Stack listening on multicast MAC addresses: {list(set(str(_) for _ in self.mac_multicast))}")
         self.logger.info(f"Stack listening on brodcast MAC address: {self.mac_broadcast}")
 
         if config.ip6_support:
@@ -153,10 +191,23 @@ class PacketHandler:
             self.logger.info(f"Stack listening on brodcast IPv4 addresses: {[str(_) for _ in self.ip4_broadcast]}")
 
     def __thread_packet_handler(self):
-        """ Thread picks up incoming packets from RX ring and processes them """
+        """ Thread picks up batches of incoming packets from RX ring and processes them """
 
         while True:
-            self.phrx_ether(self.rx_ring.dequeue())
+            self.__process_batch(self.rx_ring.dequeue_batch(config.rx_batch_size))
+
+    def __process_link_rx(self):
+        """ Simulated link callback, picks up packets that just arrived and processes them right away """
+
+        self.rx_ring.receive()
+        while batch := self.rx_ring.dequeue_batch(config.rx_batch_size, timeout=0):
+            self.__process_batch(batch)
+
+    def __process_batch(self, batch):
+        """ Process batch of incoming packets """
+
+        for ether_packet_rx in batch:
+            self.phrx_ether(ether_packet_rx)
 
     @property
     def ip6_unicast(self):
@@ -175,7 +226,7 @@ class PacketHandler:
         """ Return list of stack's IPv4 broadcast addresses """
 
         ip4_broadcast = [_.network.broadcast_address for _ in self.ip4_address]
-        ip4_broadcast.append("255.255.255.255")
+        ip4_broadcast.append(IPv4Address("255.255.255.255"))
         return ip4_broadcast
 
     def perform_ip6_nd_dad(self, ip6_unicast_candidate):
@@ -185,7 +236,7 @@ class PacketHandler:
         self.assign_ip6_multicast(ip6_unicast_candidate.solicited_node_multicast)
         self.ip6_unicast_candidate = ip6_unicast_candidate
         self.send_icmp6_nd_dad_message(ip6_unicast_candidate)
-        if event := self.event_icmp6_nd_dad.acquire(timeout=1):
+        if event := stack.clock.acquire(self.event_icmp6_nd_dad, timeout=1):
             self.logger.warning(f"ICMPv6 ND DAD - Duplicate IPv6 address detected, {ip6_unicast_candidate} advertised by {self.icmp6_nd_dad_tlla}")
         else:
             self.logger.debug(f"ICMPv6 ND DAD - No duplicate address detected for {ip6_unicast_candidate}")
@@ -265,7 +316,7 @@ class PacketHandler:
         # Send out IPv6 Router Solicitation message and wait for response in attempt to auto configure addresses based on ICMPv6 Router Advertisement
         if config.ip6_gua_autoconfig:
             self.send_icmp6_nd_router_solicitation()
-            self.event_icmp6_ra.acquire(timeout=1)
+            stack.clock.acquire(self.event_icmp6_ra, timeout=1)
             for prefix, gateway in list(self.icmp6_ra_prefixes):
                 self.logger.debug(f"Attempting IPv6 address auto configuration for RA prefix {prefix}")
                 ip6_address = prefix.eui64(self.mac_unicast)
@@ -317,7 +368,7 @@ class PacketHandler:
                 if ip4_unicast not in self.arp_probe_unicast_conflict:
                     self.send_arp_probe(ip4_unicast)
                     self.logger.debug(f"Sent out ARP Probe for {ip4_unicast}")
-            time.sleep(random.uniform(1, 2))
+            stack.clock.sleep(random.uniform(1, 2))
         for ip4_unicast in self.arp_probe_unicast_conflict:
             self.logger.warning(f"Unable to claim IPv4 address {ip4_unicast}")
 
@@ -325,7 +376,7 @@ class PacketHandler:
         for ip4_address in list(self.ip4_address_candidate):
             self.ip4_address_candidate.remove(ip4_address)
             if ip4_address.ip not in self.arp_probe_unicast_conflict:
-                self.ip4_address.append(ip4_address)
+                self.assign_ip4_address(ip4_address)
                 self.send_arp_announcement(ip4_address.ip)
                 self.logger.debug(f"Succesfully claimed IPv4 address {ip4_unicast}")
 
@@ -340,11 +391,11 @@ class PacketHandler:
 
         self.phtx_arp(
             ether_src=self.mac_unicast,
-            ether_dst="ff:ff:ff:ff:ff:ff",
+            ether_dst=MAC_BROADCAST,
             arp_oper=ps_arp.ARP_OP_REQUEST,
             arp_sha=self.mac_unicast,
             arp_spa=IPv4Address("0.0.0.0"),
-            arp_tha="00:00:00:00:00:00",
+            arp_tha=MAC_UNSPECIFIED,
             arp_tpa=ip4_unicast,
         )
         self.logger.debug(f"Sent out ARP probe for {ip4_unicast}")
@@ -354,11 +405,11 @@ class PacketHandler:
 
         self.phtx_arp(
             ether_src=self.mac_unicast,
-            ether_dst="ff:ff:ff:ff:ff:ff",
+            ether_dst=MAC_BROADCAST,
             arp_oper=ps_arp.ARP_OP_REQUEST,
             arp_sha=self.mac_unicast,
             arp_spa=ip4_unicast,
-            arp_tha="00:00:00:00:00:00",
+            arp_tha=MAC_UNSPECIFIED,
             arp_tpa=ip4_unicast,
         )
         self.logger.debug(f"Sent out ARP Announcement for {ip4_unicast}")
@@ -368,11 +419,11 @@ class PacketHandler:
 
         self.phtx_arp(
             ether_src=self.mac_unicast,
-            ether_dst="ff:ff:ff:ff:ff:ff",
+            ether_dst=MAC_BROADCAST,
             arp_oper=ps_arp.ARP_OP_REPLY,
             arp_sha=self.mac_unicast,
             arp_spa=ip4_unicast,
-            arp_tha="00:00:00:00:00:00",
+            arp_tha=MAC_UNSPECIFIED,
             arp_tpa=ip4_unicast,
         )
         self.logger.debug(f"Sent out Gratitous ARP for {ip4_unicast}")
@@ -420,10 +471,119 @@ class PacketHandler:
         )
         self.logger.debug("Sent out ICMPv6 ND Router Solicitation")
 
+    def flush_tx_caches(self):
+        """ Flush flow templates and resolved destination MAC addresses used by transmit path """
+
+        self.tx_flow_templates.clear()
+        self.tx_ether_dst_cache.clear()
+        self.ip6_route_table.route_cache.clear()
+        self.ip4_route_table.route_cache.clear()
+
+    def add_ip6_route(self, network, gateway=None, ip6_src=None):
+        """ Add route to IPv6 routing table """
+
+        self.ip6_route_table.add_route(network, gateway, ip6_src)
+        self.flush_tx_caches()
+
+    def remove_ip6_route(self, network, gateway=None, ip6_src=None):
+        """ Remove route from IPv6 routing table """
+
+        self.ip6_route_table.remove_route(network, gateway, ip6_src)
+        self.flush_tx_caches()
+
+    def add_ip4_route(self, network, gateway=None, ip4_src=None):
+        """ Add route to IPv4 routing table """
+
+        self.ip4_route_table.add_route(network, gateway, ip4_src)
+        self.flush_tx_caches()
+
+    def remove_ip4_route(self, network, gateway=None, ip4_src=None):
+        """ Remove route from IPv4 routing table """
+
+        self.ip4_route_table.remove_route(network, gateway, ip4_src)
+        self.flush_tx_caches()
+
+    def rebuild_route_tables(self):
+        """ Recreate routing tables from scratch, used when address lists are taken over as a whole instead of by assign methods """
+
+        self.ip6_route_table = RouteTable(version=6)
+        self.ip4_route_table = RouteTable(version=4)
+
+        for ip6_address in self.ip6_address:
+            self.add_ip6_route(ip6_address.network, None, ip6_address.ip)
+            if ip6_address.gateway:
+                self.add_ip6_route(IPv6Network("::/0"), ip6_address.gateway, ip6_address.ip)
+
+        for ip4_address in self.ip4_address:
+            self.add_ip4_route(ip4_address.network, None, ip4_address.ip)
+            if ip4_address.gateway:
+                self.add_ip4_route(IPv4Network("0.0.0.0/0"), ip4_address.gateway, ip4_address.ip)
+
+    def rebuild_membership(self):
+        """ Recount address memberships from scratch, used when address lists are taken over as a whole instead of by assign methods """
+
+        self.mac_membership = Counter((self.mac_unicast, self.mac_broadcast, *self.mac_multicast))
+        self.ip6_membership = Counter((*self.ip6_unicast, *self.ip6_multicast))
+        self.ip4_membership = Counter((*self.ip4_unicast, *self.ip4_multicast, *self.ip4_broadcast))
+        self.mac_rx_filter = frozenset(self.mac_membership)
+        self.ip6_rx_filter = frozenset(self.ip6_membership)
+        self.ip4_rx_filter = frozenset(self.ip4_membership)
+        self.flush_tx_caches()
+
+    def __join_membership(self, membership, *addresses):
+        """ Add reference to each of addresses and return the updated filter set """
+
+        membership.update(addresses)
+        return frozenset(membership)
+
+    def __leave_membership(self, membership, *addresses):
+        """ Drop reference to each of addresses and return the updated filter set, address leaves the set once nothing refers to it """
+
+        membership -= Counter(addresses)
+        return frozenset(membership)
+
+    def assign_ip4_address(self, ip4_address):
+        """ Assign IPv4 unicast address to the list stack listens on """
+
+        self.ip4_address.append(ip4_address)
+        self.ip4_rx_filter = self.__join_membership(self.ip4_membership, ip4_address.ip, ip4_address.broadcast_address)
+        self.add_ip4_route(ip4_address.network, None, ip4_address.ip)
+        if ip4_address.gateway:
+            self.add_ip4_route(IPv4Network("0.0.0.0/0"), ip4_address.gateway, ip4_address.ip)
+        self.logger.debug(f"Assigned IPv4 unicast address {ip4_address}")
+
+    def remove_ip4_address(self, ip4_address):
+        """ Remove IPv4 unicast address from the list stack listens on """
+
+        self.ip4_address.remove(ip4_address)
+        self.ip4_rx_filter = self.__leave_membership(self.ip4_membership, ip4_address.ip, ip4_address.broadcast_address)
+        self.remove_ip4_route(ip4_address.network, None, ip4_address.ip)
+        if ip4_address.gateway:
+            self.remove_ip4_route(IPv4Network("0.0.0.0/0"), ip4_address.gateway, ip4_address.ip)
+        self.logger.debug(f"Removed IPv4 unicast address {ip4_address}")
+
+    def assign_ip4_multicast(self, ip4_multicast):
+        """ Assign IPv4 multicast address to the list stack listens on """
+
+        self.ip4_multicast.append(ip4_multicast)
+        self.ip4_rx_filter = self.__join_membership(self.ip4_membership, ip4_multicast)
+        self.logger.debug(f"Assigned IPv4 multicast {ip4_multicast}")
+
+    def remove_ip4_multicast(self, ip4_multicast):
+        """ Remove IPv4 multicast address from the list stack listens on """
+
+        self.ip4_multicast.remove(ip4_multicast)
+        self.ip4_rx_filter = self.__leave_membership(self.ip4_membership, ip4_multicast)
+        self.logger.debug(f"Removed IPv4 multicast {ip4_multicast}")
+
     def assign_ip6_address(self, ip6_address):
         """ Assign IPv6 unicast address to the list stack listens on """
 
         self.ip6_address.append(ip6_address)
+        self.ip6_rx_filter = self.__join_membership(self.ip6_membership, ip6_address.ip)
+        self.add_ip6_route(ip6_address.network, None, ip6_address.ip)
+        if ip6_address.gateway:
+            self.add_ip6_route(IPv6Network("::/0"), ip6_address.gateway, ip6_address.ip)
         self.logger.debug(f"Assigned IPv6 unicast address {ip6_address}")
         self.assign_ip6_multicast(ip6_address.solicited_node_multicast)
 
@@ -431,6 +591,10 @@ class PacketHandler:
         """ Remove IPv6 unicast address from the list stack listens on """
 
         self.ip6_address.remove(ip6_address)
+        self.ip6_rx_filter = self.__leave_membership(self.ip6_membership, ip6_address.ip)
+        self.remove_ip6_route(ip6_address.network, None, ip6_address.ip)
+        if ip6_address.gateway:
+            self.remove_ip6_route(IPv6Network("::/0"), ip6_address.gateway, ip6_address.ip)
         self.logger.debug(f"Removed IPv6 unicast address {ip6_address}")
         self.remove_ip6_multicast(ip6_address.solicited_node_multicast)
 
@@ -438,6 +602,7 @@ class PacketHandler:
         """ Assign IPv6 multicast address to the list stack listens on """
 
         self.ip6_multicast.append(ip6_multicast)
+        self.ip6_rx_filter = self.__join_membership(self.ip6_membership, ip6_multicast)
         self.logger.debug(f"Assigned IPv6 multicast {ip6_multicast}")
         self.assign_mac_multicast(ip6_multicast.multicast_mac)
 
@@ -449,6 +614,7 @@ class PacketHandler:
         """ Remove IPv6 multicast address from the list stack listens on """
 
         self.ip6_multicast.remove(ip6_multicast)
+        self.ip6_rx_filter = self.__leave_membership(self.ip6_membership, ip6_multicast)
         self.logger.debug(f"Removed IPv6 multicast {ip6_multicast}")
         self.remove_mac_multicast(ip6_multicast.multicast_mac)
 
@@ -456,12 +622,14 @@ class PacketHandler:
         """ Assign MAC multicast address to the list stack listens on """
 
         self.mac_multicast.append(mac_multicast)
+        self.mac_rx_filter = self.__join_membership(self.mac_membership, mac_multicast)
         self.logger.debug(f"Assigned MAC multicast {mac_multicast}")
 
     def remove_mac_multicast(self, mac_multicast):
         """ Remove MAC multicast address from the list stack listens on """
 
         self.mac_multicast.remove(mac_multicast)
+        self.mac_rx_filter = self.__leave_membership(self.mac_membership, mac_multicast)
         self.logger.debug(f"Removed MAC multicast {mac_multicast}")
 
     def __dhcp4_client(self):
@@ -43,6 +43,7 @@
 
 import ps_arp
 from ipv4_address import IPv4Address
+from mac_address import MAC_BROADCAST
 
 ARP_CACHE_UPDATE_FROM_DIRECT_REQUEST = True
 ARP_CACHE_UPDATE_FROM_GRATUITOUS_REPLY = True
@@ -103,7 +104,7 @@ def phrx_arp(self, ether_packet_rx, arp_packet_rx):
             return
 
         # Update ARP cache with maping received as gratuitous ARP reply
-        if ether_packet_rx.ether_dst == "ff:ff:ff:ff:ff:ff" and arp_packet_rx.arp_spa == arp_packet_rx.arp_tpa and ARP_CACHE_UPDATE_FROM_GRATUITOUS_REPLY:
+        if ether_packet_rx.ether_dst == MAC_BROADCAST and arp_packet_rx.arp_spa == arp_packet_rx.arp_tpa and ARP_CACHE_UPDATE_FROM_GRATUITOUS_REPLY:
             self.logger.debug(f"Adding/refreshing ARP cache entry from gratuitous reply - {arp_packet_rx.arp_spa} -> {arp_packet_rx.arp_sha}")
             self.arp_cache.add_entry(arp_packet_rx.arp_spa, arp_packet_rx.arp_sha)
             return
@@ -45,7 +45,7 @@ import ps_icmp4
 import ps_ip4
 import ps_tcp
 import ps_udp
-from ip_helper import inet_cksum
+from ip_helper import inet_cksum_update
 
 ip4_fragments = {}
 
@@ -73,18 +73,27 @@ def handle_ip4_fragmentation(ip4_packet_rx):
         if ip4_fragments.get(ip4_packet_rx.ip4_packet_id, None):
             ip4_fragments[ip4_packet_rx.ip4_packet_id][ip4_packet_rx.ip4_frag_offset] = ip4_packet_rx.raw_data
 
-            raw_data = b""
-            for offset in sorted(ip4_fragments[ip4_packet_rx.ip4_packet_id]):
-                raw_data += ip4_fragments[ip4_packet_rx.ip4_packet_id][offset]
-
-            # Craft complete IP packet based on last fragment for further processing
+            fragments = ip4_fragments[ip4_packet_rx.ip4_packet_id]
+            raw_data = b"".join(fragments[offset] for offset in sorted(fragments))
+
+            # Craft complete IP packet based on last fragment for further processing, header checksum gets updated
+            # only for the flags / fragment offset and total length words that changed (RFC 1624)
+            ip4_plen = ip4_packet_rx.ip4_hlen + len(raw_data)
+            ip4_cksum = inet_cksum_update(ip4_packet_rx.ip4_cksum, ip4_packet_rx.ip4_plen, ip4_plen)
+            ip4_cksum = inet_cksum_update(
+                ip4_cksum,
+                ip4_packet_rx.ip4_flag_reserved << 15 | ip4_packet_rx.ip4_flag_df << 14 | ip4_packet_rx.ip4_flag_mf << 13 | ip4_packet_rx.ip4_frag_offset >> 3,
+                ip4_packet_rx.ip4_flag_reserved << 15 | ip4_packet_rx.ip4_flag_df << 14,
+            )
             ip4_packet_rx.ip4_flag_mf = False
             ip4_packet_rx.ip4_frag_offset = 0
-            ip4_packet_rx.ip4_plen = ip4_packet_rx.ip4_hlen + len(raw_data)
-            ip4_packet_rx.ip4_cksum = 0
-            ip4_packet_rx.ip4_cksum = inet_cksum(ip4_packet_rx.raw_header)
+            ip4_packet_rx.ip4_plen = ip4_plen
+            ip4_packet_rx.ip4_cksum = ip4_cksum
             ip4_packet_rx.raw_data = raw_data
 
+            # Checksum offload information received with the last fragment doesn't cover the whole reassembled packet
+            ip4_packet_rx.cksum_verified = False
+
     return ip4_packet_rx
 
 
@@ -98,7 +107,7 @@ def phrx_ip4(self, ip4_packet_rx):
     self.logger.debug(f"{ip4_packet_rx.tracker} - {ip4_packet_rx}")
 
     # Check if received packet has been sent to us directly or by unicast/broadcast, allow any destination if no unicast address is configured (for DHCP client)
-    if self.ip4_unicast and ip4_packet_rx.ip4_dst not in {*self.ip4_unicast, *self.ip4_multicast, *self.ip4_broadcast}:
+    if self.ip4_address and ip4_packet_rx.ip4_dst not in self.ip4_rx_filter:
         self.logger.debug(f"{ip4_packet_rx.tracker} - IP packet not destined for this stack, droping")
         return
 
@@ -57,7 +57,7 @@ def phrx_ip6(self, ip6_packet_rx):
     self.logger.debug(f"{ip6_packet_rx.tracker} - {ip6_packet_rx}")
 
     # Check if received packet has been sent to us directly or by unicast or multicast
-    if ip6_packet_rx.ip6_dst not in {*self.ip6_unicast, *self.ip6_multicast}:
+    if ip6_packet_rx.ip6_dst not in self.ip6_rx_filter:
         self.logger.debug(f"{ip6_packet_rx.tracker} - IP packet not destined for this stack, droping")
         return
 
@@ -44,8 +44,6 @@
 import stack
 from tcp_metadata import TcpMetadata
 
-PACKET_LOSS = False
-
 
 def phrx_tcp(self, ip_packet_rx, tcp_packet_rx):
     """ Handle inbound TCP packets """
@@ -79,24 +77,16 @@ def phrx_tcp(self, ip_packet_rx, tcp_packet_rx):
         tracker=tcp_packet_rx.tracker,
     )
 
-    # Check if packet should be dropped due to random packet loss enabled (for TCP retansmission testing)
-    if PACKET_LOSS:
-        from random import randint
-
-        if randint(0, 99) == 7:
-            self.logger.critical("SIMULATED LOST RX DATA PACKET")
-            return
-
     # Check if incoming packet matches active TCP session
-    if tcp_session := stack.tcp_sessions.get(packet.tcp_session_id, None):
+    if tcp_session := stack.tcp_sessions.get(packet.tcp_session_key, None):
         self.logger.debug(f"{packet.tracker} - TCP packet is part of active session {tcp_session.tcp_session_id}")
         tcp_session.tcp_fsm(packet=packet)
         return
 
     # Check if incoming packet is an initial SYN packet and if it matches any listening TCP session
     if all({packet.flag_syn}) and not any({packet.flag_ack, packet.flag_fin, packet.flag_rst}):
-        for tcp_session_id_pattern in packet.tcp_session_listening_patterns:
-            if tcp_session := stack.tcp_sessions.get(tcp_session_id_pattern, None):
+        for tcp_listener_key in packet.tcp_listener_keys:
+            if tcp_session := stack.tcp_listeners.get(tcp_listener_key, None):
                 self.logger.debug(f"{packet.tracker} - TCP packet matches listening session {tcp_session.tcp_session_id}")
                 tcp_session.tcp_fsm(packet=packet)
                 return
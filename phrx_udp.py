@@ -64,20 +64,19 @@ def phrx_udp(self, ip_packet_rx, udp_packet_rx):
     ip_packet_rx.ip_dst = ip_packet_rx.ip6_dst if ip_packet_rx.protocol == "IPv6" else ip_packet_rx.ip4_dst
     ip_packet_rx.ip_src = ip_packet_rx.ip6_src if ip_packet_rx.protocol == "IPv6" else ip_packet_rx.ip4_src
 
-    # Create UdpMetadata object and try to find matching UDP socket
+    # Create UdpMetadata object and try to find matching UDP socket, payload is copied out of the received frame buffer as it is handed over to application
     packet = UdpMetadata(
         local_ip_address=ip_packet_rx.ip_dst,
         local_port=udp_packet_rx.udp_dport,
         remote_ip_address=ip_packet_rx.ip_src,
         remote_port=udp_packet_rx.udp_sport,
-        raw_data=udp_packet_rx.raw_data,
+        raw_data=bytes(udp_packet_rx.raw_data),
         tracker=udp_packet_rx.tracker,
     )
 
-    for socket_id in packet.socket_id_patterns:
-        socket = stack.udp_sockets.get(socket_id, None)
-        if socket:
-            loguru.logger.bind(object_name="socket.").debug(f"{packet.tracker} - Found matching listening socket {socket_id}")
+    for socket in stack.udp_sockets.get(packet.local_port, ()):
+        if socket.match(packet):
+            loguru.logger.bind(object_name="socket.").debug(f"{packet.tracker} - Found matching listening socket {socket.socket_id}")
             socket.process_packet(packet)
             return
 
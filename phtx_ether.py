@@ -36,111 +36,131 @@
 ##############################################################################################
 
 
+#
 #
 # phtx_ether.py - packet handler for outbound Ethernet packets
 #
 
 
 import ps_ether
-import ps_ip4
-import ps_ip6
+from mac_address import MAC_BROADCAST, MAC_UNSPECIFIED
+
+# Maximum number of resolved destinations kept by packet handler, the whole cache gets flushed once it fills up
+ETHER_DST_CACHE_SIZE = 1024
+
+
+def resolve_ip6_ether_dst(self, ether_packet_tx, ip6_src, ip6_dst):
+    """ Resolve destination MAC of IPv6 packet, return it along with ND cache entry it came from (if any), ND cache holds the packet on miss """
+
+    # Packet destined to multicast IPv6 address goes to the corresponding multicast MAC
+    if ip6_dst.is_multicast:
+        self.logger.debug(f"{ether_packet_tx.tracker} - Resolved destiantion IPv6 {ip6_dst} to MAC {ip6_dst.multicast_mac}")
+        return ip6_dst.multicast_mac, None
+
+    # Packet goes to the next hop picked out of routes belonging to its source address, packet with unspecified source is sent directly to destination
+    route = self.ip6_route_table.find_route(ip6_dst, ip6_src)
+    if route is None and not ip6_src.is_unspecified:
+        self.logger.debug(f"{ether_packet_tx.tracker} - No route to {ip6_dst} from {ip6_src} source address, droping packet...")
+        return None
+
+    # Packet destined to external network goes to the gateway if its MAC can be obtained from ND cache
+    if route and route.gateway:
+        if nd_entry := self.icmp6_nd_cache.find_entry(route.gateway, ether_packet_tx):
+            self.logger.debug(f"{ether_packet_tx.tracker} - Resolved destiantion IPv6 {ip6_dst} to Gateway {route.gateway} MAC {nd_entry.mac_address}")
+            return nd_entry.mac_address, nd_entry
+        return None
+
+    # Packet destined to local network goes to MAC obtained from ICMPv6 ND cache
+    if nd_entry := self.icmp6_nd_cache.find_entry(ip6_dst, ether_packet_tx):
+        self.logger.debug(f"{ether_packet_tx.tracker} - Resolved destiantion IPv6 {ip6_dst} to MAC {nd_entry.mac_address}")
+        return nd_entry.mac_address, nd_entry
+
+    return None
+
 
+def resolve_ip4_ether_dst(self, ether_packet_tx, ip4_src, ip4_dst):
+    """ Resolve destination MAC of IPv4 packet, return it along with ARP cache entry it came from (if any), ARP cache holds the packet on miss """
 
-def phtx_ether(self, child_packet, ether_src="00:00:00:00:00:00", ether_dst="00:00:00:00:00:00"):
-    """ Handle outbound Ethernet packets """
+    # Packet destinied to limited broadcast addresses goes to broadcast MAC
+    if ip4_dst.is_limited_broadcast:
+        self.logger.debug(f"{ether_packet_tx.tracker} - Resolved destiantion IPv4 {ip4_dst} to MAC ff:ff:ff:ff:ff:ff")
+        return MAC_BROADCAST, None
+
+    # Packet goes to the next hop picked out of routes belonging to its source address, packet with unspecified source is sent directly to destination
+    route = self.ip4_route_table.find_route(ip4_dst, ip4_src)
+    if route is None and not ip4_src.is_unspecified:
+        self.logger.debug(f"{ether_packet_tx.tracker} - No route to {ip4_dst} from {ip4_src} source address, droping packet...")
+        return None
+
+    # Packet destinied to directed broadcast or network addresses of directly connected network goes to broadcast MAC
+    if route and not route.gateway and ip4_dst in {route.network.network_address, route.network.broadcast_address}:
+        self.logger.debug(f"{ether_packet_tx.tracker} - Resolved destiantion IPv4 {ip4_dst} to MAC ff:ff:ff:ff:ff:ff")
+        return MAC_BROADCAST, None
+
+    # Packet destined to external network goes to the gateway if its MAC can be obtained from ARP cache
+    if route and route.gateway:
+        if arp_entry := self.arp_cache.find_entry(route.gateway, ether_packet_tx):
+            self.logger.debug(f"{ether_packet_tx.tracker} - Resolved destiantion IPv4 {ip4_dst} to Gateway {route.gateway} MAC {arp_entry.mac_address}")
+            return arp_entry.mac_address, arp_entry
+        return None
+
+    # Packet destined to local network goes to MAC obtained from ARP cache
+    if arp_entry := self.arp_cache.find_entry(ip4_dst, ether_packet_tx):
+        self.logger.debug(f"{ether_packet_tx.tracker} - Resolved destiantion IPv4 {ip4_dst} to MAC {arp_entry.mac_address}")
+        return arp_entry.mac_address, arp_entry
+
+    return None
+
+
+def phtx_ether(self, child_packet, ether_src=MAC_UNSPECIFIED, ether_dst=MAC_UNSPECIFIED, ip_src=None, ip_dst=None):
+    """ Handle outbound Ethernet packets, IP packet comes with its source and destination addresses, return the packet if it has been sent out """
 
     def __send_out_packet():
         self.logger.opt(depth=1).debug(f"{ether_packet_tx.tracker} - {ether_packet_tx}")
         self.tx_ring.enqueue(ether_packet_tx, urgent=(child_packet.protocol == "ARP"))
+        return ether_packet_tx
 
     ether_packet_tx = ps_ether.EtherPacket(ether_src=ether_src, ether_dst=ether_dst, child_packet=child_packet)
 
     # Check if packet contains valid source address, fill it out if needed
-    if ether_packet_tx.ether_src == "00:00:00:00:00:00":
+    if ether_packet_tx.ether_src.is_unspecified:
         ether_packet_tx.ether_src = self.mac_unicast
+        ether_packet_tx.drop_raw_packet()
         self.logger.debug(f"{ether_packet_tx.tracker} - Set source to stack MAC {ether_packet_tx.ether_src}")
 
     # Send out packet if it contains valid destination MAC address
-    if ether_packet_tx.ether_dst != "00:00:00:00:00:00":
+    if not ether_packet_tx.ether_dst.is_unspecified:
         self.logger.debug(f"{ether_packet_tx.tracker} - Contains valid destination MAC address")
-        __send_out_packet()
-        return
+        return __send_out_packet()
+
+    # Send out packet if its destination has already been resolved, the hit is accounted to ARP / ND cache entry so it keeps being refreshed
+    if ether_dst_entry := self.tx_ether_dst_cache.get((ip_src, ip_dst), None):
+        ether_packet_tx.ether_dst, neighbor_entry = ether_dst_entry
+        ether_packet_tx.drop_raw_packet()
+        if neighbor_entry:
+            neighbor_entry.hit_count += 1
+        self.logger.debug(f"{ether_packet_tx.tracker} - Resolved destination IP {ip_dst} to cached MAC {ether_packet_tx.ether_dst}")
+        return __send_out_packet()
 
-    # Check if we can obtain destination MAC based on IPv6 header data
+    ether_dst_entry = None
+
+    # Check if we can obtain destination MAC based on IPv6 addresses
     if ether_packet_tx.ether_type == ps_ether.ETHER_TYPE_IP6:
-        ip6_packet_tx = ps_ip6.Ip6Packet(ether_packet_tx)
-
-        # Send packet out if its destined to multicast IPv6 address
-        if ip6_packet_tx.ip6_dst.is_multicast:
-            ether_packet_tx.ether_dst = ip6_packet_tx.ip6_dst.multicast_mac
-            self.logger.debug(f"{ether_packet_tx.tracker} - Resolved destiantion IPv6 {ip6_packet_tx.ip6_dst} to MAC {ether_packet_tx.ether_dst}")
-            __send_out_packet()
-            return
-
-        # Send out packet if is destined to external network (in relation to its source address) and we are able to obtain MAC of default gateway from ND cache
-        for stack_ip6_address in self.ip6_address:
-            if stack_ip6_address.ip == ip6_packet_tx.ip6_src and ip6_packet_tx.ip6_dst not in stack_ip6_address.network:
-                if stack_ip6_address.gateway is None:
-                    self.logger.debug(f"{ether_packet_tx.tracker} - No default gateway set for {stack_ip6_address} source address, droping packet...")
-                    return
-                if mac_address := self.icmp6_nd_cache.find_entry(stack_ip6_address.gateway):
-                    ether_packet_tx.ether_dst = mac_address
-                    self.logger.debug(
-                        f"{ether_packet_tx.tracker} - Resolved destiantion IPv6 {ip6_packet_tx.ip6_dst}"
-                        + f" to Default Gateway MAC {ether_packet_tx.ether_dst}"
-                    )
-                    __send_out_packet()
-                    return
-
-        # Send out packet if we are able to obtain destinaton MAC from ICMPv6 ND cache
-        if mac_address := self.icmp6_nd_cache.find_entry(ip6_packet_tx.ip6_dst):
-            ether_packet_tx.ether_dst = mac_address
-            self.logger.debug(f"{ether_packet_tx.tracker} - Resolved destiantion IPv6 {ip6_packet_tx.ip6_dst} to MAC {ether_packet_tx.ether_dst}")
-            __send_out_packet()
-            return
-
-    # Check if we can obtain destination MAC based on IPv4 header data
+        ether_dst_entry = resolve_ip6_ether_dst(self, ether_packet_tx, ip_src, ip_dst)
+
+    # Check if we can obtain destination MAC based on IPv4 addresses
     if ether_packet_tx.ether_type == ps_ether.ETHER_TYPE_IP4:
-        ip4_packet_tx = ps_ip4.Ip4Packet(ether_packet_tx)
-
-        # Send out packet if its destinied to limited broadcast addresses
-        if ip4_packet_tx.ip4_dst.is_limited_broadcast:
-            ether_packet_tx.ether_dst = "ff:ff:ff:ff:ff:ff"
-            self.logger.debug(f"{ether_packet_tx.tracker} - Resolved destiantion IPv4 {ip4_packet_tx.ip4_dst} to MAC {ether_packet_tx.ether_dst}")
-            __send_out_packet()
-            return
-
-        # Send out packet if its destinied to directed broadcast or network addresses (in relation to its source address)
-        for ip4_address in self.ip4_address:
-            if ip4_address.ip == ip4_packet_tx.ip4_src:
-                if ip4_packet_tx.ip4_dst in {ip4_address.network_address, ip4_address.broadcast_address}:
-                    ether_packet_tx.ether_dst = "ff:ff:ff:ff:ff:ff"
-                    self.logger.debug(f"{ether_packet_tx.tracker} - Resolved destiantion IPv4 {ip4_packet_tx.ip4_dst} to MAC {ether_packet_tx.ether_dst}")
-                    __send_out_packet()
-                    return
-
-        # Send out packet if is destined to external network (in relation to its source address) and we are able to obtain MAC of default gateway from ARP cache
-        for stack_ip4_address in self.ip4_address:
-            if stack_ip4_address.ip == ip4_packet_tx.ip4_src and ip4_packet_tx.ip4_dst not in stack_ip4_address.network:
-                if stack_ip4_address.gateway is None:
-                    self.logger.debug(f"{ether_packet_tx.tracker} - No default gateway set for {stack_ip4_address} source address, droping packet...")
-                    return
-                if mac_address := self.arp_cache.find_entry(stack_ip4_address.gateway):
-                    ether_packet_tx.ether_dst = mac_address
-                    self.logger.debug(
-                        f"{ether_packet_tx.tracker} - Resolved destiantion IPv4 {ip4_packet_tx.ip4_dst}"
-                        + f" to Default Gateway MAC {ether_packet_tx.ether_dst}"
-                    )
-                    __send_out_packet()
-                    return
-
-        # Send out packet if we are able to obtain destinaton MAC from ARP cache
-        if mac_address := self.arp_cache.find_entry(ip4_packet_tx.ip4_dst):
-            ether_packet_tx.ether_dst = mac_address
-            self.logger.debug(f"{ether_packet_tx.tracker} - Resolved destiantion IPv4 {ip4_packet_tx.ip4_dst} to MAC {ether_packet_tx.ether_dst}")
-            __send_out_packet()
-            return
-
-    # Drop packet in case  we are not able to obtain valid destination MAC address
-    self.logger.debug(f"{ether_packet_tx.tracker} - No valid destination MAC could be obtained, droping packet...")
-    return
+        ether_dst_entry = resolve_ip4_ether_dst(self, ether_packet_tx, ip_src, ip_dst)
+
+    # Send out packet if its destination MAC got resolved and cache the result for the next packets
+    if ether_dst_entry:
+        if len(self.tx_ether_dst_cache) >= ETHER_DST_CACHE_SIZE:
+            self.tx_ether_dst_cache.clear()
+        self.tx_ether_dst_cache[(ip_src, ip_dst)] = ether_dst_entry
+        ether_packet_tx.ether_dst = ether_dst_entry[0]
+        ether_packet_tx.drop_raw_packet()
+        return __send_out_packet()
+
+    # Drop packet in case  we are not able to obtain valid destination MAC address, unless it is being held by ARP / ND cache until next hop gets resolved
+    self.logger.debug(f"{ether_packet_tx.tracker} - No valid destination MAC could be obtained yet, packet dropped or held until next hop gets resolved")
+    return None
@@ -41,8 +41,6 @@
 #
 
 
-import struct
-
 import config
 import ps_ether
 import ps_ip4
@@ -54,7 +52,7 @@ def validate_src_ip4_address(self, ip4_src, ip4_dst):
     """ Make sure source ip address is valid, supplemt with valid one as appropriate """
 
     # Check if the the source IP address belongs to this stack or its set to all zeros (for DHCP client comunication)
-    if ip4_src not in {*self.ip4_unicast, *self.ip4_multicast, *self.ip4_broadcast, IPv4Address("0.0.0.0")}:
+    if ip4_src not in self.ip4_rx_filter and not ip4_src.is_unspecified:
         self.logger.warning(f"Unable to sent out IPv4 packet, stack doesn't own IPv4 address {ip4_src}")
         return None
 
@@ -76,27 +74,15 @@ def validate_src_ip4_address(self, ip4_src, ip4_dst):
             self.logger.warning("Unable to sent out IPv4 packet, no stack primary unicast IPv4 address available")
             return None
 
-    # If packet is a response to directed braodcast then replace source address with first stack address that belongs to appropriate subnet
-    if ip4_src in self.ip4_broadcast:
-        ip4_src = [_.ip for _ in self.ip4_address if _.broadcast_address == ip4_src]
-        if ip4_src:
-            ip4_src = ip4_src[0]
-            self.logger.debug(f"Packet is response to directed broadcast, replaced source with apropriate IPv4 address {ip4_src}")
-        else:
-            self.logger.warning("Unable to sent out IPv4 packet, no appropriate stack unicast IPv4 address available")
-            return None
-
-    # If source is unspecified check if destination belongs to any of local networks, if so pick source address from that network
-    if ip4_src.is_unspecified:
-        for ip4_address in self.ip4_address:
-            if ip4_dst in ip4_address.network:
-                return ip4_address.ip
+    # If packet is a response to directed braodcast then replace source address with stack address that belongs to appropriate subnet
+    if (route := self.ip4_route_table.find_route(ip4_src)) and not route.gateway and ip4_src == route.network.broadcast_address:
+        ip4_src = route.ip_src
+        self.logger.debug(f"Packet is response to directed broadcast, replaced source with apropriate IPv4 address {ip4_src}")
 
-    # If source unspcified and destination is external pick source from first network that has default gateway set
+    # If source is unspecified pick it from the route to destination, route to local network is preferred over the one via gateway
     if ip4_src.is_unspecified:
-        for ip4_address in self.ip4_address:
-            if ip4_address.gateway:
-                return ip4_address.ip
+        if route := self.ip4_route_table.find_route(ip4_dst):
+            return route.ip_src
 
     return ip4_src
 
@@ -112,8 +98,18 @@ def validate_dst_ip4_address(self, ip4_dst):
     return ip4_dst
 
 
+def pick_ip4_packet_id(self):
+    """ Generate new IPv4 packet ID """
+
+    self.ip4_packet_id += 1
+    if self.ip4_packet_id > 65535:
+        self.ip4_packet_id = 1
+
+    return self.ip4_packet_id
+
+
 def phtx_ip4(self, child_packet, ip4_dst, ip4_src, ip4_ttl=config.ip4_default_ttl):
-    """ Handle outbound IP packets """
+    """ Handle outbound IP packets, return Ethernet packet carrying the IP packet if it has been sent out unfragmented """
 
     # Check if IPv4 protocol support is enabled, if not then silently drop the packet
     if not config.ip4_support:
@@ -134,17 +130,14 @@ def phtx_ip4(self, child_packet, ip4_dst, ip4_src, ip4_ttl=config.ip4_default_tt
         return
 
     # Generate new IPv4 ID
-    self.ip4_packet_id += 1
-    if self.ip4_packet_id > 65535:
-        self.ip4_packet_id = 1
+    pick_ip4_packet_id(self)
 
-    # Check if packet can be sent out without fragmentation, if so send it out
-    if ps_ip4.IP4_HEADER_LEN + len(child_packet.raw_packet) <= config.mtu:
+    # Check if packet can be sent out without fragmentation (or it is TCP super-segment to be split by kernel), if so send it out
+    if ps_ip4.IP4_HEADER_LEN + len(child_packet) <= config.mtu or (child_packet.protocol == "TCP" and child_packet.tcp_gso_size):
         ip4_packet_tx = ps_ip4.Ip4Packet(ip4_src=ip4_src, ip4_dst=ip4_dst, ip4_packet_id=self.ip4_packet_id, child_packet=child_packet)
 
         self.logger.debug(f"{ip4_packet_tx.tracker} - {ip4_packet_tx}")
-        self.phtx_ether(child_packet=ip4_packet_tx)
-        return
+        return self.phtx_ether(child_packet=ip4_packet_tx, ip_src=ip4_src, ip_dst=ip4_dst)
 
     # Fragment packet and send all fragments out
     self.logger.debug("Packet exceedes available MTU, IP fragmentation needed...")
@@ -155,17 +148,10 @@ def phtx_ip4(self, child_packet, ip4_dst, ip4_src, ip4_ttl=config.ip4_default_tt
 
     if child_packet.protocol in {"UDP", "TCP"}:
         ip4_proto = ps_ip4.IP4_PROTO_UDP if child_packet.protocol == "UDP" else ps_ip4.IP4_PROTO_TCP
-        raw_data = child_packet.get_raw_packet(
-            struct.pack(
-                "! 4s 4s BBH",
-                ip4_src.packed,
-                ip4_dst.packed,
-                0,
-                ip4_proto,
-                len(child_packet.raw_packet),
-            )
-        )
+        raw_data = child_packet.get_raw_packet(ps_ip4.IP4_PSEUDO_HEADER_STRUCT.pack(ip4_src.packed, ip4_dst.packed, 0, ip4_proto, len(child_packet)))
 
+    # Fragments are views into the packet assembled above so its data gets copied only once, into the fragment frames
+    raw_data = memoryview(raw_data)
     raw_data_mtu = (config.mtu - ps_ether.ETHER_HEADER_LEN - ps_ip4.IP4_HEADER_LEN) & 0b1111111111111000
     raw_data_fragments = [raw_data[_ : raw_data_mtu + _] for _ in range(0, len(raw_data), raw_data_mtu)]
 
@@ -188,6 +174,6 @@ def phtx_ip4(self, child_packet, ip4_dst, ip4_src, ip4_ttl=config.ip4_default_tt
         offset += len(raw_data_fragment)
 
         self.logger.debug(f"{ip4_packet_tx.tracker} - {ip4_packet_tx}")
-        self.phtx_ether(child_packet=ip4_packet_tx)
+        self.phtx_ether(child_packet=ip4_packet_tx, ip_src=ip4_src, ip_dst=ip4_dst)
 
     return
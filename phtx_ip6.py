@@ -50,7 +50,7 @@ def validate_src_ip6_address(self, ip6_src, ip6_dst):
     """ Make sure source ip address is valid, supplement with valid one as appropriate """
 
     # Check if the the source IP address belongs to this stack or its unspecified
-    if ip6_src not in {*self.ip6_unicast, *self.ip6_multicast, IPv6Address("::")}:
+    if ip6_src not in self.ip6_rx_filter and not ip6_src.is_unspecified:
         self.logger.warning(f"Unable to sent out IPv6 packet, stack doesn't own IPv6 address {ip6_src}")
         return None
 
@@ -63,17 +63,10 @@ def validate_src_ip6_address(self, ip6_src, ip6_dst):
             self.logger.warning("Unable to sent out IPv6 packet, no stack link local unicast IPv6 address available")
             return None
 
-    # If source is unspecified check if destination belongs to any of local networks, if so pick source address from that network
+    # If source is unspecified pick it from the route to destination, route to local network is preferred over the one via gateway
     if ip6_src.is_unspecified:
-        for stack_ip6_address in self.ip6_address:
-            if ip6_dst in stack_ip6_address.network:
-                return stack_ip6_address.ip
-
-    # If source unspcified and destination is external pick source from first network that has default gateway set
-    if ip6_src.is_unspecified:
-        for stack_ip6_address in self.ip6_address:
-            if stack_ip6_address.gateway:
-                return stack_ip6_address.ip
+        if route := self.ip6_route_table.find_route(ip6_dst):
+            return route.ip_src
 
     return ip6_src
 
@@ -90,7 +83,7 @@ def validate_dst_ip6_address(self, ip6_dst):
 
 
 def phtx_ip6(self, child_packet, ip6_dst, ip6_src, ip6_hop=config.ip6_default_hop):
-    """ Handle outbound IP packets """
+    """ Handle outbound IP packets, return Ethernet packet carrying the IP packet if it has been sent out unfragmented """
 
     # Check if IPv6 protocol support is enabled, if not then silently drop the packet
     if not config.ip6_support:
@@ -110,13 +103,12 @@ def phtx_ip6(self, child_packet, ip6_dst, ip6_src, ip6_hop=config.ip6_default_ho
     if not ip6_dst:
         return
 
-    # Check if IP packet can be sent out without fragmentation, if so send it out
-    if ps_ip6.IP6_HEADER_LEN + len(child_packet.raw_packet) <= config.mtu:
+    # Check if IP packet can be sent out without fragmentation (or it is TCP super-segment to be split by kernel), if so send it out
+    if ps_ip6.IP6_HEADER_LEN + len(child_packet) <= config.mtu or (child_packet.protocol == "TCP" and child_packet.tcp_gso_size):
         ip6_packet_tx = ps_ip6.Ip6Packet(ip6_src=ip6_src, ip6_dst=ip6_dst, ip6_hop=ip6_hop, child_packet=child_packet)
 
         self.logger.debug(f"{ip6_packet_tx.tracker} - {ip6_packet_tx}")
-        self.phtx_ether(child_packet=ip6_packet_tx)
-        return
+        return self.phtx_ether(child_packet=ip6_packet_tx, ip_src=ip6_src, ip_dst=ip6_dst)
 
     # Fragment packet and send all fragments out *** Need to add this functionality ***
     self.logger.debug("Packet exceedes available MTU, IPv6 fragmentation needed... droping...")
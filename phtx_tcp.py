@@ -42,11 +42,13 @@
 
 
 import config
+import ps_ether
+from flow_template import FLOW_TEMPLATE_CACHE_SIZE, FlowFrame, FlowTemplate
 from ipv4_address import IPv4Address
 from ipv6_address import IPv6Address
+from phtx_ip4 import pick_ip4_packet_id
 from ps_tcp import TcpOptMss, TcpOptNop, TcpOptWscale, TcpPacket
-
-PACKET_LOSS = False
+from tracker import Tracker
 
 
 def phtx_tcp(
@@ -72,8 +74,9 @@ def phtx_tcp(
     raw_data=b"",
     tracker=None,
     echo_tracker=None,
+    tcp_gso_size=None,
 ):
-    """ Handle outbound TCP packets """
+    """ Handle outbound TCP packets, tcp_gso_size is set when data is sent as super-segment to be split by kernel """
 
     # Check if IPv4 protocol support is enabled, if not then silently drop the IPv4 packet
     if not config.ip4_support and ip_dst.version == 4:
@@ -83,6 +86,39 @@ def phtx_tcp(
     if not config.ip6_support and ip_dst.version == 6:
         return
 
+    # Segment of flow that has already been sent out gets assembled straight out of flow's header template, unless it carries options or needs fragmentation
+    flow_key = ("TCP", ip_src, ip_dst, tcp_sport, tcp_dport)
+    if (
+        not tcp_mss
+        and (flow_template := self.tx_flow_templates.get(flow_key, None))
+        and flow_template.hlen - ps_ether.ETHER_HEADER_LEN + len(raw_data) <= config.mtu
+    ):
+        tracker = tracker or Tracker("TX", echo_tracker)
+        self.logger.opt(ansi=True).info(
+            f"<magenta>{tracker}</magenta> - TCP {tcp_sport} > {tcp_dport}, seq {tcp_seq}, ack {tcp_ack}, win {tcp_win}, dlen {len(raw_data)} (flow template)"
+        )
+        frame = flow_template.assemble_tcp(
+            ip4_packet_id=pick_ip4_packet_id(self) if flow_template.ip_version == 4 else 0,
+            tcp_seq=tcp_seq,
+            tcp_ack=tcp_ack,
+            tcp_flags=tcp_flag_ns << 8
+            | tcp_flag_crw << 7
+            | tcp_flag_ece << 6
+            | tcp_flag_urg << 5
+            | tcp_flag_ack << 4
+            | tcp_flag_psh << 3
+            | tcp_flag_rst << 2
+            | tcp_flag_syn << 1
+            | tcp_flag_fin,
+            tcp_win=tcp_win,
+            tcp_urp=tcp_urp,
+            raw_data=raw_data,
+        )
+        if flow_template.neighbor_entry:
+            flow_template.neighbor_entry.hit_count += 1
+        self.tx_ring.enqueue(FlowFrame(frame, tracker))
+        return
+
     tcp_options = []
 
     if tcp_mss:
@@ -110,23 +146,24 @@ def phtx_tcp(
         raw_data=raw_data,
         tracker=tracker,
         echo_tracker=echo_tracker,
+        tcp_gso_size=tcp_gso_size if config.tap_vnet_hdr else None,
     )
 
     self.logger.opt(ansi=True).info(f"<magenta>{tcp_packet_tx.tracker}</magenta> - {tcp_packet_tx}")
 
-    # Check if packet should be dropped due to random packet loss enabled (for TCP retansmission testing)
-    if PACKET_LOSS:
-        from random import randint
-
-        if randint(0, 99) == 7:
-            self.logger.critical("SIMULATED LOST TX DATA PACKET")
-            return
-
     assert type(ip_src) in {IPv4Address, IPv6Address}
     assert type(ip_dst) in {IPv4Address, IPv6Address}
 
+    ether_packet_tx = None
+
     if ip_src.version == 6 and ip_dst.version == 6:
-        self.phtx_ip6(ip6_src=ip_src, ip6_dst=ip_dst, child_packet=tcp_packet_tx)
+        ether_packet_tx = self.phtx_ip6(ip6_src=ip_src, ip6_dst=ip_dst, child_packet=tcp_packet_tx)
 
     if ip_src.version == 4 and ip_dst.version == 4:
-        self.phtx_ip4(ip4_src=ip_src, ip4_dst=ip_dst, child_packet=tcp_packet_tx)
+        ether_packet_tx = self.phtx_ip4(ip4_src=ip_src, ip4_dst=ip_dst, child_packet=tcp_packet_tx)
+
+    # Capture header template of the flow once its segment without options has been sent out (templates don't support TAP offloads)
+    if ether_packet_tx and not tcp_options and not config.tap_vnet_hdr:
+        if len(self.tx_flow_templates) >= FLOW_TEMPLATE_CACHE_SIZE:
+            self.tx_flow_templates.clear()
+        self.tx_flow_templates[flow_key] = FlowTemplate(ether_packet_tx, self.tx_ether_dst_cache)
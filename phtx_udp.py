@@ -42,9 +42,13 @@
 
 
 import config
+import ps_ether
 import ps_udp
+from flow_template import FLOW_TEMPLATE_CACHE_SIZE, FlowFrame, FlowTemplate
 from ipv4_address import IPv4Address
 from ipv6_address import IPv6Address
+from phtx_ip4 import pick_ip4_packet_id
+from tracker import Tracker
 
 
 def phtx_udp(self, ip_src, ip_dst, udp_sport, udp_dport, raw_data=b"", echo_tracker=None):
@@ -58,6 +62,19 @@ def phtx_udp(self, ip_src, ip_dst, udp_sport, udp_dport, raw_data=b"", echo_trac
     if not config.ip6_support and ip_dst.version == 6:
         return
 
+    # Datagram of flow that has already been sent out gets assembled straight out of flow's header template, unless it needs fragmentation
+    flow_key = ("UDP", ip_src, ip_dst, udp_sport, udp_dport)
+    if (flow_template := self.tx_flow_templates.get(flow_key, None)) and flow_template.hlen - ps_ether.ETHER_HEADER_LEN + len(raw_data) <= config.mtu:
+        tracker = Tracker("TX", echo_tracker)
+        self.logger.opt(ansi=True).info(
+            f"<magenta>{tracker}</magenta> - UDP {udp_sport} > {udp_dport}, len {ps_udp.UDP_HEADER_LEN + len(raw_data)} (flow template)"
+        )
+        frame = flow_template.assemble_udp(ip4_packet_id=pick_ip4_packet_id(self) if flow_template.ip_version == 4 else 0, raw_data=raw_data)
+        if flow_template.neighbor_entry:
+            flow_template.neighbor_entry.hit_count += 1
+        self.tx_ring.enqueue(FlowFrame(frame, tracker))
+        return
+
     udp_packet_tx = ps_udp.UdpPacket(udp_sport=udp_sport, udp_dport=udp_dport, raw_data=raw_data, echo_tracker=echo_tracker)
 
     self.logger.opt(ansi=True).info(f"<magenta>{udp_packet_tx.tracker}</magenta> - {udp_packet_tx}")
@@ -65,8 +82,16 @@ def phtx_udp(self, ip_src, ip_dst, udp_sport, udp_dport, raw_data=b"", echo_trac
     assert type(ip_src) in {IPv4Address, IPv6Address}
     assert type(ip_dst) in {IPv4Address, IPv6Address}
 
+    ether_packet_tx = None
+
     if ip_src.version == 6 and ip_dst.version == 6:
-        self.phtx_ip6(ip6_src=ip_src, ip6_dst=ip_dst, child_packet=udp_packet_tx)
+        ether_packet_tx = self.phtx_ip6(ip6_src=ip_src, ip6_dst=ip_dst, child_packet=udp_packet_tx)
 
     if ip_src.version == 4 and ip_dst.version == 4:
-        self.phtx_ip4(ip4_src=ip_src, ip4_dst=ip_dst, child_packet=udp_packet_tx)
+        ether_packet_tx = self.phtx_ip4(ip4_src=ip_src, ip4_dst=ip_dst, child_packet=udp_packet_tx)
+
+    # Capture header template of the flow once its datagram has been sent out (templates don't support TAP offloads)
+    if ether_packet_tx and not config.tap_vnet_hdr:
+        if len(self.tx_flow_templates) >= FLOW_TEMPLATE_CACHE_SIZE:
+            self.tx_flow_templates.clear()
+        self.tx_flow_templates[flow_key] = FlowTemplate(ether_packet_tx, self.tx_ether_dst_cache)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyTCP - Python TCP/IP stack                                             #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyTCP                   #
+#                                                                          #
+############################################################################
+
+##############################################################################################
+#                                                                                            #
+#  This program is a work in progress and it changes on daily basis due to new features      #
+#  being implemented, changes being made to already implemented features, bug fixes, etc.    #
+#  Therefore if the current version is not working as expected try to clone it again the     #
+#  next day or shoot me an email describing the problem. Any input is appreciated. Also      #
+#  keep in mind that some features may be implemented only partially (as needed for stack    #
+#  operation) or they may be implemented in sub-optimal or not 100% RFC compliant way (due   #
+#  to lack of time) or last but not least they may contain bug(s) that i didn't notice yet.  #
+#                                                                                            #
+##############################################################################################
+
+
+#
+# port_allocator.py - module contains class supporting allocation of ephemeral ports
+#
+
+
+import errno
+import random
+import threading
+
+from ip_helper import ip_pick_version
+from ipv4_address import IPv4Address
+from ipv6_address import IPv6Address
+
+
+class PortAllocator:
+    """ Allocate ephemeral ports out of the configured range, ports in use are kept as bitmap per local address """
+
+    def __init__(self, port_range):
+        """ Class constructor """
+
+        self.port_min, self.port_max = port_range
+        self.port_mask = (1 << (self.port_max - self.port_min + 1)) - 1
+
+        self.bitmaps = {}  # Bitmap of ports in use per local address, None key holds ports of sessions / sockets bound to '*'
+        self.bindings = {}  # Number of sessions / sockets holding each (local address, port) binding, explicitly bound port can be shared
+
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def __local_key(local_ip_address):
+        """ Return address object used as bitmap key, None stands for '*' wildcard """
+
+        return None if local_ip_address in {None, "*"} else ip_pick_version(local_ip_address)
+
+    def __used_ports(self, local_key):
+        """ Return bitmap of ports that can't be allocated for given local address as they would overlap with ports already in use """
+
+        # Wildcard address overlaps with every other one, unspecified address overlaps with every address of its IP version
+        if local_key is None:
+            bitmaps = self.bitmaps.values()
+        elif local_key.is_unspecified:
+            bitmaps = [bitmap for key, bitmap in self.bitmaps.items() if key is None or key.version == local_key.version]
+        else:
+            bitmaps = [self.bitmaps.get(_, 0) for _ in (local_key, IPv6Address("::") if local_key.version == 6 else IPv4Address("0.0.0.0"), None)]
+
+        used_ports = 0
+        for bitmap in bitmaps:
+            used_ports |= bitmap
+        return used_ports
+
+    def __take(self, local_key, bit):
+        """ Add holder of the port binding, mark port as used for given local address """
+
+        self.bindings[(local_key, bit)] = self.bindings.get((local_key, bit), 0) + 1
+        self.bitmaps[local_key] = self.bitmaps.get(local_key, 0) | 1 << bit
+
+    def reserve(self, local_ip_address):
+        """ Reserve random free port for given local address, raise OSError if whole range is in use """
+
+        local_key = self.__local_key(local_ip_address)
+
+        with self.lock:
+            if not (free_ports := ~self.__used_ports(local_key) & self.port_mask):
+                raise OSError(errno.EADDRNOTAVAIL, f"No free ephemeral port left for local address {local_ip_address}")
+
+            # Pick first free port following randomly chosen start, wrap around to the beginning of range if there is none
+            start = random.randint(0, self.port_max - self.port_min)
+            if not (candidates := free_ports >> start << start):
+                candidates = free_ports
+            bit = (candidates & -candidates).bit_length() - 1
+
+            self.__take(local_key, bit)
+            return self.port_min + bit
+
+    def bind(self, local_ip_address, port):
+        """ Mark port bound explicitly to given local address as used so it's not handed out as ephemeral one, ports out of range are not tracked """
+
+        if not self.port_min <= port <= self.port_max:
+            return
+
+        local_key = self.__local_key(local_ip_address)
+
+        with self.lock:
+            self.__take(local_key, port - self.port_min)
+
+    def release(self, local_ip_address, port):
+        """ Drop reserved or explicitly bound port, it returns to the pool of free ports of given local address once its last holder releases it """
+
+        if not self.port_min <= port <= self.port_max:
+            return
+
+        local_key = self.__local_key(local_ip_address)
+        bit = port - self.port_min
+
+        with self.lock:
+            if (count := self.bindings.pop((local_key, bit), 0)) > 1:
+                self.bindings[(local_key, bit)] = count - 1
+                return
+
+            if bitmap := self.bitmaps.get(local_key, 0) & ~(1 << bit):
+                self.bitmaps[local_key] = bitmap
+            else:
+                self.bitmaps.pop(local_key, None)
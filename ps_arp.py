@@ -47,6 +47,7 @@ import loguru
 
 import config
 from ipv4_address import IPv4Address
+from mac_address import MAC_UNSPECIFIED, MacAddress
 from tracker import Tracker
 
 # ARP packet header - IPv4 stack version only
@@ -70,6 +71,8 @@ from tracker import Tracker
 
 ARP_HEADER_LEN = 28
 
+ARP_HEADER_STRUCT = struct.Struct("! HH BBH 6s 4s 6s 4s")
+
 ARP_OP_REQUEST = 1
 ARP_OP_REPLY = 2
 
@@ -79,7 +82,7 @@ class ArpPacket:
 
     protocol = "ARP"
 
-    def __init__(self, parent_packet=None, arp_sha=None, arp_spa=None, arp_tpa=None, arp_tha="00:00:00:00:00:00", arp_oper=ARP_OP_REQUEST, echo_tracker=None):
+    def __init__(self, parent_packet=None, arp_sha=None, arp_spa=None, arp_tpa=None, arp_tha=MAC_UNSPECIFIED, arp_oper=ARP_OP_REQUEST, echo_tracker=None):
         """ Class constructor """
 
         self.logger = loguru.logger.bind(object_name="ps_arp.")
@@ -102,9 +105,9 @@ class ArpPacket:
             self.arp_hrlen = raw_header[4]
             self.arp_prlen = raw_header[5]
             self.arp_oper = struct.unpack("!H", raw_header[6:8])[0]
-            self.arp_sha = ":".join([f"{_:0>2x}" for _ in raw_header[8:14]])
+            self.arp_sha = MacAddress(raw_header[8:14])
             self.arp_spa = IPv4Address(raw_header[14:18])
-            self.arp_tha = ":".join([f"{_:0>2x}" for _ in raw_header[18:24]])
+            self.arp_tha = MacAddress(raw_header[18:24])
             self.arp_tpa = IPv4Address(raw_header[24:28])
 
             if not self.__post_parse_sanity_check():
@@ -119,9 +122,9 @@ class ArpPacket:
             self.arp_hrlen = 6
             self.arp_prlen = 4
             self.arp_oper = arp_oper
-            self.arp_sha = arp_sha
+            self.arp_sha = MacAddress(arp_sha)
             self.arp_spa = IPv4Address(arp_spa)
-            self.arp_tha = arp_tha
+            self.arp_tha = MacAddress(arp_tha)
             self.arp_tpa = IPv4Address(arp_tpa)
 
     def __str__(self):
@@ -136,35 +139,31 @@ class ArpPacket:
     def __len__(self):
         """ Length of the packet """
 
-        return len(self.raw_packet)
+        return ARP_HEADER_LEN
 
-    @property
-    def raw_header(self):
-        """ Packet header in raw format """
+    def assemble_packet(self, frame, hptr):
+        """ Write packet into frame buffer at given offset """
 
-        return struct.pack(
-            "!HH BBH 6s 4s 6s 4s",
+        ARP_HEADER_STRUCT.pack_into(
+            frame,
+            hptr,
             self.arp_hrtype,
             self.arp_prtype,
             self.arp_hrlen,
             self.arp_prlen,
             self.arp_oper,
-            bytes.fromhex(self.arp_sha.replace(":", "")),
+            self.arp_sha,
             IPv4Address(self.arp_spa).packed,
-            bytes.fromhex(self.arp_tha.replace(":", "")),
+            self.arp_tha,
             IPv4Address(self.arp_tpa).packed,
         )
 
-    @property
-    def raw_packet(self):
-        """ Get packet in raw format """
-
-        return self.raw_header
-
     def get_raw_packet(self):
         """ Get packet in raw format ready to be processed by lower level protocol """
 
-        return self.raw_packet
+        raw_packet = bytearray(len(self))
+        self.assemble_packet(raw_packet, 0)
+        return raw_packet
 
     def __pre_parse_sanity_check(self, raw_packet):
         """ Preliminary sanity check to be run on raw ARP packet prior to packet parsing """
@@ -45,6 +45,7 @@ import binascii
 import struct
 
 from ipv4_address import IPv4Address
+from mac_address import MacAddress
 
 # DHCP packet header (RFC 2131)
 
@@ -296,7 +297,7 @@ class DhcpPacket:
             self.dhcp_yiaddr.packed,
             self.dhcp_siaddr.packed,
             self.dhcp_giaddr.packed,
-            (bytes.fromhex(self.dhcp_chaddr.replace(":", "")) + b"\0" * 16)[:16],
+            (MacAddress(self.dhcp_chaddr) + b"\0" * 16)[:16],
             self.dhcp_sname,
             self.dhcp_file,
             b"\x63\x82\x53\x63",
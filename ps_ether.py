@@ -42,10 +42,12 @@
 
 
 import struct
+from functools import cached_property
 
 import loguru
 
 import config
+from mac_address import MAC_UNSPECIFIED, MacAddress
 from tracker import Tracker
 
 # Ethernet packet header
@@ -63,6 +65,8 @@ from tracker import Tracker
 
 ETHER_HEADER_LEN = 14
 
+ETHER_HEADER_STRUCT = struct.Struct("! 6s 6s H")
+
 ETHER_TYPE_MIN = 0x0600
 ETHER_TYPE_ARP = 0x0806
 ETHER_TYPE_IP4 = 0x0800
@@ -77,8 +81,8 @@ class EtherPacket:
 
     protocol = "ETHER"
 
-    def __init__(self, raw_packet=None, ether_src="00:00:00:00:00:00", ether_dst="00:00:00:00:00:00", child_packet=None):
-        """ Class constructor """
+    def __init__(self, raw_packet=None, ether_src=MAC_UNSPECIFIED, ether_dst=MAC_UNSPECIFIED, child_packet=None, vnet_hdr=None):
+        """ Class constructor, vnet_hdr carries offload information received from / to be passed to TAP interface """
 
         self.logger = loguru.logger.bind(object_name="ps_ether.")
         self.sanity_check_failed = False
@@ -86,27 +90,30 @@ class EtherPacket:
         # Packet parsing
         if raw_packet:
             self.tracker = Tracker("RX")
+            self.child_packet = None
 
-            if not self.__pre_parse_sanity_check(raw_packet):
-                self.sanity_check_failed = True
-                return
+            # Checksums of packet that has been validated by kernel (or generated locally without them) don't need to be validated again
+            self.vnet_hdr = vnet_hdr
+            self.cksum_verified = bool(vnet_hdr and vnet_hdr.cksum_verified)
 
-            raw_header = raw_packet[:ETHER_HEADER_LEN]
+            # All protocol layers share received frame buffer, header fields are parsed from it on first access (see cached properties below)
+            # and payload handed over to upper layer is just a view into it
+            self.packet_view = memoryview(raw_packet)
 
-            self.raw_data = raw_packet[ETHER_HEADER_LEN:]
-            self.ether_dst = ":".join([f"{_:0>2x}" for _ in raw_header[0:6]])
-            self.ether_src = ":".join([f"{_:0>2x}" for _ in raw_header[6:12]])
-            self.ether_type = struct.unpack("!H", raw_header[12:14])[0]
+            if not self.__pre_parse_sanity_check(self.packet_view):
+                self.sanity_check_failed = True
+                return
 
             if not self.__post_parse_sanity_check():
                 self.sanity_check_failed = True
 
         # Packet building
         else:
+            self.packet_view = None
             self.tracker = child_packet.tracker
 
-            self.ether_dst = ether_dst
-            self.ether_src = ether_src
+            self.ether_dst = MacAddress(ether_dst)
+            self.ether_src = MacAddress(ether_src)
 
             assert child_packet.protocol in {"IPv6", "IPv4", "ARP"}, f"Not supported protocol: {child_packet.protocol}"
 
@@ -119,7 +126,15 @@ class EtherPacket:
             if child_packet.protocol == "ARP":
                 self.ether_type = ETHER_TYPE_ARP
 
-            self.raw_data = child_packet.get_raw_packet()
+            # Child packet is not serialized here, whole frame gets assembled into single buffer right before it is sent out
+            self.child_packet = child_packet
+
+            # Pass offload information of IP packet down to TX ring, adjusting its offsets by the Ethernet header
+            self.cksum_verified = False
+            if child_packet.protocol in {"IPv6", "IPv4"} and child_packet.vnet_hdr:
+                self.vnet_hdr = child_packet.vnet_hdr.encapsulate(ETHER_HEADER_LEN)
+            else:
+                self.vnet_hdr = None
 
     def __str__(self):
         """ Short packet log string """
@@ -129,19 +144,53 @@ class EtherPacket:
     def __len__(self):
         """ Length of the packet """
 
-        return len(self.raw_packet)
+        return ETHER_HEADER_LEN + len(self.child_packet) if self.packet_view is None else len(self.packet_view)
+
+    @cached_property
+    def ether_dst(self):
+        """ Parse 'Destination MAC address' field of received packet """
+
+        return MacAddress(self.packet_view[0:6])
+
+    @cached_property
+    def ether_src(self):
+        """ Parse 'Source MAC address' field of received packet """
 
-    @property
-    def raw_header(self):
-        """ Packet header in raw format """
+        return MacAddress(self.packet_view[6:12])
 
-        return struct.pack("! 6s 6s H", bytes.fromhex(self.ether_dst.replace(":", "")), bytes.fromhex(self.ether_src.replace(":", "")), self.ether_type)
+    @cached_property
+    def ether_type(self):
+        """ Parse 'EtherType' field of received packet """
 
-    @property
+        return struct.unpack_from("!H", self.packet_view, 12)[0]
+
+    @cached_property
+    def raw_data(self):
+        """ Payload of received packet, for packet being built it's its child packet in raw format """
+
+        if self.packet_view is None:
+            return self.child_packet.get_raw_packet()
+
+        return self.packet_view[ETHER_HEADER_LEN:]
+
+    def assemble_packet(self, frame, hptr):
+        """ Write packet into frame buffer at given offset, child packet writes itself right after the header into the same buffer """
+
+        ETHER_HEADER_STRUCT.pack_into(frame, hptr, self.ether_dst, self.ether_src, self.ether_type)
+        self.child_packet.assemble_packet(frame, hptr + ETHER_HEADER_LEN)
+
+    @cached_property
     def raw_packet(self):
-        """ Packet in raw format """
+        """ Packet in raw format, frame length is computed upfront so the buffer is allocated only once, memoized until dropped by drop_raw_packet() """
+
+        frame = bytearray(len(self))
+        self.assemble_packet(frame, 0)
+        return frame
+
+    def drop_raw_packet(self):
+        """ Drop memoized raw form of the packet, to be called whenever any of its fields gets changed after the packet has been created """
 
-        return self.raw_header + self.raw_data
+        self.__dict__.pop("raw_packet", None)
 
     def get_raw_packet(self):
         """ Get packet in raw frmat ready to be sent out """
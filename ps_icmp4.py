@@ -108,6 +108,17 @@ ICMP4_UNREACHABLE__SOURCE_ROUTE_FAILED = 5
 ICMP4_ECHOREQUEST = 8
 
 
+ICMP4_HEADER_LEN = 4
+ICMP4_ECHO_LEN = 8
+ICMP4_UNREACHABLE_LEN = 8
+
+ICMP4_CKSUM_OFFSET = 2
+
+ICMP4_HEADER_STRUCT = struct.Struct("! BBH")
+ICMP4_ECHO_STRUCT = struct.Struct("! BBH HH")
+ICMP4_UNREACHABLE_STRUCT = struct.Struct("! BBH L")
+
+
 class Icmp4Packet:
     """ ICMPv4 packet support class """
 
@@ -204,7 +215,13 @@ class Icmp4Packet:
     def __len__(self):
         """ Length of the packet """
 
-        return len(self.raw_packet)
+        if self.icmp4_type in {ICMP4_ECHOREPLY, ICMP4_ECHOREQUEST}:
+            return ICMP4_ECHO_LEN + len(self.icmp4_ec_raw_data)
+
+        if self.icmp4_type == ICMP4_UNREACHABLE and self.icmp4_code == ICMP4_UNREACHABLE__PORT:
+            return ICMP4_UNREACHABLE_LEN + len(self.icmp4_un_raw_data)
+
+        return ICMP4_HEADER_LEN + len(self.unknown_message)
 
     @property
     def raw_packet(self):
@@ -212,28 +229,46 @@ class Icmp4Packet:
 
         if self.icmp4_type == ICMP4_ECHOREPLY:
             raw_packet = (
-                struct.pack("! BBH HH", self.icmp4_type, self.icmp4_code, self.icmp4_cksum, self.icmp4_ec_id, self.icmp4_ec_seq) + self.icmp4_ec_raw_data
+                ICMP4_ECHO_STRUCT.pack(self.icmp4_type, self.icmp4_code, self.icmp4_cksum, self.icmp4_ec_id, self.icmp4_ec_seq) + self.icmp4_ec_raw_data
             )
 
         elif self.icmp4_type == ICMP4_UNREACHABLE and self.icmp4_code == ICMP4_UNREACHABLE__PORT:
-            raw_packet = struct.pack("! BBH L", self.icmp4_type, self.icmp4_code, self.icmp4_cksum, self.icmp4_un_reserved) + self.icmp4_un_raw_data
+            raw_packet = ICMP4_UNREACHABLE_STRUCT.pack(self.icmp4_type, self.icmp4_code, self.icmp4_cksum, self.icmp4_un_reserved) + self.icmp4_un_raw_data
 
         elif self.icmp4_type == ICMP4_ECHOREQUEST:
             raw_packet = (
-                struct.pack("! BBH HH", self.icmp4_type, self.icmp4_code, self.icmp4_cksum, self.icmp4_ec_id, self.icmp4_ec_seq) + self.icmp4_ec_raw_data
+                ICMP4_ECHO_STRUCT.pack(self.icmp4_type, self.icmp4_code, self.icmp4_cksum, self.icmp4_ec_id, self.icmp4_ec_seq) + self.icmp4_ec_raw_data
             )
 
         else:
-            raw_packet = struct.pack("! BBH", self.icmp4_type, self.icmp4_code, self.icmp4_cksum) + self.unknown_message
+            raw_packet = ICMP4_HEADER_STRUCT.pack(self.icmp4_type, self.icmp4_code, self.icmp4_cksum) + self.unknown_message
 
         return raw_packet
 
+    def assemble_packet(self, frame, hptr):
+        """ Write packet into frame buffer at given offset """
+
+        if self.icmp4_type in {ICMP4_ECHOREPLY, ICMP4_ECHOREQUEST}:
+            ICMP4_ECHO_STRUCT.pack_into(frame, hptr, self.icmp4_type, self.icmp4_code, 0, self.icmp4_ec_id, self.icmp4_ec_seq)
+            frame[hptr + ICMP4_ECHO_LEN : hptr + len(self)] = self.icmp4_ec_raw_data
+
+        elif self.icmp4_type == ICMP4_UNREACHABLE and self.icmp4_code == ICMP4_UNREACHABLE__PORT:
+            ICMP4_UNREACHABLE_STRUCT.pack_into(frame, hptr, self.icmp4_type, self.icmp4_code, 0, self.icmp4_un_reserved)
+            frame[hptr + ICMP4_UNREACHABLE_LEN : hptr + len(self)] = self.icmp4_un_raw_data
+
+        else:
+            ICMP4_HEADER_STRUCT.pack_into(frame, hptr, self.icmp4_type, self.icmp4_code, 0)
+            frame[hptr + ICMP4_HEADER_LEN : hptr + len(self)] = self.unknown_message
+
+        self.icmp4_cksum = inet_cksum(memoryview(frame)[hptr : hptr + len(self)])
+        struct.pack_into("!H", frame, hptr + ICMP4_CKSUM_OFFSET, self.icmp4_cksum)
+
     def get_raw_packet(self):
         """ Get packet in raw format ready to be processed by lower level protocol """
 
-        self.icmp4_cksum = inet_cksum(self.raw_packet)
-
-        return self.raw_packet
+        raw_packet = bytearray(len(self))
+        self.assemble_packet(raw_packet, 0)
+        return raw_packet
 
     def validate_cksum(self):
         """ Validate packet checksum """
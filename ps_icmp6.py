@@ -42,12 +42,14 @@
 
 
 import struct
+from functools import cached_property
 
 import loguru
 
 import config
-from ip_helper import inet_cksum
+from ip_helper import inet_cksum, inet_sum
 from ipv6_address import IPv6Address, IPv6Network
+from mac_address import MacAddress
 from tracker import Tracker
 
 # Destination Unreachable message (1/[0-6])
@@ -319,6 +321,22 @@ ICMP6_NEIGHBOR_ADVERTISEMENT = 136
 ICMP6_MLD2_REPORT = 143
 
 
+ICMP6_HEADER_LEN = 4
+ICMP6_ECHO_LEN = 8
+ICMP6_UNREACHABLE_LEN = 8
+ICMP6_ROUTER_SOLICITATION_LEN = 8
+ICMP6_ROUTER_ADVERTISEMENT_LEN = 16
+ICMP6_NEIGHBOR_SOLICITATION_LEN = 24
+ICMP6_NEIGHBOR_ADVERTISEMENT_LEN = 24
+ICMP6_MLD2_REPORT_LEN = 8
+ICMP6_MLD2_RECORD_LEN = 20
+
+ICMP6_CKSUM_OFFSET = 2
+
+ICMP6_ECHO_STRUCT = struct.Struct("! BBH HH")
+ICMP6_UNREACHABLE_STRUCT = struct.Struct("! BBH L")
+
+
 ICMP6_MART_MODE_IS_INCLUDE = 1
 ICMP6_MART_MODE_IS_EXCLUDE = 2
 ICMP6_MART_CHANGE_TO_INCLUDE = 3
@@ -530,23 +548,44 @@ class Icmp6Packet:
     def __len__(self):
         """ Length of the packet """
 
-        return len(self.raw_packet)
+        if self.icmp6_type in {ICMP6_ECHOREQUEST, ICMP6_ECHOREPLY}:
+            return ICMP6_ECHO_LEN + len(self.icmp6_ec_raw_data)
+
+        if self.icmp6_type == ICMP6_UNREACHABLE:
+            return ICMP6_UNREACHABLE_LEN + len(self.icmp6_un_raw_data)
+
+        if self.icmp6_type == ICMP6_ROUTER_SOLICITATION:
+            return ICMP6_ROUTER_SOLICITATION_LEN + len(self.raw_nd_options)
+
+        if self.icmp6_type == ICMP6_ROUTER_ADVERTISEMENT:
+            return ICMP6_ROUTER_ADVERTISEMENT_LEN + len(self.raw_nd_options)
+
+        if self.icmp6_type == ICMP6_NEIGHBOR_SOLICITATION:
+            return ICMP6_NEIGHBOR_SOLICITATION_LEN + len(self.raw_nd_options)
+
+        if self.icmp6_type == ICMP6_NEIGHBOR_ADVERTISEMENT:
+            return ICMP6_NEIGHBOR_ADVERTISEMENT_LEN + len(self.raw_nd_options)
+
+        if self.icmp6_type == ICMP6_MLD2_REPORT:
+            return ICMP6_MLD2_REPORT_LEN + sum([len(_) for _ in self.icmp6_mlr2_multicast_address_record])
+
+        return ICMP6_HEADER_LEN + len(self.unknown_message)
 
     @property
     def raw_packet(self):
         """ Get packet in raw format """
 
         if self.icmp6_type == ICMP6_UNREACHABLE:
-            raw_packet = struct.pack("! BBH L", self.icmp6_type, self.icmp6_code, self.icmp6_cksum, self.icmp6_un_reserved) + self.icmp6_un_raw_data
+            raw_packet = ICMP6_UNREACHABLE_STRUCT.pack(self.icmp6_type, self.icmp6_code, self.icmp6_cksum, self.icmp6_un_reserved) + self.icmp6_un_raw_data
 
         elif self.icmp6_type == ICMP6_ECHOREQUEST:
             raw_packet = (
-                struct.pack("! BBH HH", self.icmp6_type, self.icmp6_code, self.icmp6_cksum, self.icmp6_ec_id, self.icmp6_ec_seq) + self.icmp6_ec_raw_data
+                ICMP6_ECHO_STRUCT.pack(self.icmp6_type, self.icmp6_code, self.icmp6_cksum, self.icmp6_ec_id, self.icmp6_ec_seq) + self.icmp6_ec_raw_data
             )
 
         elif self.icmp6_type == ICMP6_ECHOREPLY:
             raw_packet = (
-                struct.pack("! BBH HH", self.icmp6_type, self.icmp6_code, self.icmp6_cksum, self.icmp6_ec_id, self.icmp6_ec_seq) + self.icmp6_ec_raw_data
+                ICMP6_ECHO_STRUCT.pack(self.icmp6_type, self.icmp6_code, self.icmp6_cksum, self.icmp6_ec_id, self.icmp6_ec_seq) + self.icmp6_ec_raw_data
             )
 
         elif self.icmp6_type == ICMP6_ROUTER_SOLICITATION:
@@ -612,16 +651,37 @@ class Icmp6Packet:
 
         return raw_packet
 
+    def assemble_packet(self, frame, hptr, ip_pseudo_header):
+        """ Write packet into frame buffer at given offset """
+
+        plen = len(self)
+
+        if self.icmp6_type in {ICMP6_ECHOREQUEST, ICMP6_ECHOREPLY}:
+            ICMP6_ECHO_STRUCT.pack_into(frame, hptr, self.icmp6_type, self.icmp6_code, 0, self.icmp6_ec_id, self.icmp6_ec_seq)
+            frame[hptr + ICMP6_ECHO_LEN : hptr + plen] = self.icmp6_ec_raw_data
+
+        elif self.icmp6_type == ICMP6_UNREACHABLE:
+            ICMP6_UNREACHABLE_STRUCT.pack_into(frame, hptr, self.icmp6_type, self.icmp6_code, 0, self.icmp6_un_reserved)
+            frame[hptr + ICMP6_UNREACHABLE_LEN : hptr + plen] = self.icmp6_un_raw_data
+
+        # Neighbor Discovery and MLD messages are small and carry no payload, they are serialized as whole and copied into the frame
+        else:
+            frame[hptr : hptr + plen] = self.raw_packet
+            struct.pack_into("!H", frame, hptr + ICMP6_CKSUM_OFFSET, 0)
+
+        self.icmp6_cksum = inet_cksum(memoryview(frame)[hptr : hptr + plen], inet_sum(ip_pseudo_header))
+        struct.pack_into("!H", frame, hptr + ICMP6_CKSUM_OFFSET, self.icmp6_cksum)
+
     def get_raw_packet(self, ip_pseudo_header):
         """ Get packet in raw format ready to be processed by lower level protocol """
 
-        self.icmp6_cksum = inet_cksum(ip_pseudo_header + self.raw_packet)
-
-        return self.raw_packet
+        raw_packet = bytearray(len(self))
+        self.assemble_packet(raw_packet, 0, ip_pseudo_header)
+        return raw_packet
 
-    @property
+    @cached_property
     def raw_nd_options(self):
-        """ ICMPv6 ND packet options in raw format """
+        """ ICMPv6 ND packet options in raw format, options are not supposed to change once packet is created """
 
         raw_nd_options = b""
 
@@ -633,7 +693,7 @@ class Icmp6Packet:
     def validate_cksum(self, ip_pseudo_header):
         """ Validate packet checksum """
 
-        return not bool(inet_cksum(ip_pseudo_header + self.raw_packet))
+        return not bool(inet_cksum(self.raw_packet, inet_sum(ip_pseudo_header)))
 
     @staticmethod
     def __read_nd_options(raw_nd_options):
@@ -701,7 +761,7 @@ class Icmp6Packet:
         if not config.pre_parse_sanity_check:
             return True
 
-        if inet_cksum(pseudo_header + raw_packet):
+        if inet_cksum(raw_packet, inet_sum(pseudo_header)):
             self.logger.critical(f"{self.tracker} - ICMPv6 sanity check fail - wrong packet checksum")
             return False
 
@@ -952,15 +1012,15 @@ class Icmp6NdOptSLLA:
         if raw_option:
             self.opt_code = raw_option[0]
             self.opt_len = raw_option[1] << 3
-            self.opt_slla = ":".join([f"{_:0>2x}" for _ in raw_option[2:8]])
+            self.opt_slla = MacAddress(raw_option[2:8])
         else:
             self.opt_code = ICMP6_ND_OPT_SLLA
             self.opt_len = ICMP6_ND_OPT_SLLA_LEN
-            self.opt_slla = opt_slla
+            self.opt_slla = MacAddress(opt_slla)
 
     @property
     def raw_option(self):
-        return struct.pack("! BB 6s", self.opt_code, self.opt_len >> 3, bytes.fromhex(self.opt_slla.replace(":", "")))
+        return struct.pack("! BB 6s", self.opt_code, self.opt_len >> 3, self.opt_slla)
 
     def __str__(self):
         return f"slla {self.opt_slla}"
@@ -985,15 +1045,15 @@ class Icmp6NdOptTLLA:
         if raw_option:
             self.opt_code = raw_option[0]
             self.opt_len = raw_option[1] << 3
-            self.opt_tlla = ":".join([f"{_:0>2x}" for _ in raw_option[2:8]])
+            self.opt_tlla = MacAddress(raw_option[2:8])
         else:
             self.opt_code = ICMP6_ND_OPT_TLLA
             self.opt_len = ICMP6_ND_OPT_TLLA_LEN
-            self.opt_tlla = opt_tlla
+            self.opt_tlla = MacAddress(opt_tlla)
 
     @property
     def raw_option(self):
-        return struct.pack("! BB 6s", self.opt_code, self.opt_len >> 3, bytes.fromhex(self.opt_tlla.replace(":", "")))
+        return struct.pack("! BB 6s", self.opt_code, self.opt_len >> 3, self.opt_tlla)
 
     def __str__(self):
         return f"tlla {self.opt_tlla}"
@@ -1128,7 +1188,7 @@ class MulticastAddressRecord:
     def __len__(self):
         """ Length of raw record """
 
-        return len(self.raw_record)
+        return ICMP6_MLD2_RECORD_LEN + 16 * self.number_of_sources + len(self.aux_data)
 
     def __hash__(self):
         """ Hash of raw record """
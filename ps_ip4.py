@@ -42,12 +42,14 @@
 
 
 import struct
+from functools import cached_property
 
 import loguru
 
 import config
-from ip_helper import inet_cksum
+from ip_helper import inet_cksum, inet_sum
 from ipv4_address import IPv4Address
+from vnet_hdr import VNET_HDR_GSO_TCPV4
 
 # IPv4 protocol header
 
@@ -68,6 +70,11 @@ from ipv4_address import IPv4Address
 
 IP4_HEADER_LEN = 20
 
+IP4_CKSUM_OFFSET = 10
+
+IP4_HEADER_STRUCT = struct.Struct("! BBH HH BBH 4s 4s")
+IP4_PSEUDO_HEADER_STRUCT = struct.Struct("! 4s 4s BBH")
+
 IP4_PROTO_ICMP4 = 1
 IP4_PROTO_TCP = 6
 IP4_PROTO_UDP = 17
@@ -156,59 +163,22 @@ class Ip4Packet:
         # Packet parsing
         if parent_packet:
             self.tracker = parent_packet.tracker
+            self.cksum_verified = parent_packet.cksum_verified
+            self.child_packet = None
 
-            raw_packet = parent_packet.raw_data
+            self.packet_view = memoryview(parent_packet.raw_data)
 
-            if not self.__pre_parse_sanity_check(raw_packet):
+            if not self.__pre_parse_sanity_check(self.packet_view):
                 self.sanity_check_failed = True
                 return
 
-            raw_header = raw_packet[:IP4_HEADER_LEN]
-            raw_options = raw_packet[IP4_HEADER_LEN : (raw_packet[0] & 0b00001111) << 2]
-
-            self.raw_data = raw_packet[(raw_packet[0] & 0b00001111) << 2 : struct.unpack("!H", raw_header[2:4])[0]]
-
-            self.ip4_ver = raw_header[0] >> 4
-            self.ip4_hlen = (raw_header[0] & 0b00001111) << 2
-            self.ip4_dscp = (raw_header[1] & 0b11111100) >> 2
-            self.ip4_ecn = raw_header[1] & 0b00000011
-            self.ip4_plen = struct.unpack("!H", raw_header[2:4])[0]
-            self.ip4_packet_id = struct.unpack("!H", raw_header[4:6])[0]
-            self.ip4_flag_reserved = bool(struct.unpack("!H", raw_header[6:8])[0] & 0b1000000000000000)
-            self.ip4_flag_df = bool(struct.unpack("!H", raw_header[6:8])[0] & 0b0100000000000000)
-            self.ip4_flag_mf = bool(struct.unpack("!H", raw_header[6:8])[0] & 0b0010000000000000)
-            self.ip4_frag_offset = (struct.unpack("!H", raw_header[6:8])[0] & 0b0001111111111111) << 3
-            self.ip4_ttl = raw_header[8]
-            self.ip4_proto = raw_header[9]
-            self.ip4_cksum = struct.unpack("!H", raw_header[10:12])[0]
-            self.ip4_src = IPv4Address(raw_header[12:16])
-            self.ip4_dst = IPv4Address(raw_header[16:20])
-
-            self.ip4_options = []
-
-            opt_cls = {}
-
-            i = 0
-
-            while i < len(raw_options):
-
-                if raw_options[i] == IP4_OPT_EOL:
-                    self.ip4_options.append(Ip4OptEol())
-                    break
-
-                if raw_options[i] == IP4_OPT_NOP:
-                    self.ip4_options.append(Ip4OptNop())
-                    i += IP4_OPT_NOP_LEN
-                    continue
-
-                self.ip4_options.append(opt_cls.get(raw_options[i], Ip4OptUnk)(raw_options[i : i + raw_options[i + 1]]))
-                i += self.raw_options[i + 1]
-
             if not self.__post_parse_sanity_check():
                 self.sanity_check_failed = True
 
         # Packet building
         else:
+            self.packet_view = None
+
             if tracker:
                 self.tracker = tracker
             else:
@@ -235,23 +205,27 @@ class Ip4Packet:
 
             assert self.ip4_hlen % 4 == 0, "IP header len is not multiplcation of 4 bytes, check options"
 
+            self.vnet_hdr = None
+
+            # Child packet is not serialized here, it writes itself into the frame buffer when the whole frame gets assembled
+            self.child_packet = child_packet
+
             if child_packet:
                 assert child_packet.protocol in {"ICMPv4", "UDP", "TCP"}, f"Not supported protocol: {child_packet.protocol}"
 
                 if child_packet.protocol == "ICMPv4":
                     self.ip4_proto = IP4_PROTO_ICMP4
-                    self.raw_data = child_packet.get_raw_packet()
-                    self.ip4_plen = self.ip4_hlen + len(self.raw_data)
 
                 if child_packet.protocol == "UDP":
                     self.ip4_proto = IP4_PROTO_UDP
-                    self.ip4_plen = self.ip4_hlen + child_packet.udp_plen
-                    self.raw_data = child_packet.get_raw_packet(self.ip_pseudo_header)
 
                 if child_packet.protocol == "TCP":
                     self.ip4_proto = IP4_PROTO_TCP
-                    self.ip4_plen = self.ip4_hlen + child_packet.tcp_hlen + len(child_packet.raw_data)
-                    self.raw_data = child_packet.get_raw_packet(self.ip_pseudo_header)
+
+                self.ip4_plen = self.ip4_hlen + len(child_packet)
+
+                if config.tap_vnet_hdr and child_packet.protocol in {"UDP", "TCP"}:
+                    self.vnet_hdr = child_packet.get_vnet_hdr(VNET_HDR_GSO_TCPV4).encapsulate(self.ip4_hlen)
 
             else:
                 self.ip4_proto = ip4_proto
@@ -268,16 +242,139 @@ class Ip4Packet:
         )
 
     def __len__(self):
-        """ Length of the packet """
+        """ Length of the packet, received packet may have been reassembled from fragments so its length is taken from header """
+
+        return self.ip4_plen
+
+    @cached_property
+    def ip4_ver(self):
+        """ Parse 'Version' field of received packet """
+
+        return self.packet_view[0] >> 4
+
+    @cached_property
+    def ip4_hlen(self):
+        """ Parse 'Internet Header Length' field of received packet """
+
+        return (self.packet_view[0] & 0b00001111) << 2
+
+    @cached_property
+    def ip4_dscp(self):
+        """ Parse 'DSCP' field of received packet """
+
+        return (self.packet_view[1] & 0b11111100) >> 2
+
+    @cached_property
+    def ip4_ecn(self):
+        """ Parse 'ECN' field of received packet """
+
+        return self.packet_view[1] & 0b00000011
+
+    @cached_property
+    def ip4_plen(self):
+        """ Parse 'Total Length' field of received packet """
+
+        return struct.unpack_from("!H", self.packet_view, 2)[0]
+
+    @cached_property
+    def ip4_packet_id(self):
+        """ Parse 'Identification' field of received packet """
+
+        return struct.unpack_from("!H", self.packet_view, 4)[0]
+
+    @cached_property
+    def ip4_flag_reserved(self):
+        """ Parse 'Reserved' flag of received packet """
+
+        return bool(self.packet_view[6] & 0b10000000)
+
+    @cached_property
+    def ip4_flag_df(self):
+        """ Parse 'Don't Fragment' flag of received packet """
+
+        return bool(self.packet_view[6] & 0b01000000)
+
+    @cached_property
+    def ip4_flag_mf(self):
+        """ Parse 'More Fragments' flag of received packet """
+
+        return bool(self.packet_view[6] & 0b00100000)
+
+    @cached_property
+    def ip4_frag_offset(self):
+        """ Parse 'Fragment Offset' field of received packet """
+
+        return (struct.unpack_from("!H", self.packet_view, 6)[0] & 0b0001111111111111) << 3
+
+    @cached_property
+    def ip4_ttl(self):
+        """ Parse 'Time to Live' field of received packet """
+
+        return self.packet_view[8]
+
+    @cached_property
+    def ip4_proto(self):
+        """ Parse 'Protocol' field of received packet """
+
+        return self.packet_view[9]
+
+    @cached_property
+    def ip4_cksum(self):
+        """ Parse 'Header Checksum' field of received packet """
+
+        return struct.unpack_from("!H", self.packet_view, 10)[0]
 
-        return len(self.raw_packet)
+    @cached_property
+    def ip4_src(self):
+        """ Parse 'Source Address' field of received packet """
+
+        return IPv4Address(self.packet_view[12:16])
+
+    @cached_property
+    def ip4_dst(self):
+        """ Parse 'Destination Address' field of received packet """
+
+        return IPv4Address(self.packet_view[16:20])
+
+    @cached_property
+    def ip4_options(self):
+        """ Parse options of received packet """
+
+        raw_options = self.packet_view[IP4_HEADER_LEN : self.ip4_hlen]
+
+        ip4_options = []
+
+        opt_cls = {}
+
+        i = 0
+
+        while i < len(raw_options):
+
+            if raw_options[i] == IP4_OPT_EOL:
+                ip4_options.append(Ip4OptEol())
+                break
+
+            if raw_options[i] == IP4_OPT_NOP:
+                ip4_options.append(Ip4OptNop())
+                i += IP4_OPT_NOP_LEN
+                continue
+
+            ip4_options.append(opt_cls.get(raw_options[i], Ip4OptUnk)(raw_options[i : i + raw_options[i + 1]]))
+            i += raw_options[i + 1]
+
+        return ip4_options
+
+    @cached_property
+    def raw_data(self):
+        """ Payload of received packet """
+
+        return self.packet_view[self.ip4_hlen : self.ip4_plen]
 
     @property
     def raw_header(self):
         """ Packet header in raw form """
 
-        return struct.pack(
-            "! BBH HH BBH 4s 4s",
+        return IP4_HEADER_STRUCT.pack(
             self.ip4_ver << 4 | self.ip4_hlen >> 2,
             self.ip4_dscp << 2 | self.ip4_ecn,
             self.ip4_plen,
@@ -290,9 +387,9 @@ class Ip4Packet:
             self.ip4_dst.packed,
         )
 
-    @property
+    @cached_property
     def raw_options(self):
-        """ Packet options in raw format """
+        """ Packet options in raw format, options are not supposed to change once packet is created """
 
         raw_options = b""
 
@@ -302,22 +399,63 @@ class Ip4Packet:
         return raw_options
 
     @property
+    def ip_pseudo_header(self):
+        """ Returns IPv4 pseudo header that is used by TCP and UDP to compute their checksums """
+
+        return IP4_PSEUDO_HEADER_STRUCT.pack(self.ip4_src.packed, self.ip4_dst.packed, 0, self.ip4_proto, self.ip4_plen - self.ip4_hlen)
+
+    def assemble_packet(self, frame, hptr):
+        """ Write packet into frame buffer at given offset, child packet writes itself right after the header into the same buffer """
+
+        # Packet that has already been assembled on its own (eg. to be parsed back by lower layer) gets just copied into the frame
+        if (raw_packet := self.__dict__.get("raw_packet", None)) is not None:
+            frame[hptr : hptr + len(raw_packet)] = raw_packet
+            return
+
+        IP4_HEADER_STRUCT.pack_into(
+            frame,
+            hptr,
+            self.ip4_ver << 4 | self.ip4_hlen >> 2,
+            self.ip4_dscp << 2 | self.ip4_ecn,
+            self.ip4_plen,
+            self.ip4_packet_id,
+            self.ip4_flag_reserved << 15 | self.ip4_flag_df << 14 | self.ip4_flag_mf << 13 | self.ip4_frag_offset >> 3,
+            self.ip4_ttl,
+            self.ip4_proto,
+            0,
+            self.ip4_src.packed,
+            self.ip4_dst.packed,
+        )
+        frame[hptr + IP4_HEADER_LEN : hptr + self.ip4_hlen] = self.raw_options
+
+        self.ip4_cksum = inet_cksum(memoryview(frame)[hptr : hptr + self.ip4_hlen])
+        struct.pack_into("!H", frame, hptr + IP4_CKSUM_OFFSET, self.ip4_cksum)
+
+        if self.child_packet is None:
+            frame[hptr + self.ip4_hlen : hptr + self.ip4_plen] = self.raw_data
+
+        elif self.child_packet.protocol == "ICMPv4":
+            self.child_packet.assemble_packet(frame, hptr + self.ip4_hlen)
+
+        else:
+            self.child_packet.assemble_packet(frame, hptr + self.ip4_hlen, self.ip_pseudo_header, cksum_offload=bool(self.vnet_hdr))
+
+    @cached_property
     def raw_packet(self):
-        """ Packet in raw form """
+        """ Packet in raw form, assembled on first access and memoized until dropped by drop_raw_packet() """
 
-        return self.raw_header + self.raw_options + self.raw_data
+        raw_packet = bytearray(len(self))
+        self.assemble_packet(raw_packet, 0)
+        return raw_packet
 
-    @property
-    def ip_pseudo_header(self):
-        """ Returns IPv4 pseudo header that is used by TCP and UDP to compute their checksums """
+    def drop_raw_packet(self):
+        """ Drop memoized raw form of the packet, to be called whenever any of its fields gets changed after the packet has been created """
 
-        return struct.pack("! 4s 4s BBH", self.ip4_src.packed, self.ip4_dst.packed, 0, self.ip4_proto, self.ip4_plen - self.ip4_hlen)
+        self.__dict__.pop("raw_packet", None)
 
     def get_raw_packet(self):
         """ Get packet in raw format ready to be processed by lower level protocol """
 
-        self.ip4_cksum = inet_cksum(self.raw_header + self.raw_options)
-
         return self.raw_packet
 
     def get_option(self, name):
@@ -331,7 +469,7 @@ class Ip4Packet:
     def validate_cksum(self):
         """ Validate packet checksum """
 
-        return not bool(inet_cksum(self.raw_header + self.raw_options))
+        return not bool(inet_cksum(self.raw_options, inet_sum(self.raw_header)))
 
     def __pre_parse_sanity_check(self, raw_packet):
         """ Preliminary sanity check to be run on raw IPv4 packet prior to packet parsing """
@@ -42,11 +42,13 @@
 
 
 import struct
+from functools import cached_property
 
 import loguru
 
 import config
 from ipv6_address import IPv6Address
+from vnet_hdr import VNET_HDR_GSO_TCPV6
 
 # IPv6 protocol header
 
@@ -75,6 +77,9 @@ from ipv6_address import IPv6Address
 
 IP6_HEADER_LEN = 40
 
+IP6_HEADER_STRUCT = struct.Struct("! BBBB HBB 16s 16s")
+IP6_PSEUDO_HEADER_STRUCT = struct.Struct("! 16s 16s L BBBB")
+
 IP6_NEXT_HEADER_TCP = 6
 IP6_NEXT_HEADER_UDP = 17
 IP6_NEXT_HEADER_ICMP6 = 58
@@ -157,32 +162,22 @@ class Ip6Packet:
         # Packet parsing
         if parent_packet:
             self.tracker = parent_packet.tracker
+            self.cksum_verified = parent_packet.cksum_verified
+            self.child_packet = None
 
-            raw_packet = parent_packet.raw_data
+            self.packet_view = memoryview(parent_packet.raw_data)
 
-            if not self.__pre_parse_sanity_check(raw_packet):
+            if not self.__pre_parse_sanity_check(self.packet_view):
                 self.sanity_check_failed = True
                 return
 
-            raw_header = raw_packet[:IP6_HEADER_LEN]
-
-            self.raw_data = raw_packet[IP6_HEADER_LEN : IP6_HEADER_LEN + struct.unpack("!H", raw_header[4:6])[0]]
-
-            self.ip6_ver = raw_header[0] >> 4
-            self.ip6_dscp = ((raw_header[0] & 0b00001111) << 2) | ((raw_header[1] & 0b11000000) >> 6)
-            self.ip6_ecn = (raw_header[1] & 0b00110000) >> 4
-            self.ip6_flow = ((raw_header[1] & 0b00001111) << 16) | (raw_header[2] << 8) | raw_header[3]
-            self.ip6_dlen = struct.unpack("!H", raw_header[4:6])[0]
-            self.ip6_next = raw_header[6]
-            self.ip6_hop = raw_header[7]
-            self.ip6_src = IPv6Address(raw_header[8:24])
-            self.ip6_dst = IPv6Address(raw_header[24:40])
-
             if not self.__post_parse_sanity_check():
                 self.sanity_check_failed = True
 
         # Packet building
         else:
+            self.packet_view = None
+
             if tracker:
                 self.tracker = tracker
             else:
@@ -197,6 +192,11 @@ class Ip6Packet:
             self.ip6_src = IPv6Address(ip6_src)
             self.ip6_dst = IPv6Address(ip6_dst)
 
+            self.vnet_hdr = None
+
+            # Child packet is not serialized here, it writes itself into the frame buffer when the whole frame gets assembled
+            self.child_packet = child_packet
+
             if child_packet:
                 assert child_packet.protocol in {"ICMPv6", "UDP", "TCP"}, f"Not supported protocol: {child_packet.protocol}"
 
@@ -209,8 +209,10 @@ class Ip6Packet:
                 if child_packet.protocol == "TCP":
                     self.ip6_next = IP6_NEXT_HEADER_TCP
 
-                self.ip6_dlen = len(child_packet.raw_packet)
-                self.raw_data = child_packet.get_raw_packet(self.ip_pseudo_header)
+                self.ip6_dlen = len(child_packet)
+
+                if config.tap_vnet_hdr and child_packet.protocol in {"UDP", "TCP"}:
+                    self.vnet_hdr = child_packet.get_vnet_hdr(VNET_HDR_GSO_TCPV6).encapsulate(IP6_HEADER_LEN)
 
             else:
                 self.ip6_next = ip6_next
@@ -228,14 +230,79 @@ class Ip6Packet:
     def __len__(self):
         """ Length of the packet """
 
-        return len(self.raw_packet)
+        return IP6_HEADER_LEN + self.ip6_dlen
 
-    @property
-    def raw_header(self):
-        """ Packet header in raw form """
+    @cached_property
+    def ip6_ver(self):
+        """ Parse 'Version' field of received packet """
+
+        return self.packet_view[0] >> 4
+
+    @cached_property
+    def ip6_dscp(self):
+        """ Parse 'DSCP' field of received packet """
+
+        return ((self.packet_view[0] & 0b00001111) << 2) | ((self.packet_view[1] & 0b11000000) >> 6)
+
+    @cached_property
+    def ip6_ecn(self):
+        """ Parse 'ECN' field of received packet """
+
+        return (self.packet_view[1] & 0b00110000) >> 4
+
+    @cached_property
+    def ip6_flow(self):
+        """ Parse 'Flow Label' field of received packet """
+
+        return ((self.packet_view[1] & 0b00001111) << 16) | (self.packet_view[2] << 8) | self.packet_view[3]
+
+    @cached_property
+    def ip6_dlen(self):
+        """ Parse 'Payload Length' field of received packet """
+
+        return struct.unpack_from("!H", self.packet_view, 4)[0]
+
+    @cached_property
+    def ip6_next(self):
+        """ Parse 'Next Header' field of received packet """
+
+        return self.packet_view[6]
 
-        return struct.pack(
-            "! BBBB HBB 16s 16s",
+    @cached_property
+    def ip6_hop(self):
+        """ Parse 'Hop Limit' field of received packet """
+
+        return self.packet_view[7]
+
+    @cached_property
+    def ip6_src(self):
+        """ Parse 'Source Address' field of received packet """
+
+        return IPv6Address(self.packet_view[8:24])
+
+    @cached_property
+    def ip6_dst(self):
+        """ Parse 'Destination Address' field of received packet """
+
+        return IPv6Address(self.packet_view[24:40])
+
+    @cached_property
+    def raw_data(self):
+        """ Payload of received packet """
+
+        return self.packet_view[IP6_HEADER_LEN : IP6_HEADER_LEN + self.ip6_dlen]
+
+    def assemble_packet(self, frame, hptr):
+        """ Write packet into frame buffer at given offset, child packet writes itself right after the header into the same buffer """
+
+        # Packet that has already been assembled on its own (eg. to be parsed back by lower layer) gets just copied into the frame
+        if (raw_packet := self.__dict__.get("raw_packet", None)) is not None:
+            frame[hptr : hptr + len(raw_packet)] = raw_packet
+            return
+
+        IP6_HEADER_STRUCT.pack_into(
+            frame,
+            hptr,
             self.ip6_ver << 4 | self.ip6_dscp >> 4,
             self.ip6_dscp << 6 | self.ip6_ecn << 4 | ((self.ip6_flow & 0b000011110000000000000000) >> 16),
             (self.ip6_flow & 0b000000001111111100000000) >> 8,
@@ -247,18 +314,34 @@ class Ip6Packet:
             self.ip6_dst.packed,
         )
 
-    @property
-    def raw_packet(self):
-        """ Packet in raw form """
+        if self.child_packet is None:
+            frame[hptr + IP6_HEADER_LEN : hptr + IP6_HEADER_LEN + self.ip6_dlen] = self.raw_data
 
-        return self.raw_header + self.raw_data
+        elif self.child_packet.protocol == "ICMPv6":
+            self.child_packet.assemble_packet(frame, hptr + IP6_HEADER_LEN, self.ip_pseudo_header)
+
+        else:
+            self.child_packet.assemble_packet(frame, hptr + IP6_HEADER_LEN, self.ip_pseudo_header, cksum_offload=bool(self.vnet_hdr))
 
     @property
     def ip_pseudo_header(self):
         """ Returns IPv6 pseudo header that is used by TCP to compute its checksum """
 
         # *** in the UDP/TCP length field need to account for IPv6 optional headers, current implementation assumes TCP/UDP is put right after IPv6 header ***
-        return struct.pack("! 16s 16s L BBBB", self.ip6_src.packed, self.ip6_dst.packed, self.ip6_dlen, 0, 0, 0, self.ip6_next)
+        return IP6_PSEUDO_HEADER_STRUCT.pack(self.ip6_src.packed, self.ip6_dst.packed, self.ip6_dlen, 0, 0, 0, self.ip6_next)
+
+    @cached_property
+    def raw_packet(self):
+        """ Packet in raw form, assembled on first access and memoized until dropped by drop_raw_packet() """
+
+        raw_packet = bytearray(len(self))
+        self.assemble_packet(raw_packet, 0)
+        return raw_packet
+
+    def drop_raw_packet(self):
+        """ Drop memoized raw form of the packet, to be called whenever any of its fields gets changed after the packet has been created """
+
+        self.__dict__.pop("raw_packet", None)
 
     def get_raw_packet(self):
         """ Get packet in raw format ready to be processed by lower level protocol """
@@ -42,12 +42,14 @@
 
 
 import struct
+from functools import cached_property
 
 import loguru
 
 import config
-from ip_helper import inet_cksum
+from ip_helper import inet_cksum, inet_sum
 from tracker import Tracker
+from vnet_hdr import VNET_HDR_F_NEEDS_CSUM, VnetHdr
 
 # TCP packet header (RFC 793)
 
@@ -68,6 +70,10 @@ from tracker import Tracker
 
 TCP_HEADER_LEN = 20
 
+TCP_CKSUM_OFFSET = 16
+
+TCP_HEADER_STRUCT = struct.Struct("! HH L L BBH HH")
+
 
 class TcpPacket:
     """ TCP packet support class """
@@ -96,8 +102,9 @@ class TcpPacket:
         raw_data=b"",
         tracker=None,
         echo_tracker=None,
+        tcp_gso_size=None,
     ):
-        """ Class constructor """
+        """ Class constructor, tcp_gso_size set means packet is super-segment meant to be split by kernel into segments of given size """
 
         self.logger = loguru.logger.bind(object_name="ps_tcp.")
         self.sanity_check_failed = False
@@ -105,67 +112,20 @@ class TcpPacket:
         # Packet parsing
         if parent_packet:
             self.tracker = parent_packet.tracker
-            raw_packet = parent_packet.raw_data
+            self.packet_view = memoryview(parent_packet.raw_data)
+            self.ip_pseudo_header = parent_packet.ip_pseudo_header
 
-            if not self.__pre_parse_sanity_check(raw_packet, parent_packet.ip_pseudo_header):
+            if not self.__pre_parse_sanity_check(self.packet_view, self.ip_pseudo_header, parent_packet.cksum_verified):
                 self.sanity_check_failed = True
                 return
 
-            raw_header = raw_packet[:TCP_HEADER_LEN]
-            raw_options = raw_packet[TCP_HEADER_LEN : (raw_header[12] & 0b11110000) >> 2]
-
-            self.raw_data = raw_packet[(raw_header[12] & 0b11110000) >> 2 :]
-            self.ip_pseudo_header = parent_packet.ip_pseudo_header
-
-            self.tcp_sport = struct.unpack("!H", raw_header[0:2])[0]
-            self.tcp_dport = struct.unpack("!H", raw_header[2:4])[0]
-            self.tcp_seq = struct.unpack("!L", raw_header[4:8])[0]
-            self.tcp_ack = struct.unpack("!L", raw_header[8:12])[0]
-            self.tcp_hlen = (raw_header[12] & 0b11110000) >> 2
-            self.tcp_reserved = raw_header[12] & 0b00001110
-            self.tcp_flag_ns = bool(raw_header[12] & 0b00000001)
-            self.tcp_flag_crw = bool(raw_header[13] & 0b10000000)
-            self.tcp_flag_ece = bool(raw_header[13] & 0b01000000)
-            self.tcp_flag_urg = bool(raw_header[13] & 0b00100000)
-            self.tcp_flag_ack = bool(raw_header[13] & 0b00010000)
-            self.tcp_flag_psh = bool(raw_header[13] & 0b00001000)
-            self.tcp_flag_rst = bool(raw_header[13] & 0b00000100)
-            self.tcp_flag_syn = bool(raw_header[13] & 0b00000010)
-            self.tcp_flag_fin = bool(raw_header[13] & 0b00000001)
-            self.tcp_win = struct.unpack("!H", raw_header[14:16])[0]
-            self.tcp_cksum = struct.unpack("!H", raw_header[16:18])[0]
-            self.tcp_urp = struct.unpack("!H", raw_header[18:20])[0]
-
-            self.tcp_options = []
-
-            opt_cls = {
-                TCP_OPT_MSS: TcpOptMss,
-                TCP_OPT_WSCALE: TcpOptWscale,
-                TCP_OPT_SACKPERM: TcpOptSackPerm,
-                TCP_OPT_TIMESTAMP: TcpOptTimestamp,
-            }
-
-            i = 0
-
-            while i < len(raw_options):
-
-                if raw_options[i] == TCP_OPT_EOL:
-                    self.tcp_options.append(TcpOptEol())
-                    break
-
-                if raw_options[i] == TCP_OPT_NOP:
-                    self.tcp_options.append(TcpOptNop())
-                    i += TCP_OPT_NOP_LEN
-                    continue
-
-                self.tcp_options.append(opt_cls.get(raw_options[i], TcpOptUnk)(raw_options[i : i + raw_options[i + 1]]))
-                i += self.raw_options[i + 1]
-
             if not self.__post_parse_sanity_check():
                 self.sanity_check_failed = True
 
         # Packet building
         else:
+            self.packet_view = None
+
             if tracker:
                 self.tracker = tracker
             else:
@@ -192,35 +152,12 @@ class TcpPacket:
             self.tcp_options = [] if tcp_options is None else tcp_options
 
             self.raw_data = raw_data
+            self.tcp_gso_size = tcp_gso_size
 
             self.tcp_hlen = TCP_HEADER_LEN + len(self.raw_options)
 
             assert self.tcp_hlen % 4 == 0, "TCP header len is not multiplcation of 4 bytes, check options"
 
-    @property
-    def raw_header(self):
-        """ Packet header in raw format """
-
-        return struct.pack(
-            "! HH L L BBH HH",
-            self.tcp_sport,
-            self.tcp_dport,
-            self.tcp_seq,
-            self.tcp_ack,
-            self.tcp_hlen << 2 | self.tcp_reserved | self.tcp_flag_ns,
-            self.tcp_flag_crw << 7
-            | self.tcp_flag_ece << 6
-            | self.tcp_flag_urg << 5
-            | self.tcp_flag_ack << 4
-            | self.tcp_flag_psh << 3
-            | self.tcp_flag_rst << 2
-            | self.tcp_flag_syn << 1
-            | self.tcp_flag_fin,
-            self.tcp_win,
-            self.tcp_cksum,
-            self.tcp_urp,
-        )
-
     def __str__(self):
         """ Short packet log string """
 
@@ -239,11 +176,158 @@ class TcpPacket:
     def __len__(self):
         """ Length of the packet """
 
-        return len(self.raw_packet)
+        return self.tcp_hlen + len(self.raw_data) if self.packet_view is None else len(self.packet_view)
 
-    @property
+    @cached_property
+    def tcp_sport(self):
+        """ Parse 'Source Port' field of received packet """
+
+        return struct.unpack_from("!H", self.packet_view, 0)[0]
+
+    @cached_property
+    def tcp_dport(self):
+        """ Parse 'Destination Port' field of received packet """
+
+        return struct.unpack_from("!H", self.packet_view, 2)[0]
+
+    @cached_property
+    def tcp_seq(self):
+        """ Parse 'Sequence Number' field of received packet """
+
+        return struct.unpack_from("!L", self.packet_view, 4)[0]
+
+    @cached_property
+    def tcp_ack(self):
+        """ Parse 'Acknowledgment Number' field of received packet """
+
+        return struct.unpack_from("!L", self.packet_view, 8)[0]
+
+    @cached_property
+    def tcp_hlen(self):
+        """ Parse 'Data Offset' field of received packet """
+
+        return (self.packet_view[12] & 0b11110000) >> 2
+
+    @cached_property
+    def tcp_reserved(self):
+        """ Parse 'Reserved' field of received packet """
+
+        return self.packet_view[12] & 0b00001110
+
+    @cached_property
+    def tcp_flag_ns(self):
+        """ Parse 'NS' flag of received packet """
+
+        return bool(self.packet_view[12] & 0b00000001)
+
+    @cached_property
+    def tcp_flag_crw(self):
+        """ Parse 'CWR' flag of received packet """
+
+        return bool(self.packet_view[13] & 0b10000000)
+
+    @cached_property
+    def tcp_flag_ece(self):
+        """ Parse 'ECE' flag of received packet """
+
+        return bool(self.packet_view[13] & 0b01000000)
+
+    @cached_property
+    def tcp_flag_urg(self):
+        """ Parse 'URG' flag of received packet """
+
+        return bool(self.packet_view[13] & 0b00100000)
+
+    @cached_property
+    def tcp_flag_ack(self):
+        """ Parse 'ACK' flag of received packet """
+
+        return bool(self.packet_view[13] & 0b00010000)
+
+    @cached_property
+    def tcp_flag_psh(self):
+        """ Parse 'PSH' flag of received packet """
+
+        return bool(self.packet_view[13] & 0b00001000)
+
+    @cached_property
+    def tcp_flag_rst(self):
+        """ Parse 'RST' flag of received packet """
+
+        return bool(self.packet_view[13] & 0b00000100)
+
+    @cached_property
+    def tcp_flag_syn(self):
+        """ Parse 'SYN' flag of received packet """
+
+        return bool(self.packet_view[13] & 0b00000010)
+
+    @cached_property
+    def tcp_flag_fin(self):
+        """ Parse 'FIN' flag of received packet """
+
+        return bool(self.packet_view[13] & 0b00000001)
+
+    @cached_property
+    def tcp_win(self):
+        """ Parse 'Window' field of received packet """
+
+        return struct.unpack_from("!H", self.packet_view, 14)[0]
+
+    @cached_property
+    def tcp_cksum(self):
+        """ Parse 'Checksum' field of received packet """
+
+        return struct.unpack_from("!H", self.packet_view, 16)[0]
+
+    @cached_property
+    def tcp_urp(self):
+        """ Parse 'Urgent Pointer' field of received packet """
+
+        return struct.unpack_from("!H", self.packet_view, 18)[0]
+
+    @cached_property
+    def tcp_options(self):
+        """ Parse options of received packet """
+
+        raw_options = self.packet_view[TCP_HEADER_LEN : self.tcp_hlen]
+
+        tcp_options = []
+
+        opt_cls = {
+            TCP_OPT_MSS: TcpOptMss,
+            TCP_OPT_WSCALE: TcpOptWscale,
+            TCP_OPT_SACKPERM: TcpOptSackPerm,
+            TCP_OPT_TIMESTAMP: TcpOptTimestamp,
+        }
+
+        i = 0
+
+        while i < len(raw_options):
+
+            if raw_options[i] == TCP_OPT_EOL:
+                tcp_options.append(TcpOptEol())
+                break
+
+            if raw_options[i] == TCP_OPT_NOP:
+                tcp_options.append(TcpOptNop())
+                i += TCP_OPT_NOP_LEN
+                continue
+
+            tcp_options.append(opt_cls.get(raw_options[i], TcpOptUnk)(raw_options[i : i + raw_options[i + 1]]))
+            i += raw_options[i + 1]
+
+        return tcp_options
+
+    @cached_property
+    def raw_data(self):
+        """ Payload of received packet """
+
+        return self.packet_view[self.tcp_hlen :]
+
+    @cached_property
     def raw_options(self):
-        """ Packet options in raw format """
+        """ Packet options in raw format, options are not supposed to change once packet is created """
 
         raw_options = b""
 
@@ -252,23 +336,58 @@ class TcpPacket:
 
         return raw_options
 
-    @property
-    def raw_packet(self):
-        """ Packet in raw format """
+    def assemble_packet(self, frame, hptr, ip_pseudo_header, cksum_offload=False):
+        """ Write packet into frame buffer at given offset, offloaded checksum carries pseudo header sum only """
+
+        TCP_HEADER_STRUCT.pack_into(
+            frame,
+            hptr,
+            self.tcp_sport,
+            self.tcp_dport,
+            self.tcp_seq,
+            self.tcp_ack,
+            self.tcp_hlen << 2 | self.tcp_reserved | self.tcp_flag_ns,
+            self.tcp_flag_crw << 7
+            | self.tcp_flag_ece << 6
+            | self.tcp_flag_urg << 5
+            | self.tcp_flag_ack << 4
+            | self.tcp_flag_psh << 3
+            | self.tcp_flag_rst << 2
+            | self.tcp_flag_syn << 1
+            | self.tcp_flag_fin,
+            self.tcp_win,
+            0,
+            self.tcp_urp,
+        )
+        frame[hptr + TCP_HEADER_LEN : hptr + self.tcp_hlen] = self.raw_options
+        frame[hptr + self.tcp_hlen : hptr + len(self)] = self.raw_data
+
+        # Pseudo header sum is used as initial checksum value so the pseudo header doesn't need to be concatenated with packet
+        pseudo_header_sum = inet_sum(ip_pseudo_header)
+        self.tcp_cksum = pseudo_header_sum if cksum_offload else inet_cksum(memoryview(frame)[hptr : hptr + len(self)], pseudo_header_sum)
+        struct.pack_into("!H", frame, hptr + TCP_CKSUM_OFFSET, self.tcp_cksum)
+
+    def get_raw_packet(self, ip_pseudo_header, cksum_offload=False):
+        """ Get packet in raw format ready to be processed by lower level protocol, offloaded checksum carries pseudo header sum only """
 
-        return self.raw_header + self.raw_options + self.raw_data
+        raw_packet = bytearray(len(self))
+        self.assemble_packet(raw_packet, 0, ip_pseudo_header, cksum_offload)
+        return raw_packet
 
-    def get_raw_packet(self, ip_pseudo_header):
-        """ Get packet in raw format ready to be processed by lower level protocol """
+    def get_vnet_hdr(self, gso_type):
+        """ Get offload information telling kernel to finish packet checksum and to split super-segment using given GSO type """
 
-        self.tcp_cksum = inet_cksum(ip_pseudo_header + self.raw_packet)
+        if self.tcp_gso_size and len(self.raw_data) > self.tcp_gso_size:
+            return VnetHdr(
+                flags=VNET_HDR_F_NEEDS_CSUM, gso_type=gso_type, hdr_len=self.tcp_hlen, gso_size=self.tcp_gso_size, csum_offset=TCP_CKSUM_OFFSET
+            )
 
-        return self.raw_packet
+        return VnetHdr(flags=VNET_HDR_F_NEEDS_CSUM, csum_offset=TCP_CKSUM_OFFSET)
 
     def validate_cksum(self, ip_pseudo_header):
         """ Validate packet checksum """
 
-        return not bool(inet_cksum(ip_pseudo_header + self.raw_packet))
+        return not bool(inet_cksum(self.packet_view, inet_sum(ip_pseudo_header)))
 
     @property
     def tcp_mss(self):
@@ -306,13 +425,13 @@ class TcpPacket:
                 return option.opt_tsval, option.opt_tsecr
         return None
 
-    def __pre_parse_sanity_check(self, raw_packet, pseudo_header):
+    def __pre_parse_sanity_check(self, raw_packet, pseudo_header, cksum_verified):
         """ Preliminary sanity check to be run on raw TCP packet prior to packet parsing """
 
         if not config.pre_parse_sanity_check:
             return True
 
-        if inet_cksum(pseudo_header + raw_packet):
+        if not cksum_verified and inet_cksum(raw_packet, inet_sum(pseudo_header)):
             self.logger.critical(f"{self.tracker} - TCP sanity check fail - wrong packet checksum")
             return False
 
@@ -42,12 +42,14 @@
 
 
 import struct
+from functools import cached_property
 
 import loguru
 
 import config
-from ip_helper import inet_cksum
+from ip_helper import inet_cksum, inet_sum
 from tracker import Tracker
+from vnet_hdr import VNET_HDR_F_NEEDS_CSUM, VnetHdr
 
 # UDP packet header (RFC 768)
 
@@ -60,6 +62,10 @@ from tracker import Tracker
 
 UDP_HEADER_LEN = 8
 
+UDP_CKSUM_OFFSET = 6
+
+UDP_HEADER_STRUCT = struct.Struct("! HH HH")
+
 
 class UdpPacket:
     """ UDP packet support class """
@@ -75,27 +81,19 @@ class UdpPacket:
         # Packet parsing
         if parent_packet:
             self.tracker = parent_packet.tracker
-            raw_packet = parent_packet.raw_data
+            self.packet_view = memoryview(parent_packet.raw_data)
+            self.ip_pseudo_header = parent_packet.ip_pseudo_header
 
-            if not self.__pre_parse_sanity_check(raw_packet, parent_packet.ip_pseudo_header):
+            if not self.__pre_parse_sanity_check(self.packet_view, self.ip_pseudo_header, parent_packet.cksum_verified):
                 self.sanity_check_failed = True
                 return
 
-            raw_header = raw_packet[:UDP_HEADER_LEN]
-
-            self.raw_data = raw_packet[UDP_HEADER_LEN : struct.unpack("!H", raw_header[4:6])[0]]
-            self.ip_pseudo_header = parent_packet.ip_pseudo_header
-
-            self.udp_sport = struct.unpack("!H", raw_header[0:2])[0]
-            self.udp_dport = struct.unpack("!H", raw_header[2:4])[0]
-            self.udp_plen = struct.unpack("!H", raw_header[4:6])[0]
-            self.udp_cksum = struct.unpack("!H", raw_header[6:8])[0]
-
             if not self.__post_parse_sanity_check():
                 self.sanity_check_failed = True
 
         # Packet building
         else:
+            self.packet_view = None
             self.tracker = Tracker("TX", echo_tracker)
 
             self.udp_sport = udp_sport
@@ -113,26 +111,61 @@ class UdpPacket:
     def __len__(self):
         """ Length of the packet """
 
-        return len(self.raw_packet)
+        return self.udp_plen if self.packet_view is None else len(self.packet_view)
+
+    @cached_property
+    def udp_sport(self):
+        """ Parse 'Source Port' field of received packet """
+
+        return struct.unpack_from("!H", self.packet_view, 0)[0]
+
+    @cached_property
+    def udp_dport(self):
+        """ Parse 'Destination Port' field of received packet """
+
+        return struct.unpack_from("!H", self.packet_view, 2)[0]
+
+    @cached_property
+    def udp_plen(self):
+        """ Parse 'Length' field of received packet """
+
+        return struct.unpack_from("!H", self.packet_view, 4)[0]
+
+    @cached_property
+    def udp_cksum(self):
+        """ Parse 'Checksum' field of received packet """
+
+        return struct.unpack_from("!H", self.packet_view, 6)[0]
+
+    @cached_property
+    def raw_data(self):
+        """ Payload of received packet """
+
+        return self.packet_view[UDP_HEADER_LEN : self.udp_plen]
 
-    @property
-    def raw_header(self):
-        """ Packet header in raw format """
+    def assemble_packet(self, frame, hptr, ip_pseudo_header, cksum_offload=False):
+        """ Write packet into frame buffer at given offset, offloaded checksum carries pseudo header sum only """
 
-        return struct.pack("! HH HH", self.udp_sport, self.udp_dport, self.udp_plen, self.udp_cksum)
+        UDP_HEADER_STRUCT.pack_into(frame, hptr, self.udp_sport, self.udp_dport, self.udp_plen, 0)
+        frame[hptr + UDP_HEADER_LEN : hptr + self.udp_plen] = self.raw_data
 
-    @property
-    def raw_packet(self):
-        """ Packet in raw format """
+        # Pseudo header sum is used as initial checksum value so the pseudo header doesn't need to be concatenated with packet
+        pseudo_header_sum = inet_sum(ip_pseudo_header)
+        self.udp_cksum = pseudo_header_sum if cksum_offload else inet_cksum(memoryview(frame)[hptr : hptr + self.udp_plen], pseudo_header_sum)
+        struct.pack_into("!H", frame, hptr + UDP_CKSUM_OFFSET, self.udp_cksum)
 
-        return self.raw_header + self.raw_data
+    def get_raw_packet(self, ip_pseudo_header, cksum_offload=False):
+        """ Get packet in raw format ready to be processed by lower level protocol, offloaded checksum carries pseudo header sum only """
 
-    def get_raw_packet(self, ip_pseudo_header):
-        """ Get packet in raw format ready to be processed by lower level protocol """
+        raw_packet = bytearray(len(self))
+        self.assemble_packet(raw_packet, 0, ip_pseudo_header, cksum_offload)
+        return raw_packet
 
-        self.udp_cksum = inet_cksum(ip_pseudo_header + self.raw_packet)
+    @staticmethod
+    def get_vnet_hdr(gso_type):
+        """ Get offload information telling kernel to finish packet checksum, UDP packets are never segmented so GSO type is not used """
 
-        return self.raw_packet
+        return VnetHdr(flags=VNET_HDR_F_NEEDS_CSUM, csum_offset=UDP_CKSUM_OFFSET)
 
     def validate_cksum(self, ip_pseudo_header):
         """ Validate packet checksum """
@@ -141,15 +174,15 @@ class UdpPacket:
         if not self.udp_cksum:
             return True
 
-        return not bool(inet_cksum(ip_pseudo_header + self.raw_packet))
+        return not bool(inet_cksum(self.packet_view, inet_sum(ip_pseudo_header)))
 
-    def __pre_parse_sanity_check(self, raw_packet, pseudo_header):
+    def __pre_parse_sanity_check(self, raw_packet, pseudo_header, cksum_verified):
         """ Preliminary sanity check to be run on raw UDP packet prior to packet parsing """
 
         if not config.pre_parse_sanity_check:
             return True
 
-        if inet_cksum(pseudo_header + raw_packet):
+        if not cksum_verified and inet_cksum(raw_packet, inet_sum(pseudo_header)):
             self.logger.critical(f"{self.tracker} - UDP sanity check fail - wrong packet checksum")
             return False
 
@@ -42,7 +42,9 @@
 
 
 import fcntl
+import multiprocessing
 import os
+import socket
 import struct
 import sys
 import time
@@ -52,6 +54,10 @@ import loguru
 import config
 from client_icmp_echo import ClientIcmpEcho
 from client_tcp_echo import ClientTcpEcho
+from link_packet_mmap import PacketMmapLink
+from link_pair import PairLink
+from link_sim import SimLink
+from link_tap import TapLink
 from ph import PacketHandler
 from service_tcp_daytime import ServiceTcpDaytime
 from service_tcp_discard import ServiceTcpDiscard
@@ -59,12 +65,22 @@ from service_tcp_echo import ServiceTcpEcho
 from service_udp_daytime import ServiceUdpDaytime
 from service_udp_discard import ServiceUdpDiscard
 from service_udp_echo import ServiceUdpEcho
+from simulation import Simulation, SimulatedStack
 from stack_cli_server import StackCliServer
+from state_sync import StateSync
+from tcp_socket import TcpSocket
 from timer import Timer
 
 TUNSETIFF = 0x400454CA
 IFF_TAP = 0x0002
 IFF_NO_PI = 0x1000
+IFF_MULTI_QUEUE = 0x0100
+IFF_VNET_HDR = 0x4000
+
+TUNSETOFFLOAD = 0x400454D0
+TUN_F_CSUM = 0x01
+TUN_F_TSO4 = 0x02
+TUN_F_TSO6 = 0x04
 
 
 #########################################################
@@ -77,33 +93,26 @@ IFF_NO_PI = 0x1000
 #########################################################
 
 
-def main():
-    """ Main function """
+def open_tap(flags=0):
+    """ Open TAP interface (or one of its queues) """
 
-    loguru.logger.remove(0)
-    loguru.logger.add(
-        sys.stdout,
-        colorize=True,
-        level="DEBUG",
-        format="<green>{time:YY-MM-DD HH:mm:ss}</green> <level>| {level:7} "
-        + "|</level> <level> <normal><cyan>{extra[object_name]}{function}:</cyan></normal> {message}</level>",
-    )
+    tap = os.open("/dev/net/tun", os.O_RDWR)
+    fcntl.ioctl(tap, TUNSETIFF, struct.pack("16sH", config.interface, IFF_TAP | IFF_NO_PI | (IFF_VNET_HDR if config.tap_vnet_hdr else 0) | flags))
 
-    loguru.logger.add(
-        "log",
-        mode="w",
-        level="DEBUG",
-        format="<green>{time:YY-MM-DD HH:mm:ss}</green> <level>| {level:7} "
-        + "|</level> <level> <normal><cyan>{extra[object_name]}{function}:</cyan></normal> {message}</level>",
-    )
+    # Let kernel pass us packets with partial checksums and TCP super-segments, it is also going to accept them from us
+    if config.tap_vnet_hdr:
+        fcntl.ioctl(tap, TUNSETOFFLOAD, TUN_F_CSUM | TUN_F_TSO4 | TUN_F_TSO6)
+
+    return tap
 
-    tap = os.open("/dev/net/tun", os.O_RDWR)
-    fcntl.ioctl(tap, TUNSETIFF, struct.pack("16sH", config.interface, IFF_TAP | IFF_NO_PI))
+
+def run_stack(link, state_sync=None):
+    """ Run stack, either as single process or as one of the workers serving multi-queue TAP interface """
 
     # Initialize stack components
     # StackCliServer()
     Timer()
-    PacketHandler(tap)
+    PacketHandler(link, state_sync)
 
     # Set proper local IP address pattern for services depending on whch version of IP is enabled
     if config.ip6_support and config.ip4_support:
@@ -129,6 +138,11 @@ def main():
     if config.service_tcp_daytime:
         ServiceTcpDaytime(local_ip_address=local_ip_address, message_count=-1, message_delay=1, message_size=1000)
 
+    # Test clients are run by the primary worker only
+    if state_sync and not state_sync.primary:
+        while True:
+            time.sleep(1)
+
     # Initialize TCP test clients
     if config.client_tcp_echo:
         ClientTcpEcho(local_ip_address="192.168.9.7", remote_ip_address="192.168.100.102", remote_port=7, message_count=10)
@@ -164,5 +178,133 @@ def main():
         time.sleep(1)
 
 
+def run_pair_peer(sock):
+    """ Run peer stack on the other end of 'pair' link, it uses the same configuration except for its own addressing """
+
+    config.mac_address = config.link_pair_peer_mac_address
+    config.ip6_address_candidate = config.link_pair_peer_ip6_address_candidate
+    config.ip4_address_candidate = config.link_pair_peer_ip4_address_candidate
+    config.client_tcp_echo = False
+    config.client_icmp_echo = False
+
+    run_stack(PairLink(sock))
+
+
+def run_simulation():
+    """ Run stack and its 'pair' peer in single process on virtual clock, send data over TCP to peer and back and report how long it took """
+
+    simulation = Simulation(seed=config.link_sim_seed, start_time=time.time())
+    link = SimLink()
+    local_stack = SimulatedStack(link, config.mac_address, config.ip6_address_candidate, config.ip4_address_candidate)
+    peer_stack = SimulatedStack(
+        SimLink(peer=link), config.link_pair_peer_mac_address, config.link_pair_peer_ip6_address_candidate, config.link_pair_peer_ip4_address_candidate
+    )
+
+    # Pick peer's address of the same IP version as the local one
+    if config.ip4_support and peer_stack.packet_handler.ip4_unicast:
+        local_ip_address, remote_ip_address = local_stack.packet_handler.ip4_unicast[0], peer_stack.packet_handler.ip4_unicast[0]
+    else:
+        local_ip_address, remote_ip_address = local_stack.packet_handler.ip6_unicast[0], peer_stack.packet_handler.ip6_unicast[0]
+
+    with peer_stack:
+        listening_socket = TcpSocket()
+        listening_socket.bind(remote_ip_address, 7)
+        listening_socket.listen()
+
+    # Socket calls drive the simulation until the event they wait for happens, so each side of transfer needs to be run in turn
+    transfer_start = simulation.clock.monotonic()
+    with local_stack:
+        client_socket = TcpSocket()
+        client_socket.bind(local_ip_address, 0)
+        if not client_socket.connect(remote_ip_address=remote_ip_address, remote_port=7):
+            loguru.logger.error(f"Simulation: Unable to connect to {remote_ip_address}, port 7")
+            return 1
+        client_socket.send(bytes(config.link_sim_transfer_size))
+
+    with peer_stack:
+        service_socket = listening_socket.accept()
+        data_rx = bytearray()
+        while len(data_rx) < config.link_sim_transfer_size and (message := service_socket.receive()):
+            data_rx.extend(message)
+        service_socket.send(bytes(data_rx))
+
+    with local_stack:
+        data_rx = bytearray()
+        while len(data_rx) < config.link_sim_transfer_size and (message := client_socket.receive()):
+            data_rx.extend(message)
+        transfer_time = simulation.clock.monotonic() - transfer_start
+        client_socket.close()
+
+    with peer_stack:
+        service_socket.close()
+
+    if len(data_rx) != config.link_sim_transfer_size:
+        loguru.logger.error(
+            f"Simulation: Sent {config.link_sim_transfer_size} bytes to {remote_ip_address} but received {len(data_rx)} bytes back "
+            + f"in {transfer_time:.3f}s of virtual time"
+        )
+        return 1
+
+    loguru.logger.info(
+        f"Simulation: Sent {config.link_sim_transfer_size} bytes to {remote_ip_address} and received {len(data_rx)} bytes back "
+        + f"in {transfer_time:.3f}s of virtual time" + (f", {len(data_rx) * 16 / transfer_time / 1000000:.3f} Mbps" if transfer_time else "")
+    )
+    return 0
+
+
+def main():
+    """ Main function """
+
+    loguru.logger.remove(0)
+    loguru.logger.add(
+        sys.stdout,
+        colorize=True,
+        level="DEBUG",
+        format="<green>{time:YY-MM-DD HH:mm:ss}</green> <level>| {level:7} "
+        + "|</level> <level> <normal><cyan>{extra[object_name]}{function}:</cyan></normal> {message}</level>",
+    )
+
+    loguru.logger.add(
+        "log",
+        mode="w",
+        level="DEBUG",
+        format="<green>{time:YY-MM-DD HH:mm:ss}</green> <level>| {level:7} "
+        + "|</level> <level> <normal><cyan>{extra[object_name]}{function}:</cyan></normal> {message}</level>",
+    )
+
+    # Simulation runs both stacks in single process on virtual clock, like 'pair' backend it relies on static addressing
+    if config.link_backend == "sim":
+        return run_simulation()
+
+    # AF_PACKET backend attaches stack to existing interface, kernel's virtio-net header offloads are not available there
+    if config.link_backend == "packet_mmap":
+        config.tap_vnet_hdr = False
+        return run_stack(PacketMmapLink(config.interface.decode()))
+
+    # Pair backend runs both stacks as separate processes since each of them keeps its state in module globals, there is no DHCP server
+    # on the link between them so both rely on static addressing
+    if config.link_backend == "pair":
+        config.tap_vnet_hdr = False
+        config.ip4_address_dhcp_config = False
+        link_sockets = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        multiprocessing.get_context("fork").Process(target=run_pair_peer, args=(link_sockets[1],)).start()
+        return run_stack(PairLink(link_sockets[0]))
+
+    if config.tap_queues == 1:
+        return run_stack(TapLink(open_tap()))
+
+    # Each TAP queue is served by its own worker process, kernel hashes flows to queues so every worker owns sessions and sockets of its flows
+    # (replies to flows opened by worker come back to its queue as kernel steers flows to the queue they were last sent out from).
+    # Workers are forked before any of stack threads gets started, state that needs to stay consistent between them is shared by StateSync
+    taps = [open_tap(IFF_MULTI_QUEUE) for _ in range(config.tap_queues)]
+    context = multiprocessing.get_context("fork")
+    worker_queues = [context.SimpleQueue() for _ in range(config.tap_queues)]
+
+    for worker_id in range(1, config.tap_queues):
+        context.Process(target=run_stack, args=(TapLink(taps[worker_id]), StateSync(worker_id, worker_queues))).start()
+
+    return run_stack(TapLink(taps[0]), StateSync(0, worker_queues))
+
+
 if __name__ == "__main__":
     sys.exit(main())
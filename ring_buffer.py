@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyTCP - Python TCP/IP stack                                             #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyTCP                   #
+#                                                                          #
+############################################################################
+
+##############################################################################################
+#                                                                                            #
+#  This program is a work in progress and it changes on daily basis due to new features      #
+#  being implemented, changes being made to already implemented features, bug fixes, etc.    #
+#  Therefore if the current version is not working as expected try to clone it again the     #
+#  next day or shoot me an email describing the problem. Any input is appreciated. Also      #
+#  keep in mind that some features may be implemented only partially (as needed for stack    #
+#  operation) or they may be implemented in sub-optimal or not 100% RFC compliant way (due   #
+#  to lack of time) or last but not least they may contain bug(s) that i didn't notice yet.  #
+#                                                                                            #
+##############################################################################################
+
+
+#
+# ring_buffer.py - module contains class supporting bounded packet queue used by RX and TX rings
+#
+
+
+import collections
+import threading
+
+
+class RingBuffer:
+    """ Fixed capacity packet queue with urgent and normal priority lanes, enqueue and dequeue cost is constant regardless of queue length """
+
+    def __init__(self, depth, drop_policy="tail"):
+        """ Class constructor, depth is shared by both lanes, drop_policy decides which packet gets dropped when the ring is full """
+
+        assert drop_policy in {"tail", "head"}
+
+        self.depth = depth
+        self.drop_policy = drop_policy
+
+        self.lane_urgent = collections.deque()
+        self.lane_normal = collections.deque()
+
+        self.packet_enqueued = threading.Condition()
+
+        self.enqueue_count = 0  # Number of packets accepted by the ring
+        self.drop_count = 0  # Number of packets dropped because the ring was full
+        self.high_watermark = 0  # Highest number of packets ever queued at the same time
+
+    def __len__(self):
+        """ Number of queued packets """
+
+        return len(self.lane_urgent) + len(self.lane_normal)
+
+    def __str__(self):
+        """ Ring statistics """
+
+        return f"queued {len(self)}/{self.depth}, enqueued {self.enqueue_count}, dropped {self.drop_count}, high watermark {self.high_watermark}"
+
+    def __enqueue(self, packet, urgent):
+        """ Put packet into its lane, return False if the packet had to be dropped, caller needs to hold the lock """
+
+        if len(self) >= self.depth:
+            self.drop_count += 1
+
+            # Head drop makes room by discarding the oldest normal packet, urgent ones are discarded only if there is nothing else left
+            if self.drop_policy == "head":
+                (self.lane_normal or self.lane_urgent).popleft()
+
+            # Tail drop discards the incoming packet, unless it is urgent and can take place of the newest normal packet
+            elif urgent and self.lane_normal:
+                self.lane_normal.pop()
+
+            else:
+                return False
+
+        (self.lane_urgent if urgent else self.lane_normal).append(packet)
+        self.enqueue_count += 1
+        self.high_watermark = max(self.high_watermark, len(self))
+        return True
+
+    def enqueue(self, packet, urgent=False):
+        """ Enqueue packet, return False if the packet had to be dropped """
+
+        with self.packet_enqueued:
+            if enqueued := self.__enqueue(packet, urgent):
+                self.packet_enqueued.notify()
+
+        return enqueued
+
+    def enqueue_batch(self, packets):
+        """ Enqueue list of (packet, urgent) pairs under single lock acquisition, return number of packets that had to be dropped """
+
+        with self.packet_enqueued:
+            dropped = sum(not self.__enqueue(packet, urgent) for packet, urgent in packets)
+            self.packet_enqueued.notify()
+
+        return dropped
+
+    def dequeue(self, timeout=None):
+        """ Dequeue packet, urgent lane first, wait for it if the ring is empty, return None if timeout passed """
+
+        with self.packet_enqueued:
+            if not self.packet_enqueued.wait_for(self.__len__, timeout=timeout):
+                return None
+
+            return (self.lane_urgent or self.lane_normal).popleft()
+
+    def dequeue_batch(self, max_count, timeout=None):
+        """ Dequeue up to max_count packets, urgent lane first, wait for at least one if the ring is empty, return empty list if timeout passed """
+
+        batch = []
+
+        with self.packet_enqueued:
+            if self.packet_enqueued.wait_for(self.__len__, timeout=timeout):
+                while len(batch) < max_count and (lane := self.lane_urgent or self.lane_normal):
+                    batch.append(lane.popleft())
+
+        return batch
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyTCP - Python TCP/IP stack                                             #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyTCP                   #
+#                                                                          #
+############################################################################
+
+##############################################################################################
+#                                                                                            #
+#  This program is a work in progress and it changes on daily basis due to new features      #
+#  being implemented, changes being made to already implemented features, bug fixes, etc.    #
+#  Therefore if the current version is not working as expected try to clone it again the     #
+#  next day or shoot me an email describing the problem. Any input is appreciated. Also      #
+#  keep in mind that some features may be implemented only partially (as needed for stack    #
+#  operation) or they may be implemented in sub-optimal or not 100% RFC compliant way (due   #
+#  to lack of time) or last but not least they may contain bug(s) that i didn't notice yet.  #
+#                                                                                            #
+##############################################################################################
+
+
+#
+# route_table.py - module contains class supporting IPv4 / IPv6 routing table
+#
+
+
+import loguru
+
+# Maximum number of destinations next hop routes are cached for, the whole cache gets flushed once it fills up
+ROUTE_CACHE_SIZE = 1024
+
+
+class RouteTable:
+    """ Support for routing table operations, routes are looked up by the longest prefix match """
+
+    class Route:
+        """ Container class for routes """
+
+        def __init__(self, network, gateway, ip_src):
+            self.network = network
+            self.gateway = gateway  # Gateway set to None means that network is directly connected
+            self.ip_src = ip_src  # Stack address route belongs to, it is used as source of packets sent over this route
+
+        def __str__(self):
+            """ String representation """
+
+            return f"{self.network} via {self.gateway if self.gateway else 'connected'} src {self.ip_src}"
+
+    def __init__(self, version):
+        """ Class constructor """
+
+        self.max_prefixlen = 32 if version == 4 else 128
+
+        self.routes = {}  # Routes by prefix length and then by network address integer value
+        self.prefixlens = []  # Prefix lengths present in table, from the longest one
+        self.route_cache = {}  # Routes already looked up for packed destination and source addresses
+
+        self.logger = loguru.logger.bind(object_name="route_table.")
+
+    def __iter__(self):
+        """ Iterate over all routes, from the most specific ones """
+
+        for prefixlen in self.prefixlens:
+            for routes in self.routes[prefixlen].values():
+                yield from routes
+
+    def add_route(self, network, gateway=None, ip_src=None):
+        """ Add route to table, multiple routes to the same network are allowed as long as they belong to different stack addresses """
+
+        routes = self.routes.setdefault(network.prefixlen, {}).setdefault(int(network.network_address), [])
+        routes.append(route := self.Route(network, gateway, ip_src))
+        self.prefixlens = sorted(self.routes, reverse=True)
+        self.route_cache.clear()
+        self.logger.debug(f"Added route {route}")
+
+    def remove_route(self, network, gateway=None, ip_src=None):
+        """ Remove route from table """
+
+        routes = self.routes[network.prefixlen][int(network.network_address)]
+        routes.remove(route := [_ for _ in routes if _.gateway == gateway and _.ip_src == ip_src][0])
+
+        if not routes:
+            del self.routes[network.prefixlen][int(network.network_address)]
+        if not self.routes[network.prefixlen]:
+            del self.routes[network.prefixlen]
+
+        self.prefixlens = sorted(self.routes, reverse=True)
+        self.route_cache.clear()
+        self.logger.debug(f"Removed route {route}")
+
+    def find_route(self, ip_dst, ip_src=None):
+        """ Find route to destination, if source address is specified only routes belonging to it are considered """
+
+        route_cache_key = (ip_dst.packed, ip_src.packed if ip_src else None)
+        if (route := self.route_cache.get(route_cache_key, False)) is not False:
+            return route
+
+        ip_src = None if ip_src is None or ip_src.is_unspecified else ip_src
+
+        route = None
+        for prefixlen in self.prefixlens:
+            if routes := self.routes[prefixlen].get(int(ip_dst) >> (self.max_prefixlen - prefixlen) << (self.max_prefixlen - prefixlen), None):
+                if route := next((_ for _ in routes if ip_src is None or _.ip_src == ip_src), None):
+                    break
+
+        if len(self.route_cache) >= ROUTE_CACHE_SIZE:
+            self.route_cache.clear()
+        self.route_cache[route_cache_key] = route
+
+        return route
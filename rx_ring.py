@@ -41,54 +41,66 @@
 #
 
 
-import os
 import threading
 
 import loguru
 
+import config
 import ps_ether
+import stack
+from ring_buffer import RingBuffer
 
 
 class RxRing:
     """ Support for receiving packets from the network """
 
-    def __init__(self, tap):
-        """ Initialize access to tap interface and the inbound queue """
+    def __init__(self, link):
+        """ Initialize access to link backend and the inbound queue """
 
-        self.tap = tap
-        self.rx_ring = []
+        self.link = link
+        self.rx_ring = RingBuffer(config.rx_ring_depth, config.ring_drop_policy)
         self.logger = loguru.logger.bind(object_name="rx_ring.")
 
-        self.packet_enqueued = threading.Semaphore(0)
-
-        threading.Thread(target=self.__thread_receive).start()
+        # In simulated time mode link hands frames over to packet handler as they arrive, packet handler picks them up by itself
+        if not stack.clock.simulated:
+            threading.Thread(target=self.__thread_receive).start()
         self.logger.debug("Started RX ring")
 
-    def __enqueue(self, ether_packet_rx):
-        """ Enqueue packet for further processing """
+    def __enqueue(self, batch):
+        """ Enqueue batch of packets for further processing """
 
-        if ether_packet_rx.ether_type == ps_ether.ETHER_TYPE_ARP:
-            self.rx_ring.insert(0, ether_packet_rx)
-            self.logger.opt(ansi=True).debug(f"{ether_packet_rx.tracker}, priority: Urgent, queue len: {len(self.rx_ring)}")
-        else:
-            self.rx_ring.append(ether_packet_rx)
-            self.logger.opt(ansi=True).debug(f"{ether_packet_rx.tracker}, priority: Normal, queue len: {len(self.rx_ring)}")
+        if dropped := self.rx_ring.enqueue_batch(batch):
+            self.logger.opt(ansi=True).debug(f"<red>RX ring full, {dropped} packet(s) dropped</>, {self.rx_ring}")
 
-        self.packet_enqueued.release()
+        self.logger.opt(ansi=True).debug(f"Enqueued batch of {len(batch) - dropped} packet(s), queue len: {len(self.rx_ring)}")
 
     def __thread_receive(self):
         """ Thread responsible for receiving and enqueuing incoming packets """
 
         while True:
 
-            # Wait till there is any packet comming and pick it up
-            ether_packet_rx = ps_ether.EtherPacket(os.read(self.tap, 2048))
+            # Wait till there is any packet comming and pick up as many of them as single batch allows
+            self.link.wait_rx()
+            self.receive()
+
+    def receive(self):
+        """ Pick up single batch of packets link has ready without waiting for them and enqueue it """
+
+        batch = []
+        for raw_frame, vnet_hdr in self.link.receive_batch(config.rx_batch_size):
+            ether_packet_rx = ps_ether.EtherPacket(raw_frame, vnet_hdr=vnet_hdr)
             self.logger.opt(ansi=True).debug(f"<green>[RX]</green> {ether_packet_rx.tracker} - {len(ether_packet_rx)} bytes")
-            self.__enqueue(ether_packet_rx)
+            batch.append((ether_packet_rx, ether_packet_rx.ether_type == ps_ether.ETHER_TYPE_ARP))
+
+        if batch:
+            self.__enqueue(batch)
 
     def dequeue(self):
         """ Dequeue inboutd packet from RX ring """
 
-        self.packet_enqueued.acquire()
+        return self.rx_ring.dequeue()
+
+    def dequeue_batch(self, max_count, timeout=None):
+        """ Dequeue batch of up to max_count inbound packets from RX ring """
 
-        return self.rx_ring.pop(0)
+        return self.rx_ring.dequeue_batch(max_count, timeout=timeout)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyTCP - Python TCP/IP stack                                             #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyTCP                   #
+#                                                                          #
+############################################################################
+
+##############################################################################################
+#                                                                                            #
+#  This program is a work in progress and it changes on daily basis due to new features      #
+#  being implemented, changes being made to already implemented features, bug fixes, etc.    #
+#  Therefore if the current version is not working as expected try to clone it again the     #
+#  next day or shoot me an email describing the problem. Any input is appreciated. Also      #
+#  keep in mind that some features may be implemented only partially (as needed for stack    #
+#  operation) or they may be implemented in sub-optimal or not 100% RFC compliant way (due   #
+#  to lack of time) or last but not least they may contain bug(s) that i didn't notice yet.  #
+#                                                                                            #
+##############################################################################################
+
+
+#
+# simulation.py - module contains classes supporting deterministic simulation of several stacks running in single process on virtual clock
+#
+
+
+import random
+
+import config
+import stack
+from clock import SimulatedClock
+from ph import PacketHandler
+from timer import Timer
+
+
+class Simulation:
+    """ Deterministic simulation, all the stacks share single virtual clock and run in the thread that drives simulation through blocking socket
+    calls (or clock's sleep), there are no threads to schedule so the same configuration and seed always produce the same run """
+
+    def __init__(self, seed=0, start_time=0.0):
+        """ Class constructor, start_time is the wall clock time reported at the start of simulation """
+
+        random.seed(seed)
+        self.timer = Timer(clock=SimulatedClock(start_time))
+        self.clock = self.timer.clock
+
+        # There is no DHCP server nor kernel offloading on simulated links
+        config.ip4_address_dhcp_config = False
+        config.tap_vnet_hdr = False
+
+
+class SimulatedStack:
+    """ Stack instance running in simulation, its globals are swapped in for the code executed within 'with' block """
+
+    def __init__(self, link, mac_address, ip6_address_candidate, ip4_address_candidate):
+        """ Class constructor, stack gets started with its own addressing, link needs to be the simulated one """
+
+        self.context = stack.new_context()
+        self.previous_contexts = []
+
+        with self:
+            config.mac_address = mac_address
+            config.ip6_address_candidate = ip6_address_candidate
+            config.ip4_address_candidate = ip4_address_candidate
+            self.packet_handler = PacketHandler(link)
+
+    def __enter__(self):
+        """ Make this stack the one in charge """
+
+        self.previous_contexts.append(stack.switch_context(self.context))
+        return self
+
+    def __exit__(self, *_):
+        """ Give control back to the stack that was in charge before """
+
+        stack.switch_context(self.previous_contexts.pop())
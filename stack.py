@@ -41,8 +41,52 @@
 #
 
 
+import config
+from clock import Clock
+from port_allocator import PortAllocator
+
+clock = Clock()
 timer = None
 packet_handler = None
 
 tcp_sessions = {}
+tcp_listeners = {}
 udp_sockets = {}
+
+
+tcp_ephemeral_ports = PortAllocator(config.TCP_EPHEMERAL_PORT_RANGE)
+udp_ephemeral_ports = PortAllocator(config.UDP_EPHEMERAL_PORT_RANGE)
+
+# Globals belonging to single stack instance, simulation running several stacks in single process keeps their set (context) for each of them
+# and swaps them whenever it executes code on behalf of another stack, context is None when there is only one stack in the process
+CONTEXT_GLOBALS = ("packet_handler", "tcp_sessions", "tcp_listeners", "udp_sockets", "tcp_ephemeral_ports", "udp_ephemeral_ports")
+
+context = None
+
+
+def new_context():
+    """ Create set of globals for new stack instance """
+
+    return {
+        "packet_handler": None,
+        "tcp_sessions": {},
+        "tcp_listeners": {},
+        "udp_sockets": {},
+        "tcp_ephemeral_ports": PortAllocator(config.TCP_EPHEMERAL_PORT_RANGE),
+        "udp_ephemeral_ports": PortAllocator(config.UDP_EPHEMERAL_PORT_RANGE),
+    }
+
+
+def switch_context(next_context):
+    """ Save globals of current stack instance into its context and load ones of the next instance, return the previous context """
+
+    global context
+
+    previous_context = context
+    if previous_context is not None:
+        previous_context.update({_: globals()[_] for _ in CONTEXT_GLOBALS})
+    if next_context is not None:
+        globals().update(next_context)
+    context = next_context
+
+    return previous_context
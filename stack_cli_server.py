@@ -90,7 +90,7 @@ class StackCliServer:
 
                 if message.lower().strip() == b"show tcp sessions":
                     message = b"\n"
-                    for session in stack.tcp_sessions:
+                    for session in (*stack.tcp_listeners.values(), *stack.tcp_sessions.values()):
                         message += bytes(str(session), "utf-8") + b"\n"
                     message += b"\n"
                     conn.sendall(message)
@@ -116,6 +116,13 @@ class StackCliServer:
                     message += b"\n"
                     conn.sendall(message)
 
+                elif message.lower().strip() == b"show ipv6 route":
+                    message = b"\n"
+                    for route in stack.packet_handler.ip6_route_table:
+                        message += bytes(str(route), "utf-8") + b"\n"
+                    message += b"\n"
+                    conn.sendall(message)
+
                 elif message.lower().strip() == b"show ipv4 address":
                     message = b"\n"
                     for address in stack.packet_handler.ip4_address:
@@ -144,5 +151,19 @@ class StackCliServer:
                     message += b"\n"
                     conn.sendall(message)
 
+                elif message.lower().strip() == b"show ipv4 route":
+                    message = b"\n"
+                    for route in stack.packet_handler.ip4_route_table:
+                        message += bytes(str(route), "utf-8") + b"\n"
+                    message += b"\n"
+                    conn.sendall(message)
+
+                elif message.lower().strip() == b"show rings":
+                    message = b"\n"
+                    message += bytes(f"RX ring: {stack.packet_handler.rx_ring.rx_ring}", "utf-8") + b"\n"
+                    message += bytes(f"TX ring: {stack.packet_handler.tx_ring.tx_ring}", "utf-8") + b"\n"
+                    message += b"\n"
+                    conn.sendall(message)
+
                 else:
                     conn.sendall(b"Syntax error...\n")
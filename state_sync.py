@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyTCP - Python TCP/IP stack                                             #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyTCP                   #
+#                                                                          #
+############################################################################
+
+##############################################################################################
+#                                                                                            #
+#  This program is a work in progress and it changes on daily basis due to new features      #
+#  being implemented, changes being made to already implemented features, bug fixes, etc.    #
+#  Therefore if the current version is not working as expected try to clone it again the     #
+#  next day or shoot me an email describing the problem. Any input is appreciated. Also      #
+#  keep in mind that some features may be implemented only partially (as needed for stack    #
+#  operation) or they may be implemented in sub-optimal or not 100% RFC compliant way (due   #
+#  to lack of time) or last but not least they may contain bug(s) that i didn't notice yet.  #
+#                                                                                            #
+##############################################################################################
+
+
+#
+# state_sync.py - module contains class keeping state shared by worker processes serving multi-queue TAP interface consistent
+#
+
+
+import threading
+
+import loguru
+
+import config
+from ipv4_address import IPv4Address, IPv4Interface
+from ipv6_address import IPv6Address, IPv6Interface
+from mac_address import MacAddress
+
+
+class StateSync:
+    """ Support for sharing ARP / ICMPv6 ND cache entries and address configuration between worker processes """
+
+    def __init__(self, worker_id, worker_queues):
+        """ Class constructor, worker_queues holds one multiprocessing queue per worker, worker 0 is the primary one that configures addressing """
+
+        self.worker_id = worker_id
+        self.worker_queues = worker_queues
+        self.primary = worker_id == 0
+        self.packet_handler = None
+
+        self.event_addressing = threading.Semaphore(0)
+
+        self.logger = loguru.logger.bind(object_name=f"state_sync{worker_id}.")
+
+    def start(self, packet_handler):
+        """ Start receiving state updates from other workers """
+
+        self.packet_handler = packet_handler
+        threading.Thread(target=self.__thread_receive).start()
+        self.logger.debug(f"Started state sync for worker {self.worker_id} of {len(self.worker_queues)}")
+
+    def __thread_receive(self):
+        """ Thread responsible for applying state updates published by other workers """
+
+        while True:
+            message = self.worker_queues[self.worker_id].get()
+
+            if message[0] == "ARP":
+                self.packet_handler.arp_cache.add_entry(message[1], message[2], sync=False)
+                continue
+
+            if message[0] == "ND":
+                self.packet_handler.icmp6_nd_cache.add_entry(message[1], message[2], sync=False)
+                continue
+
+            if message[0] == "ADDRESSING":
+                self.__apply_addressing(*message[1:])
+                continue
+
+    def __publish(self, message):
+        """ Put message into queues of all the other workers """
+
+        for worker_id, worker_queue in enumerate(self.worker_queues):
+            if worker_id != self.worker_id:
+                worker_queue.put(message)
+
+    def publish_arp_entry(self, ip4_address, mac_address):
+        """ Share ARP cache entry with other workers """
+
+        self.__publish(("ARP", ip4_address, mac_address))
+
+    def publish_nd_entry(self, ip6_address, mac_address):
+        """ Share ICMPv6 ND cache entry with other workers """
+
+        self.__publish(("ND", ip6_address, mac_address))
+
+    def publish_addressing(self):
+        """ Share address configuration of the primary worker, interface objects are passed as strings as pickling doesn't preserve their gateways """
+
+        self.__publish(
+            (
+                "ADDRESSING",
+                config.ip6_support,
+                config.ip4_support,
+                [(str(_), str(_.gateway) if _.gateway else None) for _ in self.packet_handler.ip6_address],
+                [str(_) for _ in self.packet_handler.ip6_multicast],
+                [(str(_), str(_.gateway) if _.gateway else None) for _ in self.packet_handler.ip4_address],
+                [str(_) for _ in self.packet_handler.mac_multicast],
+            )
+        )
+        self.logger.debug("Published address configuration to other workers")
+
+    def __apply_addressing(self, ip6_support, ip4_support, ip6_address, ip6_multicast, ip4_address, mac_multicast):
+        """ Take over address configuration published by the primary worker """
+
+        config.ip6_support = ip6_support
+        config.ip4_support = ip4_support
+
+        for address, gateway in ip6_address:
+            address = IPv6Interface(address)
+            address.gateway = IPv6Address(gateway) if gateway else None
+            self.packet_handler.ip6_address.append(address)
+
+        for address, gateway in ip4_address:
+            address = IPv4Interface(address)
+            address.gateway = IPv4Address(gateway) if gateway else None
+            self.packet_handler.ip4_address.append(address)
+
+        self.packet_handler.ip6_multicast[:] = [IPv6Address(_) for _ in ip6_multicast]
+        self.packet_handler.mac_multicast[:] = [MacAddress(_) for _ in mac_multicast]
+        self.packet_handler.rebuild_membership()
+        self.packet_handler.rebuild_route_tables()
+
+        self.logger.debug("Took over address configuration from primary worker")
+        self.event_addressing.release()
+
+    def wait_for_addressing(self):
+        """ Block until address configuration published by the primary worker gets applied """
+
+        self.event_addressing.acquire()
@@ -41,6 +41,10 @@
 #
 
 
+# Packed unspecified address of each IP version, listening session bound to it accepts connections to any address of that version
+TCP_UNSPECIFIED_ADDRESS = {6: bytes(16), 4: bytes(4)}
+
+
 class TcpMetadata:
     """ Store TCP metadata """
 
@@ -79,27 +83,17 @@ class TcpMetadata:
         self.tracker = tracker
 
     @property
-    def tcp_session_id(self):
-        """ Session ID """
+    def tcp_session_key(self):
+        """ Key of the session packet belongs to in TCP flow table """
 
-        return f"TCP/{self.local_ip_address}/{self.local_port}/{self.remote_ip_address}/{self.remote_port}"
+        return (self.local_ip_address.packed, self.local_port, self.remote_ip_address.packed, self.remote_port)
 
     @property
-    def tcp_session_listening_patterns(self):
-        """ Session ID patterns that match listening socket """
-
-        if self.remote_ip_address.version == 6:
-            return [
-                f"TCP/{self.local_ip_address}/{self.local_port}/*/*",
-                f"TCP/::/{self.local_port}/*/*",
-                f"TCP/*/{self.local_port}/*/*",
-            ]
-
-        if self.remote_ip_address.version == 4:
-            return [
-                f"TCP/{self.local_ip_address}/{self.local_port}/*/*",
-                f"TCP/0.0.0.0/{self.local_port}/*/*",
-                f"TCP/*/{self.local_port}/*/*",
-            ]
+    def tcp_listener_keys(self):
+        """ Keys of listening sessions packet may match in TCP listener index, from the most specific one to the wildcard one """
 
-        return None
+        return (
+            (self.local_port, self.local_ip_address.packed),
+            (self.local_port, TCP_UNSPECIFIED_ADDRESS[self.local_ip_address.version]),
+            (self.local_port, None),
+        )
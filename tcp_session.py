@@ -48,11 +48,14 @@ import loguru
 
 import config
 import stack
+from ip_helper import ip_pick_version
 
 PACKET_RETRANSMIT_TIMEOUT = 1000  # Retransmit data if ACK not received
 PACKET_RETRANSMIT_MAX_COUNT = 3  # If data is not acked, retransit it 5 times
 DELAYED_ACK_DELAY = 100  # Delay between consecutive delayed ACK outbound packets
 TIME_WAIT_DELAY = 30000  # 30s delay for the TIME_WAIT state, default is 30-120s
+PERSIST_TIMEOUT = 1000  # Initial delay before probing peer's zero window, doubles after each probe
+PERSIST_MAX_TIMEOUT = 60000  # Maximum delay between consecutive zero window probes
 
 
 def trace_fsm(function):
@@ -98,9 +101,14 @@ class TcpSession:
         self.logger = loguru.logger.bind(object_name="tcp_session.")
 
         self.local_ip_address = local_ip_address
-        self.local_port = local_port if local_port else self.__pick_random_local_port()
+        # Allocator raises OSError when there is no ephemeral port left, session is not created then
+        if local_port:
+            stack.tcp_ephemeral_ports.bind(local_ip_address, local_port)
+        self.local_port = local_port if local_port else stack.tcp_ephemeral_ports.reserve(local_ip_address)
+        self.local_port_binding = (local_ip_address, self.local_port)  # Port held in allocator until session is closed, even if session moves to other address
         self.remote_ip_address = remote_ip_address
         self.remote_port = remote_port
+        self.__set_session_id()
 
         self.socket = socket  # Keeps track of the socket that owns this session for the session -> socket communication purposes
 
@@ -118,7 +126,7 @@ class TcpSession:
         self.local_seq_fin = None  # SEQ of FIN packet we sent, used to track peer's ACK for it and for FIN retransmit
 
         self.tx_retransmit_request_counter = {}  # Keeps track of DUP packets sent from peer to determine if any of them is a retransmit request
-        self.tx_retransmit_timeout_counter = {}  # Keeps track of the timestamps for the sent out packets, used to determine when to retransmit packet
+        self.tx_retransmit_timeout_counter = 0  # Number of retransmit timeouts expired for the oldest unacked SEQ, used for timer backoff
         self.rx_retransmit_request_counter = {}  # Keeps track of us sending 'fast retransmit request' packets so we can limit their count to 2
 
         self.tx_buffer_seq_mod = self.local_seq_init  # Used to help translate local_seq_send and local_seq_ackd numbers to TX buffer pointers
@@ -144,22 +152,36 @@ class TcpSession:
 
         self.ooo_packet_queue = {}  # Out of order packet buffer
 
+        self.persist_counter = 0  # Number of zero window probes sent since peer closed its window
+
+        # Session timers, each of them gets armed only when needed
+        self.timer_retransmit = stack.timer.register_timer(method=self.tcp_fsm, kwargs={"timer": True})  # Retransmit timeout of the oldest unacked segment
+        self.timer_delayed_ack = stack.timer.register_timer(method=self.tcp_fsm, kwargs={"timer": True})  # Delay before acking received data
+        self.timer_time_wait = stack.timer.register_timer(method=self.tcp_fsm, kwargs={"timer": True})  # TIME_WAIT state delay
+        self.timer_send_ready = stack.timer.register_timer(method=self.tcp_fsm, kwargs={"timer": True})  # Transmit pending segments and initialize new state
+        self.timer_persist = stack.timer.register_timer(method=self.__persist_timeout)  # Probe peer's zero window
+
         # Start session in CLOSED state
         self.__change_state("CLOSED")
 
-        # Setup timer to execute FSM time event every milisecond
-        stack.timer.register_method(method=self.tcp_fsm, kwargs={"timer": True})
-
     def __str__(self):
         """ String representation """
 
         return self.tcp_session_id
 
-    @property
-    def tcp_session_id(self):
-        """ Session ID """
+    def __set_session_id(self):
+        """ Set session ID and keys session is registered under in TCP flow table / listener index, called whenever session addresses change """
+
+        self.tcp_session_id = f"TCP/{self.local_ip_address}/{self.local_port}/{self.remote_ip_address}/{self.remote_port}"
+
+        # Listening session bound to '*' accepts connections to any address of either IP version
+        local_ip_address = None if self.local_ip_address in {None, "*"} else ip_pick_version(self.local_ip_address).packed
+        self.tcp_listener_key = (self.local_port, local_ip_address)
 
-        return f"TCP/{self.local_ip_address}/{self.local_port}/{self.remote_ip_address}/{self.remote_port}"
+        if self.remote_ip_address in {None, "*"}:
+            self.tcp_session_key = None
+        else:
+            self.tcp_session_key = (local_ip_address, self.local_port, ip_pick_version(self.remote_ip_address).packed, self.remote_port)
 
     @property
     def tx_buffer_seq_sent(self):
@@ -184,7 +206,7 @@ class TcpSession:
 
         self.logger.debug(f"{self.tcp_session_id} - State {self.state} - got CONNECT syscall")
         self.tcp_fsm(syscall="CONNECT")
-        self.event_connect.acquire()
+        stack.clock.acquire(self.event_connect)
         return self.state == "ESTABLISHED"
 
     def send(self, raw_data):
@@ -193,14 +215,17 @@ class TcpSession:
         if self.state in {"ESTABLISHED", "CLOSE_WAIT"}:
             with self.lock_tx_buffer:
                 self.tx_buffer.extend(list(raw_data))
-                return len(raw_data) if self.state == "ESTABLISHED" else -1
+            # Let the send-ready timer pick up the new data
+            with self.lock_fsm:
+                self.__arm_timers()
+            return len(raw_data) if self.state == "ESTABLISHED" else -1
         return None
 
     def receive(self, byte_count=None):
         """ RECEIVE syscall """
 
         # Wait till there is any data in the buffer
-        self.event_rx_buffer.acquire()
+        stack.clock.acquire(self.event_rx_buffer)
 
         # If there is no data in RX buffer and remote end closed connection then notify application
         if not self.rx_buffer and self.state == "CLOSE_WAIT":
@@ -227,13 +252,6 @@ class TcpSession:
         self.logger.debug(f"{self.tcp_session_id} - State {self.state} - got CLOSE syscall, {len(self.tx_buffer)} bytes in TX buffer")
         self.tcp_fsm(syscall="CLOSE")
 
-    def __pick_random_local_port(self):
-        """ Pick random local port, making sure it is not already being used by any session bound to the same local IP """
-
-        used_ports = {int(_.split("/")[2]) for _ in stack.tcp_sessions if _.split("/")[1] in {"*", self.local_ip_address}}
-        while (port := random.randint(*config.TCP_EPHEMERAL_PORT_RANGE)) not in used_ports:
-            return port
-
     def __change_state(self, state):
         """ Change the state of TCP finite state machine """
 
@@ -244,14 +262,25 @@ class TcpSession:
             self.logger.opt(ansi=True, depth=1).info(f"{self.tcp_session_id} - State changed: <yellow> {old_state} -> {self.state}</>")
 
         # Register session
-        if self.state in {"SYN_SENT", "LISTEN"}:
-            stack.tcp_sessions[self.tcp_session_id] = self
+        if self.state in {"SYN_SENT"}:
+            stack.tcp_sessions[self.tcp_session_key] = self
+            self.logger.debug(f"{self.tcp_session_id} - Registered TCP session")
+
+        # Register listening session
+        if self.state in {"LISTEN"}:
+            stack.tcp_listeners[self.tcp_listener_key] = self
             self.logger.debug(f"{self.tcp_session_id} - Registered TCP session")
 
-        # Unregister session
+        # Unregister session and stop all of its timers
         if self.state in {"CLOSED"}:
-            stack.tcp_sessions.pop(self.tcp_session_id)
+            if old_state == "LISTEN":
+                stack.tcp_listeners.pop(self.tcp_listener_key)
+            else:
+                stack.tcp_sessions.pop(self.tcp_session_key)
+            stack.tcp_ephemeral_ports.release(*self.local_port_binding)
             self.logger.debug(f"{self.tcp_session_id} - Unregistered TCP session")
+            for timer in (self.timer_retransmit, self.timer_delayed_ack, self.timer_time_wait, self.timer_send_ready, self.timer_persist):
+                timer.cancel()
 
     def __transmit_packet(self, seq=None, flag_syn=False, flag_ack=False, flag_fin=False, flag_rst=False, raw_data=b""):
         """ Send out TCP packet """
@@ -273,6 +302,7 @@ class TcpSession:
             tcp_win=self.local_win,
             tcp_mss=self.local_mss if flag_syn else None,
             raw_data=raw_data,
+            tcp_gso_size=self.remote_mss if len(raw_data) > self.remote_mss else None,
         )
         self.remote_seq_ackd = self.remote_seq_rcvd
         self.local_seq_sent = seq + len(raw_data) + flag_syn + flag_fin
@@ -283,22 +313,85 @@ class TcpSession:
         if flag_fin:
             self.local_seq_fin = self.local_seq_sent
 
-        # If in ESTABLISHED state then reset ACK delay timer
-        if self.state == "ESTABLISHED":
-            stack.timer.register_timer(self.tcp_session_id + "-delayed_ack", DELAYED_ACK_DELAY)
-
-        # If packet contains data then Initialize / adjust packet's retransmit counter and timer
+        # If packet contains data then (re)start retransmit timer in case it covers the oldest unacked SEQ or the timer is not running yet
         if raw_data or flag_syn or flag_fin:
-            self.tx_retransmit_timeout_counter[seq] = self.tx_retransmit_timeout_counter.get(seq, -1) + 1
-            stack.timer.register_timer(
-                self.tcp_session_id + "-retransmit_seq-" + str(seq), PACKET_RETRANSMIT_TIMEOUT * (1 << self.tx_retransmit_timeout_counter[seq])
-            )
+            if seq == self.local_seq_ackd or not self.timer_retransmit.active:
+                self.timer_retransmit.reset(PACKET_RETRANSMIT_TIMEOUT * (1 << self.tx_retransmit_timeout_counter))
 
         self.logger.debug(
             f"{self.tcp_session_id} - Sent packet: {'S' if flag_syn else ''}{'F' if flag_fin else ''}{'R' if flag_rst else ''}"
             + f"{'A' if flag_ack else ''}, seq {seq}, ack {ack}, dlen {len(raw_data)}"
         )
 
+    def __transmit_window_probe(self):
+        """ Send out zero window probe, it carries already acknowledged SEQ so peer has to respond with its current window size """
+
+        stack.packet_handler.phtx_tcp(
+            ip_src=self.local_ip_address,
+            ip_dst=self.remote_ip_address,
+            tcp_sport=self.local_port,
+            tcp_dport=self.remote_port,
+            tcp_seq=self.local_seq_sent - 1,
+            tcp_ack=self.remote_seq_rcvd,
+            tcp_flag_ack=True,
+            tcp_win=self.local_win,
+        )
+        self.logger.debug(f"{self.tcp_session_id} - Sent zero window probe, seq {self.local_seq_sent - 1}, ack {self.remote_seq_rcvd}")
+
+    def __persist_timeout(self):
+        """ Persist timer handler, probe peer's zero window so lost window update doesn't stall the session """
+
+        with self.lock_fsm:
+            if self.__zero_window():
+                self.__transmit_window_probe()
+                self.persist_counter += 1
+            self.__arm_timers()
+
+    def __segment_ready(self):
+        """ Check if there is any segment that can be transmitted right away """
+
+        if self.state in {"SYN_SENT", "SYN_RCVD"}:
+            return self.local_seq_sent == self.local_seq_init
+
+        if self.state in {"ESTABLISHED", "CLOSE_WAIT"}:
+            return (self.closing and not self.tx_buffer) or (
+                len(self.tx_buffer) > self.tx_buffer_seq_sent and self.tx_buffer_seq_ackd + self.tx_win > self.tx_buffer_seq_sent
+            )
+
+        if self.state in {"FIN_WAIT_1", "LAST_ACK"}:
+            return self.local_seq_sent != self.local_seq_fin
+
+        return False
+
+    def __zero_window(self):
+        """ Check if data transmission is stalled by peer's zero window """
+
+        return (
+            self.state in {"ESTABLISHED", "CLOSE_WAIT"}
+            and self.remote_win == 0
+            and self.local_seq_sent == self.local_seq_ackd
+            and len(self.tx_buffer) > self.tx_buffer_seq_sent
+        )
+
+    def __arm_timers(self):
+        """ Arm send-ready and persist timers in case session has anything waiting to be transmitted or new state to be initialized """
+
+        # Closed session has had all of its timers cancelled already and must not get any of them re-armed
+        if self.state == "CLOSED":
+            return
+
+        if (self.state_init or self.__segment_ready()) and not self.timer_send_ready.active:
+            self.timer_send_ready.reset(0)
+
+        if not self.__zero_window():
+            self.persist_counter = 0
+            if self.timer_persist.active:
+                self.timer_persist.cancel()
+            return
+
+        if not self.timer_persist.active:
+            self.timer_persist.reset(min(PERSIST_TIMEOUT << self.persist_counter, PERSIST_MAX_TIMEOUT))
+
     def __enqueue_rx_buffer(self, raw_data):
         """ Process the incoming segment and enqueue the data to be used by socket """
 
@@ -329,7 +422,8 @@ class TcpSession:
         if self.state in {"ESTABLISHED", "CLOSE_WAIT"}:
             unsent_data_len = len(self.tx_buffer) - self.tx_buffer_seq_sent
             unused_tx_win_len = self.tx_buffer_seq_ackd + self.tx_win - self.tx_buffer_seq_sent
-            data_tx_len = min(self.remote_mss, unused_tx_win_len, unsent_data_len)
+            # With TAP offloads enabled data can be sent out as super-segment that will be split into MSS sized segments by kernel
+            data_tx_len = min(config.tap_tso_max_size if config.tap_vnet_hdr else self.remote_mss, unused_tx_win_len, unsent_data_len)
             if unsent_data_len:
                 self.logger.opt(ansi=True).debug(
                     f"{self.tcp_session_id} - Sliding window <yellow>[{self.local_seq_ackd}|{self.local_seq_sent}|{self.local_seq_ackd + self.tx_win}]</>"
@@ -353,19 +447,17 @@ class TcpSession:
     def __delayed_ack(self):
         """ Run Delayed ACK mechanism """
 
-        if stack.timer.timer_expired(self.tcp_session_id + "-delayed_ack"):
+        if self.timer_delayed_ack.expired:
             if self.remote_seq_rcvd > self.remote_seq_ackd:
                 self.__transmit_packet(flag_ack=True)
                 self.logger.debug(f"{self.tcp_session_id} - Sent out delayed ACK ({self.remote_seq_rcvd})")
-            stack.timer.register_timer(self.tcp_session_id + "-delayed_ack", DELAYED_ACK_DELAY)
 
     def __retransmit_packet_timeout(self):
         """ Retransmit packet after expired timeout """
 
-        if self.local_seq_ackd in self.tx_retransmit_timeout_counter and stack.timer.timer_expired(
-            self.tcp_session_id + "-retransmit_seq-" + str(self.local_seq_ackd)
-        ):
-            if self.tx_retransmit_timeout_counter[self.local_seq_ackd] == PACKET_RETRANSMIT_MAX_COUNT:
+        # Data gets retransmitted starting from the oldest unacked SEQ regardless of where the original segments (or TSO super-segments) began
+        if self.local_seq_ackd < self.local_seq_sent_max and self.timer_retransmit.expired:
+            if self.tx_retransmit_timeout_counter == PACKET_RETRANSMIT_MAX_COUNT:
                 # Send RST packet if we received any packet from peer already
                 if self.remote_seq_rcvd is not None:
                     self.__transmit_packet(flag_rst=True, flag_ack=True, seq=self.local_seq_ackd)
@@ -381,6 +473,7 @@ class TcpSession:
                 # Change state to CLOSED
                 self.__change_state("CLOSED")
                 return
+            self.tx_retransmit_timeout_counter += 1
             self.tx_win = self.remote_mss
             self.local_seq_sent = self.local_seq_ackd
             # In case we need to retransmit packt containing SYN flag adjust tx_buffer_seq_mod so it doesn't reflect SYN flag yet
@@ -401,6 +494,7 @@ class TcpSession:
         """ Process regular data/ACK packet """
 
         # Make note of the local SEQ that has been acked by peer
+        local_seq_ackd = self.local_seq_ackd
         self.local_seq_ackd = max(self.local_seq_ackd, packet.ack)
         # Adjust local SEQ accordingly to what peer acked (needed after the retransmit happens and peer is jumping to previously received SEQ)
         if self.local_seq_sent < self.local_seq_ackd <= self.local_seq_sent_max:
@@ -411,6 +505,9 @@ class TcpSession:
         if packet.raw_data:
             self.__enqueue_rx_buffer(packet.raw_data)
             self.logger.debug(f"{self.tcp_session_id} - Enqueued {len(packet.raw_data)} bytes starting at {packet.seq}")
+        # In case packet needs to be acked start delayed ACK timer unless it is running already
+        if (packet.raw_data or packet.flag_fin) and not self.timer_delayed_ack.active:
+            self.timer_delayed_ack.reset(DELAYED_ACK_DELAY)
         # Purge acked data from TX buffer
         with self.lock_tx_buffer:
             del self.tx_buffer[: self.tx_buffer_seq_ackd]
@@ -420,19 +517,21 @@ class TcpSession:
         if self.remote_win != packet.win * self.remote_wscale:
             self.logger.debug(f"{self.tcp_session_id} - Updating remote window size {self.remote_win} -> {packet.win * self.remote_wscale}")
             self.remote_win = packet.win * self.remote_wscale
-        # Enlarge TX window
-        self.tx_win = min(self.tx_win << 1, self.remote_win)
+        # Enlarge TX window, restart it from single segment in case peer reopened its zero window
+        self.tx_win = min(max(self.tx_win << 1, self.remote_mss), self.remote_win)
         self.logger.debug(f"{self.tcp_session_id} - Set TX window to {self.tx_win}")
         # Purge expired tx packet retransmit requests
         for seq in list(self.tx_retransmit_request_counter):
             if seq < packet.ack:
                 self.tx_retransmit_request_counter.pop(seq)
                 self.logger.debug(f"{self.tcp_session_id} - Purged expired TX packet retransmit request counter for {seq}")
-        # Purge expired tx packet retransmit timeouts
-        for seq in list(self.tx_retransmit_timeout_counter):
-            if seq < packet.ack:
-                self.tx_retransmit_timeout_counter.pop(seq)
-                self.logger.debug(f"{self.tcp_session_id} - Purged expired TX packet retransmit timeout for {seq}")
+        # In case peer acked new data clear backoff and restart retransmit timer for the oldest unacked SEQ or stop it if there is nothing left to be acked
+        if self.local_seq_ackd > local_seq_ackd:
+            self.tx_retransmit_timeout_counter = 0
+            if self.local_seq_ackd == self.local_seq_sent_max:
+                self.timer_retransmit.cancel()
+            else:
+                self.timer_retransmit.reset(PACKET_RETRANSMIT_TIMEOUT)
         # Purge expired rx retransmit requests
         for seq in list(self.rx_retransmit_request_counter):
             if seq < self.remote_seq_rcvd:
@@ -479,16 +578,15 @@ class TcpSession:
                     remote_port=self.remote_port,
                     socket=self.socket,
                 )
+                # Register the new listening session, it takes over this session's place in listener index and holds its port as well
                 tcp_session.listen()
                 # Adjust this session to match incoming connection
-                stack.tcp_sessions.pop(self.tcp_session_id)
                 self.local_ip_address = packet.local_ip_address
                 self.local_port = packet.local_port
                 self.remote_ip_address = packet.remote_ip_address
                 self.remote_port = packet.remote_port
-                stack.tcp_sessions[self.tcp_session_id] = self
-                # Register the new listening session
-                stack.tcp_sessions[tcp_session.tcp_session_id] = tcp_session
+                self.__set_session_id()
+                stack.tcp_sessions[self.tcp_session_key] = self
                 # Initialize session parameters
                 self.remote_mss = min(packet.mss, config.mtu - 40)
                 self.remote_win = packet.win * self.remote_wscale  # For SYN / SYN + ACK packets this is initialized with wscale=1
@@ -878,11 +976,11 @@ class TcpSession:
         # State initialization
         if self.state_init:
             self.state_init = False
-            stack.timer.register_timer(self.tcp_session_id + "-time_wait", TIME_WAIT_DELAY)
+            self.timer_time_wait.reset(TIME_WAIT_DELAY)
             self.logger.debug(f"{self.tcp_session_id} - State {self.state} initialized")
 
         # Got timer event -> Run TIME_WAIT delay
-        if timer and stack.timer.timer_expired(self.tcp_session_id + "-time_wait"):
+        if timer and self.timer_time_wait.expired:
             self.__change_state("CLOSED")
             return
 
@@ -891,7 +989,7 @@ class TcpSession:
 
         # Process event
         with self.lock_fsm:
-            return {
+            retval = {
                 "CLOSED": self.__tcp_fsm_closed,
                 "LISTEN": self.__tcp_fsm_listen,
                 "SYN_SENT": self.__tcp_fsm_syn_sent,
@@ -904,3 +1002,8 @@ class TcpSession:
                 "LAST_ACK": self.__tcp_fsm_last_ack,
                 "TIME_WAIT": self.__tcp_fsm_time_wait,
             }[self.state](packet, syscall, timer)
+
+            # Arm timers for whatever this event left waiting to be transmitted or initialized
+            self.__arm_timers()
+
+            return retval
@@ -48,11 +48,14 @@ import loguru
 
 import config
 import stack
+from ip_helper import ip_pick_version
 
 PACKET_RETRANSMIT_TIMEOUT = 1000  # Retransmit data if ACK not received
 PACKET_RETRANSMIT_MAX_COUNT = 3  # If data is not acked, retransit it 5 times
 DELAYED_ACK_DELAY = 100  # Delay between consecutive delayed ACK outbound packets
 TIME_WAIT_DELAY = 30000  # 30s delay for the TIME_WAIT state, default is 30-120s
+PERSIST_TIMEOUT = 1000  # Initial delay before probing peer's zero window, doubles after each probe
+PERSIST_MAX_TIMEOUT = 60000  # Maximum delay between consecutive zero window probes
 
 
 def trace_fsm(function):
@@ -98,9 +101,14 @@ class TcpSession:
         self.logger = loguru.logger.bind(object_name="tcp_session.")
 
         self.local_ip_address = local_ip_address
-        self.local_port = local_port if local_port else self.__pick_random_local_port()
+        # Allocator raises OSError when there is no ephemeral port left, session is not created then
+        if local_port:
+            stack.tcp_ephemeral_ports.bind(local_ip_address, local_port)
+        self.local_port = local_port if local_port else stack.tcp_ephemeral_ports.reserve(local_ip_address)
+        self.local_port_binding = (local_ip_address, self.local_port)  # Port held in allocator until session is closed, even if session moves to other address
         self.remote_ip_address = remote_ip_address
         self.remote_port = remote_port
+        self.__set_session_id()
 
         self.socket = socket  # Keeps track of the socket that owns this session for the session -> socket communication purposes
 
@@ -127,7 +135,7 @@ class TcpSession:
         self.snd_wsc = 1  # Window scale, this is always initialized as 1 because initial SYN / SYN + ACK packets don't use wscale for backward compatibility
 
         self.tx_retransmit_request_counter = {}  # Keeps track of DUP packets sent from peer to determine if any of them is a retransmit request
-        self.tx_retransmit_timeout_counter = {}  # Keeps track of the timestamps for the sent out packets, used to determine when to retransmit packet
+        self.tx_retransmit_timeout_counter = 0  # Number of retransmit timeouts expired for the oldest unacked SEQ, used for timer backoff
         self.rx_retransmit_request_counter = {}  # Keeps track of us sending 'fast retransmit request' packets so we can limit their count to 2
 
         self.tx_buffer_seq_mod = self.snd_ini  # Used to help translate local_seq_send and snd_una numbers to TX buffer pointers
@@ -145,19 +153,33 @@ class TcpSession:
 
         self.ooo_packet_queue = {}  # Out of order packet buffer
 
-        # Setup timer to execute FSM time event every milisecond
-        stack.timer.register_method(method=self.tcp_fsm, kwargs={"timer": True})
+        self.persist_counter = 0  # Number of zero window probes sent since peer closed its window
+
+        # Session timers, each of them gets armed only when needed
+        self.timer_retransmit = stack.timer.register_timer(method=self.tcp_fsm, kwargs={"timer": True})  # Retransmit timeout of the oldest unacked segment
+        self.timer_delayed_ack = stack.timer.register_timer(method=self.tcp_fsm, kwargs={"timer": True})  # Delay before acking received data
+        self.timer_time_wait = stack.timer.register_timer(method=self.tcp_fsm, kwargs={"timer": True})  # TIME_WAIT state delay
+        self.timer_send_ready = stack.timer.register_timer(method=self.tcp_fsm, kwargs={"timer": True})  # Transmit segments that became ready to be sent
+        self.timer_persist = stack.timer.register_timer(method=self.__persist_timeout)  # Probe peer's zero window
 
     def __str__(self):
         """ String representation """
 
         return self.tcp_session_id
 
-    @property
-    def tcp_session_id(self):
-        """ Session ID """
+    def __set_session_id(self):
+        """ Set session ID and keys session is registered under in TCP flow table / listener index, called whenever session addresses change """
+
+        self.tcp_session_id = f"TCP/{self.local_ip_address}/{self.local_port}/{self.remote_ip_address}/{self.remote_port}"
 
-        return f"TCP/{self.local_ip_address}/{self.local_port}/{self.remote_ip_address}/{self.remote_port}"
+        # Listening session bound to '*' accepts connections to any address of either IP version
+        local_ip_address = None if self.local_ip_address in {None, "*"} else ip_pick_version(self.local_ip_address).packed
+        self.tcp_listener_key = (self.local_port, local_ip_address)
+
+        if self.remote_ip_address in {None, "*"}:
+            self.tcp_session_key = None
+        else:
+            self.tcp_session_key = (local_ip_address, self.local_port, ip_pick_version(self.remote_ip_address).packed, self.remote_port)
 
     @property
     def tx_buffer_nxt(self):
@@ -182,7 +204,7 @@ class TcpSession:
 
         self.logger.debug(f"{self.tcp_session_id} - State {self.state} - got CONNECT syscall")
         self.tcp_fsm(syscall="CONNECT")
-        self.event_connect.acquire()
+        stack.clock.acquire(self.event_connect)
         return self.state == "ESTABLISHED"
 
     def send(self, raw_data):
@@ -191,14 +213,17 @@ class TcpSession:
         if self.state in {"ESTABLISHED", "CLOSE_WAIT"}:
             with self.lock_tx_buffer:
                 self.tx_buffer.extend(list(raw_data))
-                return len(raw_data) if self.state == "ESTABLISHED" else -1
+            # Let the send-ready timer pick up the new data
+            with self.lock_fsm:
+                self.__arm_timers()
+            return len(raw_data) if self.state == "ESTABLISHED" else -1
         return None
 
     def receive(self, byte_count=None):
         """ RECEIVE syscall """
 
         # Wait till there is any data in the buffer
-        self.event_rx_buffer.acquire()
+        stack.clock.acquire(self.event_rx_buffer)
 
         # If there is no data in RX buffer and remote end closed connection then notify application
         if not self.rx_buffer and self.state == "CLOSE_WAIT":
@@ -225,13 +250,6 @@ class TcpSession:
         self.logger.debug(f"{self.tcp_session_id} - State {self.state} - got CLOSE syscall, {len(self.tx_buffer)} bytes in TX buffer")
         self.tcp_fsm(syscall="CLOSE")
 
-    def __pick_random_local_port(self):
-        """ Pick random local port, making sure it is not already being used by any session bound to the same local IP """
-
-        used_ports = {int(_.split("/")[2]) for _ in stack.tcp_sessions if _.split("/")[1] in {"*", self.local_ip_address}}
-        while (port := random.randint(*config.TCP_EPHEMERAL_PORT_RANGE)) not in used_ports:
-            return port
-
     def __change_state(self, state):
         """ Change the state of TCP finite state machine """
 
@@ -241,14 +259,25 @@ class TcpSession:
             self.logger.opt(ansi=True, depth=1).info(f"{self.tcp_session_id} - State changed: <yellow> {old_state} -> {self.state}</>")
 
         # Register session
-        if self.state in {"SYN_SENT", "LISTEN"}:
-            stack.tcp_sessions[self.tcp_session_id] = self
+        if self.state in {"SYN_SENT"}:
+            stack.tcp_sessions[self.tcp_session_key] = self
             self.logger.debug(f"{self.tcp_session_id} - Registered TCP session")
 
-        # Unregister session
+        # Register listening session
+        if self.state in {"LISTEN"}:
+            stack.tcp_listeners[self.tcp_listener_key] = self
+            self.logger.debug(f"{self.tcp_session_id} - Registered TCP session")
+
+        # Unregister session and stop all of its timers
         if self.state in {"CLOSED"}:
-            stack.tcp_sessions.pop(self.tcp_session_id)
+            if old_state == "LISTEN":
+                stack.tcp_listeners.pop(self.tcp_listener_key)
+            else:
+                stack.tcp_sessions.pop(self.tcp_session_key)
+            stack.tcp_ephemeral_ports.release(*self.local_port_binding)
             self.logger.debug(f"{self.tcp_session_id} - Unregistered TCP session")
+            for timer in (self.timer_retransmit, self.timer_delayed_ack, self.timer_time_wait, self.timer_send_ready, self.timer_persist):
+                timer.cancel()
 
     def __transmit_packet(self, seq=None, flag_syn=False, flag_ack=False, flag_fin=False, flag_rst=False, raw_data=b""):
         """ Send out TCP packet """
@@ -270,6 +299,7 @@ class TcpSession:
             tcp_win=self.rcv_wnd,
             tcp_mss=self.rcv_mss if flag_syn else None,
             raw_data=raw_data,
+            tcp_gso_size=self.snd_mss if len(raw_data) > self.snd_mss else None,
         )
         self.rcv_una = self.rcv_nxt
         self.snd_nxt = seq + len(raw_data) + flag_syn + flag_fin
@@ -280,22 +310,78 @@ class TcpSession:
         if flag_fin:
             self.snd_fin = self.snd_nxt
 
-        # If in ESTABLISHED state then reset ACK delay timer
-        if self.state == "ESTABLISHED":
-            stack.timer.register_timer(self.tcp_session_id + "-delayed_ack", DELAYED_ACK_DELAY)
-
-        # If packet contains data then Initialize / adjust packet's retransmit counter and timer
+        # If packet contains data then (re)start retransmit timer in case it covers the oldest unacked SEQ or the timer is not running yet
         if raw_data or flag_syn or flag_fin:
-            self.tx_retransmit_timeout_counter[seq] = self.tx_retransmit_timeout_counter.get(seq, -1) + 1
-            stack.timer.register_timer(
-                self.tcp_session_id + "-retransmit_seq-" + str(seq), PACKET_RETRANSMIT_TIMEOUT * (1 << self.tx_retransmit_timeout_counter[seq])
-            )
+            if seq == self.snd_una or not self.timer_retransmit.active:
+                self.timer_retransmit.reset(PACKET_RETRANSMIT_TIMEOUT * (1 << self.tx_retransmit_timeout_counter))
 
         self.logger.debug(
             f"{self.tcp_session_id} - Sent packet: {'S' if flag_syn else ''}{'F' if flag_fin else ''}{'R' if flag_rst else ''}"
             + f"{'A' if flag_ack else ''}, seq {seq}, ack {ack}, dlen {len(raw_data)}"
         )
 
+    def __transmit_window_probe(self):
+        """ Send out zero window probe, it carries already acknowledged SEQ so peer has to respond with its current window size """
+
+        stack.packet_handler.phtx_tcp(
+            ip_src=self.local_ip_address,
+            ip_dst=self.remote_ip_address,
+            tcp_sport=self.local_port,
+            tcp_dport=self.remote_port,
+            tcp_seq=self.snd_nxt - 1,
+            tcp_ack=self.rcv_nxt,
+            tcp_flag_ack=True,
+            tcp_win=self.rcv_wnd,
+        )
+        self.logger.debug(f"{self.tcp_session_id} - Sent zero window probe, seq {self.snd_nxt - 1}, ack {self.rcv_nxt}")
+
+    def __persist_timeout(self):
+        """ Persist timer handler, probe peer's zero window so lost window update doesn't stall the session """
+
+        with self.lock_fsm:
+            if self.__zero_window():
+                self.__transmit_window_probe()
+                self.persist_counter += 1
+            self.__arm_timers()
+
+    def __segment_ready(self):
+        """ Check if there is any segment that can be transmitted right away """
+
+        if self.state in {"SYN_SENT", "SYN_RCVD"}:
+            return self.snd_nxt == self.snd_ini
+
+        if self.state in {"ESTABLISHED", "CLOSE_WAIT"}:
+            return (self.closing and not self.tx_buffer) or (len(self.tx_buffer) > self.tx_buffer_nxt and self.snd_ewn > self.tx_buffer_nxt)
+
+        if self.state in {"FIN_WAIT_1", "LAST_ACK"}:
+            return self.snd_nxt != self.snd_fin
+
+        return False
+
+    def __zero_window(self):
+        """ Check if data transmission is stalled by peer's zero window """
+
+        return self.state in {"ESTABLISHED", "CLOSE_WAIT"} and self.snd_wnd == 0 and self.snd_nxt == self.snd_una and len(self.tx_buffer) > self.tx_buffer_nxt
+
+    def __arm_timers(self):
+        """ Arm send-ready and persist timers in case session has anything waiting to be transmitted """
+
+        # Closed session has had all of its timers cancelled already and must not get any of them re-armed
+        if self.state == "CLOSED":
+            return
+
+        if self.__segment_ready() and not self.timer_send_ready.active:
+            self.timer_send_ready.reset(0)
+
+        if not self.__zero_window():
+            self.persist_counter = 0
+            if self.timer_persist.active:
+                self.timer_persist.cancel()
+            return
+
+        if not self.timer_persist.active:
+            self.timer_persist.reset(min(PERSIST_TIMEOUT << self.persist_counter, PERSIST_MAX_TIMEOUT))
+
     def __enqueue_rx_buffer(self, raw_data):
         """ Process the incoming segment and enqueue the data to be used by socket """
 
@@ -326,7 +412,8 @@ class TcpSession:
         if self.state in {"ESTABLISHED", "CLOSE_WAIT"}:
             remaining_data_len = len(self.tx_buffer) - self.tx_buffer_nxt
             usable_window = self.snd_ewn - self.tx_buffer_nxt
-            transmit_data_len = min(self.snd_mss, usable_window, remaining_data_len)
+            # With TAP offloads enabled data can be sent out as super-segment that will be split into MSS sized segments by kernel
+            transmit_data_len = min(config.tap_tso_max_size if config.tap_vnet_hdr else self.snd_mss, usable_window, remaining_data_len)
             if remaining_data_len:
                 self.logger.opt(ansi=True).debug(
                     f"{self.tcp_session_id} - Sliding window <yellow>[{self.snd_una}|{self.snd_nxt}|{self.snd_una + self.snd_ewn}]</>"
@@ -350,17 +437,17 @@ class TcpSession:
     def __delayed_ack(self):
         """ Run Delayed ACK mechanism """
 
-        if stack.timer.timer_expired(self.tcp_session_id + "-delayed_ack"):
+        if self.timer_delayed_ack.expired:
             if self.rcv_nxt > self.rcv_una:
                 self.__transmit_packet(flag_ack=True)
                 self.logger.debug(f"{self.tcp_session_id} - Sent out delayed ACK ({self.rcv_nxt})")
-            stack.timer.register_timer(self.tcp_session_id + "-delayed_ack", DELAYED_ACK_DELAY)
 
     def __retransmit_packet_timeout(self):
         """ Retransmit packet after expired timeout """
 
-        if self.snd_una in self.tx_retransmit_timeout_counter and stack.timer.timer_expired(self.tcp_session_id + "-retransmit_seq-" + str(self.snd_una)):
-            if self.tx_retransmit_timeout_counter[self.snd_una] == PACKET_RETRANSMIT_MAX_COUNT:
+        # Data gets retransmitted starting from the oldest unacked SEQ regardless of where the original segments (or TSO super-segments) began
+        if self.snd_una < self.snd_max and self.timer_retransmit.expired:
+            if self.tx_retransmit_timeout_counter == PACKET_RETRANSMIT_MAX_COUNT:
                 # Send RST packet if we received any packet from peer already
                 if self.rcv_nxt is not None:
                     self.__transmit_packet(flag_rst=True, flag_ack=True, seq=self.snd_una)
@@ -376,6 +463,7 @@ class TcpSession:
                 # Change state to CLOSED
                 self.__change_state("CLOSED")
                 return
+            self.tx_retransmit_timeout_counter += 1
             self.snd_ewn = self.snd_mss
             self.snd_nxt = self.snd_una
             # In case we need to retransmit packt containing SYN flag adjust tx_buffer_seq_mod so it doesn't reflect SYN flag yet
@@ -396,6 +484,7 @@ class TcpSession:
         """ Process regular data/ACK packet """
 
         # Make note of the local SEQ that has been acked by peer
+        snd_una = self.snd_una
         self.snd_una = max(self.snd_una, packet.ack)
         # Adjust local SEQ accordingly to what peer acked (needed after the retransmit happens and peer is jumping to previously received SEQ)
         if self.snd_nxt < self.snd_una <= self.snd_max:
@@ -406,6 +495,9 @@ class TcpSession:
         if packet.raw_data:
             self.__enqueue_rx_buffer(packet.raw_data)
             self.logger.debug(f"{self.tcp_session_id} - Enqueued {len(packet.raw_data)} bytes starting at {packet.seq}")
+        # In case packet needs to be acked start delayed ACK timer unless it is running already
+        if (packet.raw_data or packet.flag_fin) and not self.timer_delayed_ack.active:
+            self.timer_delayed_ack.reset(DELAYED_ACK_DELAY)
         # Purge acked data from TX buffer
         with self.lock_tx_buffer:
             del self.tx_buffer[: self.tx_buffer_una]
@@ -415,19 +507,21 @@ class TcpSession:
         if self.snd_wnd != packet.win * self.snd_wsc:
             self.logger.debug(f"{self.tcp_session_id} - Updated sending window size {self.snd_wnd} -> {packet.win * self.snd_wsc}")
             self.snd_wnd = packet.win * self.snd_wsc
-        # Enlarge effective sending window
-        self.snd_ewn = min(self.snd_ewn << 1, self.snd_wnd)
+        # Enlarge effective sending window, restart it from single segment in case peer reopened its zero window
+        self.snd_ewn = min(max(self.snd_ewn << 1, self.snd_mss), self.snd_wnd)
         self.logger.debug(f"{self.tcp_session_id} - Updated effective sending window to {self.snd_ewn}")
         # Purge expired tx packet retransmit requests
         for seq in list(self.tx_retransmit_request_counter):
             if seq < packet.ack:
                 self.tx_retransmit_request_counter.pop(seq)
                 self.logger.debug(f"{self.tcp_session_id} - Purged expired TX packet retransmit request counter for {seq}")
-        # Purge expired tx packet retransmit timeouts
-        for seq in list(self.tx_retransmit_timeout_counter):
-            if seq < packet.ack:
-                self.tx_retransmit_timeout_counter.pop(seq)
-                self.logger.debug(f"{self.tcp_session_id} - Purged expired TX packet retransmit timeout for {seq}")
+        # In case peer acked new data clear backoff and restart retransmit timer for the oldest unacked SEQ or stop it if there is nothing left to be acked
+        if self.snd_una > snd_una:
+            self.tx_retransmit_timeout_counter = 0
+            if self.snd_una == self.snd_max:
+                self.timer_retransmit.cancel()
+            else:
+                self.timer_retransmit.reset(PACKET_RETRANSMIT_TIMEOUT)
         # Purge expired rx retransmit requests
         for seq in list(self.rx_retransmit_request_counter):
             if seq < self.rcv_nxt:
@@ -464,16 +558,15 @@ class TcpSession:
                     remote_port=self.remote_port,
                     socket=self.socket,
                 )
+                # Register the new listening session, it takes over this session's place in listener index and holds its port as well
                 tcp_session.listen()
                 # Adjust this session to match incoming connection
-                stack.tcp_sessions.pop(self.tcp_session_id)
                 self.local_ip_address = packet.local_ip_address
                 self.local_port = packet.local_port
                 self.remote_ip_address = packet.remote_ip_address
                 self.remote_port = packet.remote_port
-                stack.tcp_sessions[self.tcp_session_id] = self
-                # Register the new listening session
-                stack.tcp_sessions[tcp_session.tcp_session_id] = tcp_session
+                self.__set_session_id()
+                stack.tcp_sessions[self.tcp_session_key] = self
                 # Initialize session parameters
                 self.snd_mss = min(packet.mss, config.mtu - 40)
                 self.snd_wnd = packet.win * self.snd_wsc  # For SYN / SYN + ACK packets this is initialized with wscale=1
@@ -692,7 +785,7 @@ class TcpSession:
                     # Change state to TIME_WAIT
                     self.__change_state("TIME_WAIT")
                     # Initialize TIME_WAIT delay
-                    stack.timer.register_timer(self.tcp_session_id + "-time_wait", TIME_WAIT_DELAY)
+                    self.timer_time_wait.reset(TIME_WAIT_DELAY)
                 else:
                     # Change state to CLOSING
                     self.__change_state("CLOSING")
@@ -730,7 +823,7 @@ class TcpSession:
                 # Change state to TIME_WAIT
                 self.__change_state("TIME_WAIT")
                 # Initialize TIME_WAIT delay
-                stack.timer.register_timer(self.tcp_session_id + "-time_wait", TIME_WAIT_DELAY)
+                self.timer_time_wait.reset(TIME_WAIT_DELAY)
                 return
 
         # Got RST + ACK packet -> Change state to CLOSED
@@ -751,7 +844,7 @@ class TcpSession:
                 self.snd_una = packet.ack
                 self.__change_state("TIME_WAIT")
                 # Initialize TIME_WAIT delay
-                stack.timer.register_timer(self.tcp_session_id + "-time_wait", TIME_WAIT_DELAY)
+                self.timer_time_wait.reset(TIME_WAIT_DELAY)
                 return
 
         # Got RST + ACK packet -> Change state to CLOSED
@@ -834,7 +927,7 @@ class TcpSession:
         """ TCP FSM TIME_WAIT state handler """
 
         # Got timer event -> Run TIME_WAIT delay
-        if timer and stack.timer.timer_expired(self.tcp_session_id + "-time_wait"):
+        if timer and self.timer_time_wait.expired:
             self.__change_state("CLOSED")
             return
 
@@ -843,7 +936,7 @@ class TcpSession:
 
         # Process event
         with self.lock_fsm:
-            return {
+            retval = {
                 "CLOSED": self.__tcp_fsm_closed,
                 "LISTEN": self.__tcp_fsm_listen,
                 "SYN_SENT": self.__tcp_fsm_syn_sent,
@@ -856,3 +949,8 @@ class TcpSession:
                 "LAST_ACK": self.__tcp_fsm_last_ack,
                 "TIME_WAIT": self.__tcp_fsm_time_wait,
             }[self.state](packet, syscall, timer)
+
+            # Arm timers for whatever this event left waiting to be transmitted
+            self.__arm_timers()
+
+            return retval
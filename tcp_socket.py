@@ -123,7 +123,7 @@ class TcpSocket:
         """ Wait for the established inbound connection, then create new socket for it and return it """
 
         self.logger.debug(f"{self.socket_id} - Waiting for established inbound connection")
-        self.event_tcp_session_established.acquire()
+        stack.clock.acquire(self.event_tcp_session_established)
         for tcp_session in stack.tcp_sessions.values():
             if tcp_session.socket is self and tcp_session.state == "ESTABLISHED":
                 return TcpSocket(tcp_session=tcp_session)
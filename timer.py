@@ -41,20 +41,25 @@
 #
 
 
+import heapq
+import itertools
 import threading
-import time
 
 import loguru
 
 import stack
+from clock import Clock
+
+STALE_ENTRIES_MIN = 64  # Minimum number of cancelled heap entries before the heap gets compacted
 
 
 class TimerTask:
-    """ Timer task support class """
+    """ Timer task support class, returned to the caller as handle that can be used to cancel or reset the task """
 
-    def __init__(self, method, args, kwargs, delay, delay_exp, repeat_count, stop_condition):
+    def __init__(self, timer, method, args, kwargs, delay, delay_exp, repeat_count, stop_condition):
         """ Class constructor, repeat_count = -1 means infinite, delay_exp means to raise delay time exponentialy after each method execution """
 
+        self.timer = timer
         self.method = method
         self.args = args
         self.kwargs = kwargs
@@ -63,81 +68,221 @@ class TimerTask:
         self.repeat_count = repeat_count
         self.stop_condition = stop_condition
 
-        self.remaining_delay = delay
+        self.deadline = None
+        self.sequence = None  # Sequence of the task's current heap entry, None when task is not scheduled
+        self.expired = False  # Indicates that task reached its last execution and has not been reset since
+        self.cancelled = False  # Indicates that task has been cancelled and has not been reset since
         self.delay_exp_factor = 0
+        self.context = stack.context  # Stack instance task gets executed on behalf of, when simulation runs several of them in single process
 
-    def tick(self):
-        """ Tick input from timer """
+    @property
+    def active(self):
+        """ Check if task is scheduled to be executed """
 
-        self.remaining_delay -= 1
+        return self.sequence is not None
 
-        if self.stop_condition and self.stop_condition():
-            self.remaining_delay = 0
-            return
+    def cancel(self):
+        """ Cancel task, it can be scheduled again with reset() """
 
-        if self.remaining_delay:
-            return
+        with self.timer.tasks_changed:
+            self.timer.cancel_task(self)
+            self.expired = False
+            self.cancelled = True
+
+    def reset(self, delay=None):
+        """ (Re)schedule task to be executed after given or its original delay, counting from now """
+
+        with self.timer.tasks_changed:
+            if delay is not None:
+                self.delay = delay
+            self.expired = False
+            self.cancelled = False
+            self.delay_exp_factor = 0
+            self.timer.schedule_task(self, self.timer.clock.monotonic() + self.delay / 1000)
+
+    def run(self):
+        """ Execute task's method and schedule it again if it has more runs left """
+
+        with self.timer.tasks_changed:
+            # Skip task that got reset or cancelled by other thread after being taken off the heap
+            if self.active or self.cancelled:
+                return
+
+            if self.stop_condition and self.stop_condition():
+                return
+
+            # Mark the last execution before running method, so the method itself can already see the task as expired
+            if not self.repeat_count:
+                self.expired = True
 
         self.method(*self.args, **self.kwargs)
 
-        if self.repeat_count:
-            self.remaining_delay = self.delay * (1 << self.delay_exp_factor) if self.delay_exp else self.delay
+        # Bookkeeping and rescheduling are done in single step, so task reset or cancelled meanwhile by other thread doesn't get re-armed
+        with self.timer.tasks_changed:
+            # Method or other thread may have reset or cancelled the task already
+            if self.active or self.cancelled or not self.repeat_count:
+                return
+
+            delay = self.delay * (1 << self.delay_exp_factor) if self.delay_exp else self.delay
             self.delay_exp_factor += 1
             if self.repeat_count > 0:
                 self.repeat_count -= 1
 
+            # Count next deadline from the previous one so the task doesn't drift by its own execution time,
+            # if we are already late by more than whole delay period don't try to catch up with missed runs
+            deadline = self.deadline + delay / 1000
+            if deadline < (now := self.timer.clock.monotonic()):
+                deadline = now + delay / 1000
+
+            self.timer.schedule_task(self, deadline)
+
 
 class Timer:
     """ Support for stack timer """
 
-    def __init__(self):
-        """ Class constructor """
+    def __init__(self, clock=None):
+        """ Class constructor, simulated clock replaces timer thread with simulation driver executing tasks on run_next() / run_until() calls """
 
         stack.timer = self
+        stack.clock = self.clock = Clock() if clock is None else clock
+        self.clock.timer = self
 
         self.logger = loguru.logger.bind(object_name="timer.")
 
         self.run_timer = True
 
+        # Heap of (deadline, sequence, task) entries, entries of cancelled and reset tasks are left in place and skipped when popped
         self.tasks = []
-        self.timers = {}
+        self.stale_entries = 0
+
+        self.task_sequence = itertools.count()
+        self.tasks_changed = threading.Condition()
+
+        if self.clock.simulated:
+            self.logger.debug("Started timer in simulated time mode")
+            return
 
         threading.Thread(target=self.__thread_timer).start()
         self.logger.debug("Started timer")
 
     def __thread_timer(self):
-        """ Thread responsible for executing registered methods on every timer tick """
+        """ Thread responsible for executing registered methods when their deadlines are reached """
 
         while self.run_timer:
-            time.sleep(0.001)
+            with self.tasks_changed:
+                now = self.clock.monotonic()
 
-            # Tck registered timers
-            for name in self.timers:
-                self.timers[name] -= 1
+                # Sleep until the earliest deadline or until new task that expires earlier gets registered
+                if (deadline := self.__next_deadline()) is None or deadline > now:
+                    self.tasks_changed.wait(timeout=None if deadline is None else deadline - now)
+                    continue
 
-            # Cleanup expired timers
-            self.timers = {_: __ for _, __ in self.timers.items() if __}
+                expired_tasks = self.__pop_expired_tasks(now)
 
-            # Tick registered methods
-            for task in self.tasks:
-                task.tick()
+            self.__run_tasks(expired_tasks)
 
-            # Cleanup expired methods
-            self.tasks = [_ for _ in self.tasks if _.remaining_delay]
+    def __next_deadline(self):
+        """ Discard stale entries from the top of the heap and return the earliest deadline """
 
-    def register_method(self, method, args=None, kwargs=None, delay=1, delay_exp=False, repeat_count=-1, stop_condition=None):
-        """ Register method to be executed by timer """
+        while self.tasks and self.tasks[0][1] != self.tasks[0][2].sequence:
+            heapq.heappop(self.tasks)
+            self.stale_entries -= 1
+
+        return self.tasks[0][0] if self.tasks else None
+
+    def __pop_expired_tasks(self, now):
+        """ Take all the tasks that expired by given time off the heap """
+
+        expired_tasks = []
+        while self.tasks and self.tasks[0][0] <= now:
+            _, sequence, task = heapq.heappop(self.tasks)
 
-        self.tasks.append(TimerTask(method, [] if args is None else args, {} if kwargs is None else kwargs, delay, delay_exp, repeat_count, stop_condition))
+            # Skip entries left behind by cancelled or reset tasks
+            if sequence != task.sequence:
+                self.stale_entries -= 1
+                continue
 
-    def register_timer(self, name, timeout):
-        """ Register delay timer """
+            task.sequence = None
+            expired_tasks.append(task)
 
-        self.timers[name] = timeout
+        return expired_tasks
+
+    def __run_tasks(self, expired_tasks):
+        """ Execute expired methods outside of the lock so they are free to register, reset or cancel tasks """
+
+        context = stack.context
+
+        for task in expired_tasks:
+            if task.context is not stack.context:
+                stack.switch_context(task.context)
+            task.run()
+
+        # Leave globals of the stack instance that drives simulation in place
+        if stack.context is not context:
+            stack.switch_context(context)
+
+    def run_next(self, limit=None):
+        """ Simulation driver, jump clock to the earliest deadline not later than limit and execute tasks expiring at it, return False if there was none """
+
+        with self.tasks_changed:
+            if (deadline := self.__next_deadline()) is None or (limit is not None and deadline > limit):
+                return False
+
+            self.clock.now = max(self.clock.now, deadline)
+            expired_tasks = self.__pop_expired_tasks(self.clock.now)
+
+        self.__run_tasks(expired_tasks)
+        return True
+
+    def run_until(self, limit):
+        """ Simulation driver, execute all tasks expiring up to given virtual time and leave clock at that time """
+
+        while self.run_next(limit):
+            pass
+
+        self.clock.now = max(self.clock.now, limit)
+
+    def schedule_task(self, task, deadline):
+        """ Put task on the heap and wake up timer thread if the task became the earliest one """
+
+        with self.tasks_changed:
+            if task.active:
+                self.stale_entries += 1
+            task.deadline = deadline
+            task.sequence = next(self.task_sequence)
+            heapq.heappush(self.tasks, (deadline, task.sequence, task))
+            self.__compact()
+            if self.tasks[0][2] is task:
+                self.tasks_changed.notify()
+
+    def cancel_task(self, task):
+        """ Remove task from schedule """
+
+        with self.tasks_changed:
+            if task.active:
+                task.sequence = None
+                self.stale_entries += 1
+                self.__compact()
+
+    def __compact(self):
+        """ Rebuild the heap once most of its entries belong to cancelled or reset tasks """
+
+        if self.stale_entries > STALE_ENTRIES_MIN and self.stale_entries > len(self.tasks) // 2:
+            self.tasks = [_ for _ in self.tasks if _[1] == _[2].sequence]
+            heapq.heapify(self.tasks)
+            self.stale_entries = 0
+
+    def register_method(self, method, args=None, kwargs=None, delay=1, delay_exp=False, repeat_count=-1, stop_condition=None):
+        """ Register method to be executed by timer, return task handle """
 
-    def timer_expired(self, name):
-        """ Check if timer expired """
+        task = TimerTask(self, method, [] if args is None else args, {} if kwargs is None else kwargs, delay, delay_exp, repeat_count, stop_condition)
+        task.reset()
+        return task
 
-        self.logger.opt(ansi=True).trace(f"<red>Active timers: {self.timers}</>")
+    def register_timer(self, method, args=None, kwargs=None, delay=None):
+        """ Register one-shot timer executing method on expiry, return task handle, timer is left inactive until reset() if delay is not provided """
 
-        return not self.timers.get(name, None)
+        task = TimerTask(self, method, [] if args is None else args, {} if kwargs is None else kwargs, delay, False, 0, None)
+        if delay is not None:
+            task.reset()
+        return task
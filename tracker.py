@@ -41,7 +41,7 @@
 #
 
 
-import time
+import stack
 
 
 class Tracker:
@@ -58,14 +58,14 @@ class Tracker:
         assert prefix in {"RX", "TX"}
 
         if prefix == "RX":
-            self.timestamp = time.time()
+            self.timestamp = stack.clock.time()
             self.serial = f"RX{Tracker.serial_rx:0>4x}".upper()
             Tracker.serial_rx += 1
             if Tracker.serial_rx > 0xFFFF:
                 Tracker.serial_rx = 0
 
         if prefix == "TX":
-            self.timestamp = time.time()
+            self.timestamp = stack.clock.time()
             self.serial = f"TX{Tracker.serial_tx:0>4x}".upper()
             Tracker.serial_tx += 1
             if Tracker.serial_tx > 0xFFFF:
@@ -84,6 +84,6 @@ class Tracker:
         """ Latency between echo tracker timestamp and current time """
 
         if self.echo_tracker:
-            return f" {(time.time() - self.echo_tracker.timestamp) * 1000:.3f}ms"
+            return f" {(stack.clock.time() - self.echo_tracker.timestamp) * 1000:.3f}ms"
 
         return ""
@@ -41,55 +41,60 @@
 #
 
 
-import os
 import threading
 
 import loguru
 
+import config
+import stack
+from ring_buffer import RingBuffer
+
 
 class TxRing:
     """ Support for sending packets to the network """
 
-    def __init__(self, tap):
-        """ Initialize access to tap interface and the outbound queue """
+    def __init__(self, link):
+        """ Initialize access to link backend and the outbound queue """
 
-        self.tap = tap
+        self.link = link
 
-        self.tx_ring = []
+        self.tx_ring = RingBuffer(config.tx_ring_depth, config.ring_drop_policy)
         self.logger = loguru.logger.bind(object_name="tx_ring.")
 
-        self.packet_enqueued = threading.Semaphore(0)
-
-        threading.Thread(target=self.__thread_dequeue).start()
+        # In simulated time mode packets are handed over to link right away as they get enqueued
+        if not stack.clock.simulated:
+            threading.Thread(target=self.__thread_dequeue).start()
         self.logger.debug("Started TX ring")
 
     def __thread_dequeue(self):
-        """ Dequeue packet from TX ring """
+        """ Dequeue batches of packets from TX ring """
 
         while True:
-            # Wait till packets is avaiable int he queue the pick it up
-            self.packet_enqueued.acquire()
-            ether_packet_tx = self.tx_ring.pop(0)
-            self.logger.opt(ansi=True).debug(f"{ether_packet_tx.tracker}")
-            self.__transmit(ether_packet_tx)
+            # Wait till packets are avaiable in the queue then pick up as many of them as single batch allows
+            self.__transmit(self.tx_ring.dequeue_batch(config.tx_batch_size))
+
+    def __transmit(self, batch):
+        """ Transmit batch of packets, link backend drops packets it is not able to take right away """
+
+        sent = self.link.transmit_batch([(ether_packet_tx.get_raw_packet(), ether_packet_tx.vnet_hdr) for ether_packet_tx in batch])
 
-    def __transmit(self, ether_packet_tx):
-        """ Transmit packet """
+        for ether_packet_tx, packet_sent in zip(batch, sent):
+            if not packet_sent:
+                self.logger.opt(ansi=True).debug(f"<red>[TX]</> {ether_packet_tx.tracker} - {self.link.name} link busy, packet dropped")
+                continue
 
-        os.write(self.tap, ether_packet_tx.get_raw_packet())
-        self.logger.opt(ansi=True).debug(
-            f"<magenta>[TX]</> {ether_packet_tx.tracker}<yellow>{ether_packet_tx.tracker.latency}</> - {len(ether_packet_tx)} bytes"
-        )
+            self.logger.opt(ansi=True).debug(
+                f"<magenta>[TX]</> {ether_packet_tx.tracker}<yellow>{ether_packet_tx.tracker.latency}</> - {len(ether_packet_tx)} bytes"
+            )
 
     def enqueue(self, ether_packet_tx, urgent=False):
         """ Enqueue outbound Ethernet packet to TX ring """
 
-        if urgent:
-            self.tx_ring.insert(0, ether_packet_tx)
-            self.logger.opt(ansi=True).debug(f"{ether_packet_tx.tracker}, priority: Urgent, queue len: {len(self.tx_ring)}")
+        if not self.tx_ring.enqueue(ether_packet_tx, urgent):
+            self.logger.opt(ansi=True).debug(f"{ether_packet_tx.tracker}, <red>TX ring full, packet dropped</>, {self.tx_ring}")
+            return
 
-        else:
-            self.tx_ring.append(ether_packet_tx)
-            self.logger.opt(ansi=True).debug(f"{ether_packet_tx.tracker}, priorty: Normal, queue len: {len(self.tx_ring)}")
+        self.logger.opt(ansi=True).debug(f"{ether_packet_tx.tracker}, priority: {'Urgent' if urgent else 'Normal'}, queue len: {len(self.tx_ring)}")
 
-        self.packet_enqueued.release()
+        if stack.clock.simulated:
+            self.__transmit(self.tx_ring.dequeue_batch(config.tx_batch_size, timeout=0))
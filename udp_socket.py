@@ -46,6 +46,7 @@ import threading
 import loguru
 
 import stack
+from ip_helper import ip_pick_version
 
 
 class UdpSocket:
@@ -71,14 +72,53 @@ class UdpSocket:
     def socket_id(self):
         return f"UDP/{self.local_ip_address}/{self.local_port}/{self.remote_ip_address}/{self.remote_port}"
 
-    def bind(self, local_ip_address, local_port):
-        """ Bind the socket to local address """
+    @property
+    def specificity(self):
+        """ Rank of socket binding, sockets bound to the same local port are matched against inbound packet from the most specific one """
+
+        return (
+            self.__remote_ip_address is not None,
+            self.__local_ip_address is not None and not self.__local_ip_address.is_unspecified,
+            self.__remote_port is not None,
+            self.__local_ip_address is not None,
+        )
+
+    def bind(self, local_ip_address, local_port=None):
+        """ Bind the socket to local address, pick ephemeral port if local port is not specified """
 
+        # Allocator raises OSError when there is no ephemeral port left, socket is left unbound then
+        if local_port:
+            stack.udp_ephemeral_ports.bind(local_ip_address, local_port)
+        self.local_port = local_port if local_port else stack.udp_ephemeral_ports.reserve(local_ip_address)
         self.local_ip_address = local_ip_address
-        self.local_port = local_port
-        stack.udp_sockets[self.socket_id] = self
+
+        # Binding is kept in form of address objects, None stands for '*' wildcard and unspecified local address stands for any address of its IP version
+        self.__local_ip_address = None if self.local_ip_address == "*" else ip_pick_version(self.local_ip_address)
+        self.__remote_ip_address = None if self.remote_ip_address == "*" else ip_pick_version(self.remote_ip_address)
+        self.__remote_port = None if self.remote_port == "*" else self.remote_port
+
+        # Sockets bound to given port are stored in the order they are to be matched against inbound packet, list gets replaced instead of
+        # being modified so packet handler can iterate over it without locking
+        stack.udp_sockets[self.local_port] = sorted((*stack.udp_sockets.get(self.local_port, ()), self), key=lambda _: _.specificity, reverse=True)
         self.logger.debug(f"{self.socket_id} - Socket bound to local address")
 
+    def match(self, packet):
+        """ Check if inbound packet's metadata matches socket binding """
+
+        if self.__remote_port is not None and self.__remote_port != packet.remote_port:
+            return False
+
+        if self.__remote_ip_address is not None and self.__remote_ip_address != packet.remote_ip_address:
+            return False
+
+        if self.__local_ip_address is None:
+            return True
+
+        if self.__local_ip_address.is_unspecified:
+            return self.__local_ip_address.version == packet.local_ip_address.version
+
+        return self.__local_ip_address == packet.local_ip_address
+
     @staticmethod
     def send_to(packet):
         """ Put data from UdpMetadata structure into TX ring """
@@ -94,14 +134,20 @@ class UdpSocket:
     def receive_from(self, timeout=None):
         """ Read data from listening socket and return UdpMessage structure """
 
-        if self.packet_rx_ready.acquire(timeout=timeout):
+        if stack.clock.acquire(self.packet_rx_ready, timeout=timeout):
             return self.packet_rx.pop(0)
         return None
 
     def close(self):
         """ Close socket """
 
-        stack.udp_sockets.pop(self.socket_id)
+        if udp_sockets := [_ for _ in stack.udp_sockets.get(self.local_port, ()) if _ is not self]:
+            stack.udp_sockets[self.local_port] = udp_sockets
+        else:
+            stack.udp_sockets.pop(self.local_port, None)
+
+        if self.local_port is not None:
+            stack.udp_ephemeral_ports.release(self.local_ip_address, self.local_port)
         self.logger.debug(f"Closed UDP socket {self.socket_id}")
 
     def process_packet(self, packet):
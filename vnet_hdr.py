@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyTCP - Python TCP/IP stack                                             #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyTCP                   #
+#                                                                          #
+############################################################################
+
+##############################################################################################
+#                                                                                            #
+#  This program is a work in progress and it changes on daily basis due to new features      #
+#  being implemented, changes being made to already implemented features, bug fixes, etc.    #
+#  Therefore if the current version is not working as expected try to clone it again the     #
+#  next day or shoot me an email describing the problem. Any input is appreciated. Also      #
+#  keep in mind that some features may be implemented only partially (as needed for stack    #
+#  operation) or they may be implemented in sub-optimal or not 100% RFC compliant way (due   #
+#  to lack of time) or last but not least they may contain bug(s) that i didn't notice yet.  #
+#                                                                                            #
+##############################################################################################
+
+
+#
+# vnet_hdr.py - module contains class supporting virtio-net header used by TAP interface offloads
+#
+
+
+import struct
+
+# virtio-net header, preceeds every frame when TAP interface is opened with IFF_VNET_HDR flag (host byte order)
+
+# +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+# |     Flags     |   GSO type    |         Header length         |
+# +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+# |           GSO size            |         Checksum start        |
+# +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+# |        Checksum offset        |
+# +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+
+
+VNET_HDR_LEN = 10
+
+VNET_HDR_F_NEEDS_CSUM = 1  # Checksum field contains pseudo header sum only, the rest needs to be computed starting at csum_start
+VNET_HDR_F_DATA_VALID = 2  # Checksum has already been validated
+
+VNET_HDR_GSO_NONE = 0
+VNET_HDR_GSO_TCPV4 = 1
+VNET_HDR_GSO_TCPV6 = 4
+
+VNET_HDR_GSO_TABLE = {VNET_HDR_GSO_NONE: "NONE", VNET_HDR_GSO_TCPV4: "TCPV4", VNET_HDR_GSO_TCPV6: "TCPV6"}
+
+VNET_HDR_STRUCT = struct.Struct("= BBHHHH")
+
+
+class VnetHdr:
+    """ virtio-net header support class """
+
+    def __init__(self, raw_header=None, flags=0, gso_type=VNET_HDR_GSO_NONE, hdr_len=0, gso_size=0, csum_start=0, csum_offset=0):
+        """ Class constructor """
+
+        # Header parsing
+        if raw_header:
+            self.flags, self.gso_type, self.hdr_len, self.gso_size, self.csum_start, self.csum_offset = VNET_HDR_STRUCT.unpack(raw_header[:VNET_HDR_LEN])
+
+        # Header building
+        else:
+            self.flags = flags
+            self.gso_type = gso_type
+            self.hdr_len = hdr_len
+            self.gso_size = gso_size
+            self.csum_start = csum_start
+            self.csum_offset = csum_offset
+
+    def __str__(self):
+        """ Short header log string """
+
+        return (
+            f"VNET{' NEEDS_CSUM' if self.flags & VNET_HDR_F_NEEDS_CSUM else ''}{' DATA_VALID' if self.flags & VNET_HDR_F_DATA_VALID else ''}"
+            + f", gso {VNET_HDR_GSO_TABLE.get(self.gso_type, '???')}, hdr_len {self.hdr_len}, gso_size {self.gso_size}"
+            + f", csum_start {self.csum_start}, csum_offset {self.csum_offset}"
+        )
+
+    @property
+    def raw_header(self):
+        """ Header in raw format """
+
+        return VNET_HDR_STRUCT.pack(self.flags, self.gso_type, self.hdr_len, self.gso_size, self.csum_start, self.csum_offset)
+
+    @property
+    def cksum_verified(self):
+        """ Check if the packet checksum doesn't need to be validated, it has been either validated already or not computed at all by local sender """
+
+        return bool(self.flags & (VNET_HDR_F_NEEDS_CSUM | VNET_HDR_F_DATA_VALID))
+
+    def encapsulate(self, header_len):
+        """ Return copy of the header with offsets adjusted for packet being encapsulated into lower layer header of given length """
+
+        return VnetHdr(
+            flags=self.flags,
+            gso_type=self.gso_type,
+            hdr_len=self.hdr_len + header_len if self.hdr_len else 0,
+            gso_size=self.gso_size,
+            csum_start=self.csum_start + header_len if self.flags & VNET_HDR_F_NEEDS_CSUM else 0,
+            csum_offset=self.csum_offset,
+        )